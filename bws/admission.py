@@ -0,0 +1,364 @@
+"""
+Host-wide admission control for the Fortran model processes. The number of model processes
+running at once, across all the web-service worker processes on a host, is limited to a
+number of slots. Requests wait in a bounded queue for a free slot and are rejected with a
+503 when the queue is full.
+
+The queue is ordered shortest job first, by the estimated run time of the model runs (see
+L{bws.estimate}), so that cheap calculations are not held up by large pedigrees. To prevent
+starvation, a queued model run is brought forward by FORTRAN_QUEUE_AGING seconds of estimated
+run time for each second it waits, i.e. it is admitted in the order of its enqueue time plus its
+estimated run time divided by the aging rate.
+
+When the host is busy, the slots are shared between the API accounts (request.user) in
+proportion to their FORTRAN_SHARE_WEIGHTS (default 1), and equally between the end users
+(the user_id field) of an account, by weighted fair queuing. The estimated run time still to
+run of the model runs of an end user, both running and queued ahead of a model run, divided by
+their share, delays the model run as if it had been queued that much later. So an account
+sending a large batch does not take every slot from the others, and its model runs take their
+turn as the backlog of the others clears.
+
+The slot record of a model run also holds its threads and the CPUs it is pinned to, so that the
+model runs are spread across the cores and NUMA nodes of the host (see L{bws.placement}).
+"""
+from contextlib import contextmanager
+import fcntl
+import hashlib
+import logging
+import os
+import time
+import uuid
+
+from django.conf import settings
+
+from bws import placement
+from bws.exceptions import ServiceUnavailableException
+
+
+logger = logging.getLogger(__name__)
+
+
+class Ticket(object):
+    """
+    Place in the queue for a model slot. A ticket is a file in the queue directory that is
+    locked by its owner for as long as it is waiting, so tickets left by a worker that has
+    died can be identified and removed.
+    """
+
+    def __init__(self, name, path):
+        """
+        @param name: file name, i.e. the admission time, enqueue time (in nanoseconds), estimated
+        run time (in milliseconds), weight of the account (in thousandths) and the account and end
+        user identifiers, see L{SlotLimiter._enqueue}
+        @param path: file path
+        """
+        self.name = name
+        self.path = path
+        parts = name.split('-')
+        self.admit = int(parts[0]) / 1e9
+        self.enqueued = int(parts[1]) / 1e9
+        self.cost = int(parts[2]) / 1e3
+        self.weight = int(parts[3]) / 1e3
+        self.account = parts[4]
+        self.end_user = parts[5]
+        self.fair = self.admit      # admission time with the fair share delay, see L{SlotLimiter.tickets}
+
+    def rank(self):
+        """ Order in which tickets are admitted, lowest first. """
+        return (self.admit, self.enqueued)
+
+    def is_stale(self):
+        """ Return true if the owner of the ticket is no longer waiting. """
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+        except OSError:
+            return True
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+        finally:
+            os.close(fd)
+
+
+class SlotLimiter(object):
+    """
+    Limit the number of model processes run at once on the host. Each running process holds an
+    exclusive lock on one of the slot files, so the limit applies to all the worker processes
+    sharing the lock directory and a slot is freed even if its worker dies.
+    """
+
+    def __init__(self, lock_dir, nslots, queue_size, timeout, retry_after, aging=10, weights=None,
+                 poll_interval=0.05):
+        """
+        @param lock_dir: directory for the slot lock files and queue tickets
+        @param nslots: maximum number of model processes run at once
+        @param queue_size: maximum number of model runs waiting for a slot
+        @param timeout: maximum time in seconds to wait for a slot
+        @param retry_after: seconds a rejected client is asked to wait before retrying
+        @keyword aging: seconds of estimated run time a model run is brought forward for each second it
+        waits, 0 for no aging
+        @keyword weights: dictionary of the fair share weights of the accounts, default 1
+        @keyword poll_interval: seconds between checks for a free slot
+        """
+        self.lock_dir = lock_dir
+        self.queue_dir = os.path.join(lock_dir, "queue")
+        self.nslots = nslots
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.aging = aging
+        self.weights = {} if weights is None else weights
+        self.poll_interval = poll_interval
+        os.makedirs(self.queue_dir, exist_ok=True)
+
+    def slot_path(self, idx):
+        return os.path.join(self.lock_dir, "slot-" + str(idx) + ".lock")
+
+    def tickets(self):
+        """
+        Get the tickets waiting for a slot, removing those left by workers that are no longer waiting.
+        @return: list of tickets in the order they will be admitted
+        """
+        tickets = []
+        for name in os.listdir(self.queue_dir):
+            if not name.endswith(".ticket"):
+                continue
+            ticket = Ticket(name, os.path.join(self.queue_dir, name))
+            if ticket.is_stale() and time.time() - ticket.enqueued > 1:
+                try:
+                    os.remove(ticket.path)
+                except OSError:
+                    pass
+                continue
+            tickets.append(ticket)
+        return self._order(tickets)
+
+    def _order(self, tickets):
+        """
+        Order the tickets by their admission time delayed by the backlog of their end user divided
+        by their fair share of the slots.
+        @param tickets: tickets waiting for a slot
+        @return: list of the tickets in the order they will be admitted
+        """
+        end_users = {}
+        backlog = {}
+        for (account, end_user, remaining, _threads) in self._running():
+            end_users.setdefault(account, set()).add(end_user)
+            backlog[(account, end_user)] = backlog.get((account, end_user), 0) + remaining
+        for t in tickets:
+            end_users.setdefault(t.account, set()).add(t.end_user)
+
+        for t in sorted(tickets, key=lambda t: t.rank()):
+            tenant = (t.account, t.end_user)
+            share = t.weight / len(end_users[t.account])
+            ahead = backlog.get(tenant, 0)
+            t.fair = t.admit + ahead / share / self.aging if self.aging else (ahead + t.cost) / share
+            backlog[tenant] = ahead + t.cost
+        return sorted(tickets, key=lambda t: (t.fair, t.rank()))
+
+    def _records(self):
+        """
+        Get the records of the model runs holding a slot, i.e. their account, end user, estimated run
+        time, start time, threads and CPUs, see L{slot}.
+        @return: dictionary of the fields of the records by slot index
+        """
+        records = {}
+        for idx in range(self.nslots):
+            fd = os.open(self.slot_path(idx), os.O_RDWR | os.O_CREAT, 0o666)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                parts = os.pread(fd, 256, 0).decode("utf-8", "replace").split()
+                if len(parts) == 6:
+                    records[idx] = parts
+            finally:
+                os.close(fd)
+        return records
+
+    def _running(self):
+        """
+        Get the model runs holding a slot.
+        @return: list of the account and end user identifiers, estimated run time still to run and
+        number of threads of the model runs
+        """
+        running = []
+        now = time.time()
+        for parts in self._records().values():
+            try:
+                running.append((parts[0], parts[1], max(0.0, float(parts[2]) - (now - float(parts[3]))),
+                                int(parts[4])))
+            except ValueError:
+                pass
+        return running
+
+    def idle_cores(self):
+        """ Number of cores of the host not used by the threads of the model runs holding a slot. """
+        return (os.cpu_count() or 1) - sum(threads for (_a, _u, _r, threads) in self._running())
+
+    def set_threads(self, idx, threads, cpus=None):
+        """
+        Record the number of threads of the model run holding a slot, see L{idle_cores}.
+        @param idx: slot index
+        @param threads: number of threads
+        @keyword cpus: CPUs the model run is pinned to, None if it is not pinned
+        """
+        with open(self.slot_path(idx), "r+") as f:
+            parts = f.read().split()
+            if len(parts) == 6:
+                f.seek(0)
+                f.truncate()
+                f.write(" ".join(parts[:4] + [str(threads), placement.format_cpulist(cpus or [])]) + "\n")
+
+    def place(self, idx, threads, policy):
+        """
+        Record the threads of the model run holding a slot and choose its CPUs, away from the CPUs
+        of the other model runs, see L{bws.placement.get_cpus}. The choice is serialised between the
+        workers so that model runs started at the same time are not given the same CPUs.
+        @param idx: slot index
+        @param threads: number of threads of the model run
+        @param policy: placement policy, e.g. 'cores', or None to not pin the model run
+        @return: CPUs or None if the model run is not pinned
+        """
+        if policy is None:
+            self.set_threads(idx, threads)
+            return None
+        with open(os.path.join(self.lock_dir, "placement.lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            placed = []
+            for (i, parts) in self._records().items():
+                try:
+                    if i != idx and parts[5] != "-":
+                        placed.append((int(parts[4]), placement.parse_cpulist(parts[5])))
+                except ValueError:
+                    pass
+            cpus = placement.get_cpus(threads, placed, policy)
+            self.set_threads(idx, threads, cpus)
+        return cpus
+
+    def queue_depth(self):
+        """ Number of model runs waiting for a slot. """
+        return len(self.tickets())
+
+    def slots_in_use(self):
+        """ Number of slots held by running model processes. """
+        return self.nslots - len(self._free_slots())
+
+    def _free_slots(self):
+        """ Get the indices of the slots that are not locked. """
+        free = []
+        for idx in range(self.nslots):
+            fd = os.open(self.slot_path(idx), os.O_RDWR | os.O_CREAT, 0o666)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                free.append(idx)
+            except OSError:
+                pass
+            finally:
+                os.close(fd)
+        return free
+
+    def _lock_slot(self):
+        """ Try to lock a free slot.
+        @return: tuple of the slot index and locked file descriptor, or None if all the slots are in use
+        """
+        for idx in range(self.nslots):
+            fd = os.open(self.slot_path(idx), os.O_RDWR | os.O_CREAT, 0o666)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return (idx, fd)
+            except OSError:
+                os.close(fd)
+        return None
+
+    def _enqueue(self, cost, tenant):
+        """ Add a ticket to the queue.
+        @param cost: estimated run time in seconds
+        @param tenant: tuple of the account and end user
+        @return: tuple of the ticket and its locked file descriptor
+        """
+        depth = self.queue_depth()
+        if depth >= self.queue_size:
+            logger.warning(f"MODEL QUEUE FULL: depth={depth}; slots={self.nslots}")
+            raise ServiceUnavailableException(wait=self.retry_after)
+
+        enqueued = time.time_ns()
+        # without aging, the model runs are admitted strictly in the order of their estimated run time
+        admit = enqueued + int(cost / self.aging * 1e9) if self.aging else int(cost * 1e9)
+        weight = max(float(self.weights.get(tenant[0], 1)), 0.001)
+        name = "%020d-%020d-%d-%d-%s-%s-%s.ticket" % (admit, enqueued, int(cost * 1e3), int(weight * 1e3),
+                                                      get_tenant_id(tenant[0]), get_tenant_id(tenant[1]),
+                                                      uuid.uuid4().hex)
+        path = os.path.join(self.queue_dir, name)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o666)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        if depth > 0:
+            logger.info(f"MODEL QUEUE: depth={depth+1}; estimated time={cost:.3f}; "
+                        f"user={tenant[0]}; user_id={tenant[1]}")
+        return (Ticket(name, path), fd)
+
+    @contextmanager
+    def slot(self, cost=None, tenant=("", "")):
+        """
+        Wait for a free slot to run a model process in.
+        @keyword cost: estimated run time of the model run in seconds, see L{bws.estimate}, None or 0 to
+        be admitted in the order the model runs were queued
+        @keyword tenant: tuple of the account and end user the model run is for
+        @return: slot index
+        """
+        cost = max(0.0, min(float(cost or 0), 1e6))
+        (ticket, ticket_fd) = self._enqueue(cost, tenant)
+        locked = None
+        start = time.time()
+        try:
+            while locked is None:
+                names = [t.name for t in self.tickets()]
+                ahead = names.index(ticket.name) if ticket.name in names else 0
+                if ahead < len(self._free_slots()):
+                    locked = self._lock_slot()
+                if locked is None:
+                    if time.time() - start > self.timeout:
+                        logger.warning(f"MODEL QUEUE TIMED OUT: waited={time.time() - start}; "
+                                       f"estimated time={cost:.3f}")
+                        raise ServiceUnavailableException(wait=self.retry_after)
+                    time.sleep(self.poll_interval)
+        finally:
+            try:
+                os.remove(ticket.path)
+            except OSError:
+                pass
+            os.close(ticket_fd)
+
+        (idx, slot_fd) = locked
+        # record the model run holding the slot for the fair share of the others, see L{_running}
+        os.ftruncate(slot_fd, 0)
+        os.pwrite(slot_fd, ("%s %s %f %f 1 -\n" % (ticket.account, ticket.end_user, cost, time.time())).encode(), 0)
+        try:
+            yield idx
+        finally:
+            os.close(slot_fd)
+
+
+_limiter = None
+
+
+def get_tenant_id(name):
+    """
+    Get the identifier of an account or end user used in the queue and slot files.
+    @param name: account or end user name
+    @return: identifier
+    """
+    return hashlib.sha256(str(name).encode("utf-8")).hexdigest()[:12]
+
+
+def get_limiter():
+    """ Get the slot limiter configured in the settings. """
+    global _limiter
+    args = (settings.FORTRAN_LOCK_DIR, settings.FORTRAN_MAX_PROCESSES, settings.FORTRAN_QUEUE_SIZE,
+            settings.FORTRAN_QUEUE_TIMEOUT, settings.FORTRAN_RETRY_AFTER, settings.FORTRAN_QUEUE_AGING,
+            settings.FORTRAN_SHARE_WEIGHTS)
+    if _limiter is None or _limiter.args != args:
+        _limiter = SlotLimiter(*args)
+        _limiter.args = args
+    return _limiter
@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class BwsConfig(AppConfig):
+    name = 'bws'
+
+    def ready(self):
+        from bws import checks  # noqa: F401 register the system checks
@@ -0,0 +1,175 @@
+"""
+Precomputed population baseline cancer risks. The baseline risks (see
+L{bws.calcs.RemainingLifetimeBaselineRisk} and L{bws.calcs.RangeRiskBaseline}) are for a woman
+with no family history, genetic tests or risk factors, so depend only on her year of birth, age
+and age at breast cancer diagnosis for a given model parameters file and cancer incidence rates.
+The tables are built by the 'build_baseline_tables' management command and stored in
+BASELINE_TABLES_DIR with a directory for each parameters file and cancer incidence rates:
+  - meta.json:          model version the risks were calculated with and the number of rows
+  - <calc>_keys.npy:    sorted row keys, see L{get_key}
+  - <calc>_risks.npy:   risks for each row at each age (column), NaN for the ages not calculated
+The arrays are memory mapped, so a lookup is a binary search that only reads the pages it needs.
+"""
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+CALCS = ["remaining_lifetime", "lifetime", "ten_year"]
+NAGES = settings.MAX_AGE_FOR_RISK_CALCS + 2     # columns for the risks at ages 0 to 80
+
+_TABLES = {}    # loaded tables by name, see L{get_table}
+
+
+def get_key(yob, age, diagnosis_age="0"):
+    """
+    Get the row key for a woman.
+    @param yob: year of birth
+    @param age: age at last follow up
+    @keyword diagnosis_age: age at breast cancer diagnosis, '0' if unaffected
+    @return: row key or None if a value is not a number
+    """
+    values = [str(yob), str(age), str(diagnosis_age)]
+    if not all(v.isdigit() for v in values):
+        return None
+    yob, age, diagnosis_age = [int(v) for v in values]
+    if age >= 1000 or diagnosis_age >= 1000:
+        return None
+    return (yob * 1000 + age) * 1000 + diagnosis_age
+
+
+def get_table_name(params, cancer_rates):
+    """
+    Get the name of the table for a model parameters file and cancer incidence rates.
+    @param params: model parameters file path, see L{bws.calcs.get_param_file}
+    @param cancer_rates: cancer incidence rates file name, e.g. 'UK'
+    @return: table name
+    """
+    return os.path.splitext(os.path.basename(params))[0] + "_" + cancer_rates
+
+
+class BaselineTable(object):
+    """ Memory mapped baseline risk table. """
+
+    def __init__(self, path):
+        """
+        @param path: table directory
+        """
+        with open(os.path.join(path, "meta.json"), "r") as f:
+            self.meta = json.load(f)
+        self.version = self.meta["version"]
+        self.warned = False
+        self.keys = {}
+        self.risks = {}
+        for calc in CALCS:
+            keys_file = os.path.join(path, calc + "_keys.npy")
+            if os.path.exists(keys_file):
+                self.keys[calc] = np.load(keys_file, mmap_mode='r')
+                self.risks[calc] = np.load(os.path.join(path, calc + "_risks.npy"), mmap_mode='r')
+
+    def get(self, calc, key):
+        """
+        Get the risks for a row.
+        @param calc: calculation, e.g. 'remaining_lifetime'
+        @param key: row key, see L{get_key}
+        @return: list of the (age, risk) or None if the row is not in the table
+        """
+        keys = self.keys.get(calc)
+        if keys is None or len(keys) == 0:
+            return None
+        idx = int(np.searchsorted(keys, key))
+        if idx >= len(keys) or keys[idx] != key:
+            return None
+        row = self.risks[calc][idx]
+        return [(age, float(row[age])) for age in np.flatnonzero(~np.isnan(row)).tolist()]
+
+    @classmethod
+    def write(cls, path, meta, rows):
+        """
+        Write a table, replacing any existing table.
+        @param path: table directory
+        @param meta: table metadata, must include the model version
+        @param rows: dictionary of the calculation to a dictionary of the row key to a list of the (age, risk)
+        """
+        parent = os.path.dirname(path)
+        os.makedirs(parent, exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix=".tmp_", dir=parent)
+        try:
+            meta = dict(meta, rows={})
+            for calc, calc_rows in rows.items():
+                keys = np.array(sorted(calc_rows.keys()), dtype=np.int64)
+                risks = np.full((len(keys), NAGES), np.nan, dtype=np.float64)
+                for idx, key in enumerate(keys.tolist()):
+                    for age, risk in calc_rows[key]:
+                        risks[idx, age] = risk
+                np.save(os.path.join(tmp, calc + "_keys.npy"), keys)
+                np.save(os.path.join(tmp, calc + "_risks.npy"), risks)
+                meta["rows"][calc] = len(keys)
+            with open(os.path.join(tmp, "meta.json"), "w") as f:
+                json.dump(meta, f, indent=2)
+            os.chmod(tmp, 0o755)
+
+            # swap the directories, a lookup in between finds no table and runs the model
+            old = None
+            if os.path.exists(path):
+                old = tempfile.mkdtemp(prefix=".old_", dir=parent)
+                os.replace(path, os.path.join(old, "table"))
+            os.replace(tmp, path)
+            if old is not None:
+                shutil.rmtree(old)
+        except Exception:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+
+
+def get_table(name):
+    """
+    Get a table, reloading it if it has been rebuilt.
+    @param name: table name, see L{get_table_name}
+    @return: L{BaselineTable} or None if there is no table
+    """
+    path = os.path.join(settings.BASELINE_TABLES_DIR, name)
+    try:
+        mtime = os.stat(os.path.join(path, "meta.json")).st_mtime_ns
+    except OSError:
+        return None
+    cached = _TABLES.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    try:
+        table = BaselineTable(path)
+    except (OSError, ValueError, KeyError) as e:
+        logger.error("BASELINE TABLE NOT LOADED: " + path + " " + str(e))
+        return None
+    _TABLES[path] = (mtime, table)
+    return table
+
+
+def get_risks(name, version, calc, key):
+    """
+    Look up precomputed baseline risks.
+    @param name: table name, see L{get_table_name}
+    @param version: model version, the table is only used if it was built with this version
+    @param calc: calculation, e.g. 'remaining_lifetime'
+    @param key: row key, see L{get_key}
+    @return: list of the (age, risk) or None if they are not in a table
+    """
+    if settings.BASELINE_TABLES_DIR is None or key is None:
+        return None
+    table = get_table(name)
+    if table is None:
+        return None
+    if table.version != version:
+        if not table.warned:
+            logger.warning("BASELINE TABLE " + name + " BUILT WITH MODEL VERSION " + str(table.version) +
+                           " NOT " + str(version))
+            table.warned = True
+        return None
+    return table.get(calc, key)
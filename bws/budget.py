@@ -0,0 +1,193 @@
+"""
+Resource budgets for the model processes. Each model process is given the budget of the first
+tier in FORTRAN_BUDGETS for pedigrees as large as its pedigree, with limits of:
+  - address_space: virtual memory in bytes (RLIMIT_AS)
+  - cpu_time:      CPU time in seconds used by all its threads (RLIMIT_CPU), for each thread
+                   once the threads are chosen by L{Budget.adapt_threads}
+  - open_files:    number of open files (RLIMIT_NOFILE)
+  - threads:       maximum number of OpenMP and OpenBLAS threads, see L{Budget.adapt_threads}
+  - memory:        cgroup v2 memory.max in bytes
+  - cpu_max:       cgroup v2 cpu.max, e.g. '200000 100000' for two CPUs
+The cgroup limits are only applied if FORTRAN_CGROUP is a cgroup v2 directory in which the
+workers can create a cgroup for each model process. A model process that exceeds its budget
+raises L{bws.exceptions.ResourceLimitException}.
+"""
+import logging
+import os
+import re
+import resource
+import shlex
+import signal
+import uuid
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+REGEX_MEMORY_ERROR = re.compile("(memory|allocat)", re.IGNORECASE)
+REGEX_OPEN_FILES_ERROR = re.compile("too many open files", re.IGNORECASE)
+
+
+class Budget(object):
+    """ Resource limits of a model process. """
+    # name, resource, shell ulimit option and the size of its unit
+    RLIMITS = [("address_space", resource.RLIMIT_AS, "v", 1024), ("cpu_time", resource.RLIMIT_CPU, "t", 1),
+               ("open_files", resource.RLIMIT_NOFILE, "n", 1)]
+
+    def __init__(self, address_space=None, cpu_time=None, open_files=None, threads=None, memory=None, cpu_max=None):
+        """
+        @keyword address_space: maximum virtual memory in bytes
+        @keyword cpu_time: maximum CPU time in seconds
+        @keyword open_files: maximum number of open files
+        @keyword threads: number of OpenMP and OpenBLAS threads
+        @keyword memory: maximum memory of the cgroup in bytes
+        @keyword cpu_max: cgroup CPU bandwidth limit, '$MAX $PERIOD' in microseconds
+        """
+        self.address_space = address_space
+        self.cpu_time = cpu_time
+        self.thread_cpu_time = cpu_time
+        self.open_files = open_files
+        self.threads = threads
+        self.memory = memory
+        self.cpu_max = cpu_max
+        self.cgroup = None
+
+    @classmethod
+    def factory(cls, npeople=None):
+        """
+        Get the budget for a pedigree.
+        @keyword npeople: number of people in the pedigree, None for the largest budget
+        @return: L{Budget}
+        """
+        tiers = settings.FORTRAN_BUDGETS
+        if len(tiers) == 0:
+            return cls()
+        for (max_people, budget) in tiers:
+            if npeople is not None and npeople <= max_people:
+                return cls(**budget)
+        return cls(**tiers[-1][1])
+
+    def adapt_threads(self, cost, idle_cores):
+        """
+        Choose the number of OpenMP and OpenBLAS threads of the model process, one for each
+        FORTRAN_THREADS_COST seconds of its estimated run time up to the number of idle cores,
+        FORTRAN_MAX_THREADS and the threads of the budget. So small model runs, and all the model
+        runs when the host is busy, are single threaded. The CPU time limit, which is of the CPU
+        time of all the threads, is scaled by the number of threads so that a multi-threaded model
+        run is given the same run time before it is stopped.
+        @param cost: estimated run time in seconds or None if not estimated
+        @param idle_cores: number of cores not used by the other model processes
+        @return: number of threads
+        """
+        limit = settings.FORTRAN_MAX_THREADS
+        if self.threads is not None:
+            limit = min(self.threads, limit)
+        threads = int((cost or 0) // settings.FORTRAN_THREADS_COST) if settings.FORTRAN_THREADS_COST else limit
+        self.threads = max(1, min(threads, limit, idle_cores))
+        if self.thread_cpu_time is not None:
+            self.cpu_time = self.thread_cpu_time * self.threads
+        return self.threads
+
+    def get_env(self, env):
+        """
+        Get the environment of the model process.
+        @param env: environment variables
+        @return: environment variables with the number of threads set
+        """
+        if self.threads is None:
+            return env
+        return dict(env, OMP_NUM_THREADS=str(self.threads), OPENBLAS_NUM_THREADS=str(self.threads))
+
+    def get_command(self, cmd):
+        """
+        Get the command line that starts the model with the resource limits and in its cgroup.
+        The limits are set by a shell that then execs the model, so that no Python code is run
+        in the child and the worker can start it with vfork/posix_spawn rather than fork, which
+        copies the page tables of the worker. See L{bws.calcs.ModelProcess} for the priority.
+        @param cmd: model command line
+        @return: command line
+        """
+        lines = []
+        if self.cgroup is not None:
+            lines.append("echo $$ > " + shlex.quote(os.path.join(self.cgroup, "cgroup.procs")))
+        # stack as large as allowed, unlimited by default
+        hard = resource.getrlimit(resource.RLIMIT_STACK)[1]
+        lines.append("ulimit -S -s " + ("unlimited" if hard == resource.RLIM_INFINITY else str(hard // 1024)))
+        grace = int(settings.FORTRAN_KILL_GRACE) + 1
+        for (name, rlimit, option, unit) in Budget.RLIMITS:
+            value = getattr(self, name)
+            if value is None:
+                continue
+            # CPU time limit sends SIGXCPU and then SIGKILL if it is ignored
+            limit = (value, value + grace if rlimit == resource.RLIMIT_CPU else value)
+            hard = resource.getrlimit(rlimit)[1]
+            if hard != resource.RLIM_INFINITY:
+                limit = (min(limit[0], hard), min(limit[1], hard))
+            lines.append("ulimit -S -%s %d" % (option, limit[0] // unit))
+            lines.append("ulimit -H -%s %d" % (option, limit[1] // unit))
+        return ["/bin/sh", "-c", "set -e; " + "; ".join(lines) + '; exec "$@"', "sh"] + list(cmd)
+
+    def create_cgroup(self):
+        """
+        Create a cgroup with the memory and CPU limits for the model process, if they are set
+        and FORTRAN_CGROUP is available.
+        @return: cgroup directory or None
+        """
+        if settings.FORTRAN_CGROUP is None or (self.memory is None and self.cpu_max is None):
+            return None
+        path = os.path.join(settings.FORTRAN_CGROUP, "bws-" + uuid.uuid4().hex)
+        try:
+            os.mkdir(path)
+            for (name, value) in (("memory.max", self.memory), ("memory.swap.max", 0 if self.memory else None),
+                                  ("cpu.max", self.cpu_max)):
+                if value is not None:
+                    with open(os.path.join(path, name), "w") as f:
+                        f.write(str(value))
+        except OSError as e:
+            logger.warning("MODEL CGROUP NOT CREATED: " + str(e))
+            self.cgroup = path if os.path.isdir(path) else None
+            self.remove_cgroup()
+            return None
+        self.cgroup = path
+        return path
+
+    def remove_cgroup(self):
+        """ Remove the cgroup of the model process, after the process has exited. """
+        if self.cgroup is None:
+            return
+        try:
+            os.rmdir(self.cgroup)
+        except OSError as e:
+            logger.warning("MODEL CGROUP NOT REMOVED: " + str(e))
+        self.cgroup = None
+
+    def get_breach(self, returncode, rusage, errs):
+        """
+        Get the resource limit a model process that failed exceeded.
+        @param returncode: model process exit code, negative for the signal that killed it
+        @param rusage: resource usage of the process or None if not available
+        @param errs: model process standard error
+        @return: name of the limit, e.g. 'cpu_time', or None if it did not exceed a limit
+        """
+        if returncode == 0:
+            return None
+        if self.cpu_time is not None:
+            if returncode == -signal.SIGXCPU:
+                return "cpu_time"
+            if (returncode == -signal.SIGKILL and rusage is not None and
+                    rusage.ru_utime + rusage.ru_stime >= self.cpu_time):
+                return "cpu_time"
+        if self.cgroup is not None and self.memory is not None:
+            try:
+                with open(os.path.join(self.cgroup, "memory.events"), "r") as f:
+                    events = dict(line.split() for line in f if len(line.split()) == 2)
+                if int(events.get("oom_kill", 0)) > 0 or int(events.get("max", 0)) > 0:
+                    return "memory"
+            except (OSError, ValueError):
+                pass
+        if self.address_space is not None and REGEX_MEMORY_ERROR.search(errs):
+            return "address_space"
+        if self.open_files is not None and REGEX_OPEN_FILES_ERROR.search(errs):
+            return "open_files"
+        return None
@@ -2,9 +2,10 @@
 see https://github.com/CCGE-BOADICEA/boadicea/wiki/Cancer-Risk-Calculations"""
 from collections import OrderedDict
 from copy import deepcopy
+import hashlib
 import logging
 import os
-import resource
+import signal
 from subprocess import Popen, PIPE, TimeoutExpired
 import tempfile
 import time
@@ -14,9 +15,12 @@ from django.http.request import HttpRequest
 from rest_framework.exceptions import ValidationError, NotAcceptable
 from rest_framework.request import Request
 
-from bws import pedigree
+from bws import pedigree, metrics, baseline, estimate, placement, watchdog
+from bws.admission import get_limiter
+from bws.budget import Budget
 from bws.cancer import Cancer, Cancers, CanRiskGeneticTests, BWSGeneticTests
-from bws.exceptions import TimeOutException, ModelError
+from bws.coalesce import get_single_flight, SingleFlight
+from bws.exceptions import TimeOutException, ModelError, ServiceUnavailableException, ResourceLimitException
 from bws.pedigree import Male, Female, BwaPedigree, CanRiskPedigree
 import re
 
@@ -24,6 +28,115 @@ import re
 logger = logging.getLogger(__name__)
 
 REGEX_ALPHANUM_COMMAS = re.compile("^([\\w,]+)$")
+# current age and age to which risk is calculated for the lifetime and ten year range risks
+RISK_RANGES = {"lifetime": (20, 80), "ten_year": (40, 50)}
+
+
+class ModelProcess(Popen):
+    """
+    Model process that records its resource usage (CPU time, maximum resident set size, page
+    faults and context switches) when it is waited for. Unlike getrusage(RUSAGE_CHILDREN), this
+    is the usage of this process alone when other threads are also running model processes.
+    The process is started in a new session (and so process group) so that it can be killed
+    with any processes it starts, and is marked with the pid of this worker for the watchdog,
+    see L{bws.watchdog}. Its priority is lowered, and it is pinned to its CPUs (see
+    L{bws.placement}), by the worker after it is started, rather than with a preexec_fn, so
+    that it is started without forking the worker (see L{bws.budget.Budget.get_command}).
+    """
+    rusage = None
+
+    def __init__(self, args, niceness=0, cpus=None, **kwargs):
+        """
+        @param args: command line
+        @keyword niceness: niceness value added to that of the worker
+        @keyword cpus: CPUs the process is pinned to, None to not pin it
+        """
+        env = dict(kwargs.get("env") or os.environ)
+        env[watchdog.OWNER_ENV] = str(os.getpid())
+        kwargs["env"] = env
+        kwargs.setdefault("start_new_session", True)
+        super().__init__(args, **kwargs)
+        if niceness > 0:
+            try:
+                priority = min(os.getpriority(os.PRIO_PROCESS, 0) + niceness, 19)
+                os.setpriority(os.PRIO_PROCESS, self.pid, priority)
+            except OSError:
+                pass    # exited
+        placement.set_affinity(self.pid, cpus)
+
+    def kill_group(self, grace=None):
+        """
+        Kill the process and the processes it started, i.e. its process group. The group is sent
+        SIGTERM and then SIGKILL if the process has not exited after the grace period, or if it
+        has exited to kill any processes left in the group. The process is always waited for so
+        that it does not become a zombie.
+        @keyword grace: seconds between SIGTERM and SIGKILL, default FORTRAN_KILL_GRACE
+        """
+        if self.returncode is not None:
+            return
+        grace = settings.FORTRAN_KILL_GRACE if grace is None else grace
+        try:
+            os.killpg(self.pid, signal.SIGTERM)
+            deadline = time.time() + grace
+            # wait without reaping the process so that its pid still identifies the group
+            while (time.time() < deadline and
+                   os.waitid(os.P_PID, self.pid, os.WEXITED | os.WNOHANG | os.WNOWAIT) is None):
+                time.sleep(0.01)
+            os.killpg(self.pid, signal.SIGKILL)
+        except (ProcessLookupError, ChildProcessError):
+            pass
+        for f in (self.stdin, self.stdout, self.stderr):
+            if f is not None:
+                f.close()
+        self.wait()
+
+    def _try_wait(self, wait_flags):
+        """ Wait for the process with os.wait4 rather than os.waitpid to get its resource usage. """
+        try:
+            (pid, sts, rusage) = os.wait4(self.pid, wait_flags)
+        except ChildProcessError:
+            # the process has already been waited for, e.g. if SIGCHLD is ignored
+            return (self.pid, 0)
+        if pid == self.pid:
+            self.rusage = rusage
+        return (pid, sts)
+
+
+def get_param_file(model_settings, mutation_freq, sensitivity, isashk=False, cwd=None):
+    """
+    Get the model parameters file for the given settings. The files for the population mutation
+    frequencies and the default genetic test sensitivities are shared by all the model runs. They
+    are stored in PARAMS_DIR named by a hash of their content and only written if they do not
+    already exist. The files for custom settings are written to the working directory of the
+    request, so that they are removed with it.
+    @param model_settings: model settings
+    @param mutation_freq: mutation frequencies
+    @param sensitivity: genetic test sensitivity
+    @keyword isashk: true if AJ
+    @keyword cwd: working directory for the file of custom settings
+    @return: path to the model parameters file
+    """
+    shared = (sensitivity == model_settings['GENETIC_TEST_SENSITIVITY'] and
+              any(mutation_freq == mf for mf in model_settings['MUTATION_FREQUENCIES'].values()))
+    if shared:
+        dirname = settings.PARAMS_DIR
+    elif cwd is not None:
+        dirname = cwd
+    else:
+        raise ValueError("A working directory is required for custom model parameters")
+    content = pedigree.Pedigree.get_param_file_content(model_settings=model_settings, mutation_freq=mutation_freq,
+                                                       sensitivity=sensitivity, isashk=isashk)
+    digest = hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+    filepath = os.path.join(dirname, model_settings['NAME'] + "_" + digest + ".params")
+    if not os.path.exists(filepath):
+        os.makedirs(dirname, exist_ok=True)
+        # write to a temporary file and rename it so that a partially written file is never read
+        (fd, tmp) = tempfile.mkstemp(suffix=".tmp", dir=dirname)
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, filepath)
+    return filepath
 
 
 class ModelParams():
@@ -83,6 +196,7 @@ class Risk(object):
         assert isinstance(predictions, Predictions), "%r is not a Predictions" % predictions
         self.predictions = predictions
         self.risk_age = None    # if none uses the default ages to calculate risk at
+        self.calc = "remaining_lifetime"    # calculation type used to label metrics
 
     def _get_pedi(self):
         """
@@ -126,9 +240,10 @@ class Risk(object):
         """ Returns the type of risk as the class name. """
         return self.__class__.__name__
 
-    def get_risk(self):
+    def get_risk(self, precomputed=True):
         """
         Calculate the risk and return the parsed output as a list.
+        @keyword precomputed: use the precomputed risks if available, see L{_get_precomputed_risk}
         @return: list of risks for each age
         """
         pedi = self._get_pedi()
@@ -136,28 +251,89 @@ class Risk(object):
         if t.dead == "1":   # risk not calculated for deceased indivual's
             return None
 
+        if precomputed:
+            risks = self._get_precomputed_risk(pedi)
+            if risks is not None:
+                return risks
+
         pred = self.predictions
-        ped_file = pedi.write_pedigree_file(file_type=pedigree.CANCER_RISKS,
-                                            risk_factor_code=self._get_risk_factor_code(),
-                                            hgt=self._get_hgt(),
-                                            prs=self._get_prs(),
-                                            filepath=os.path.join(pred.cwd, self._type()+"_risk.ped"),
-                                            model_settings=pred.model_settings)
-        bat_file = pedi.write_batch_file(pedigree.CANCER_RISKS, ped_file,
-                                         filepath=os.path.join(pred.cwd, self._type()+"_risk.bat"),
-                                         model_settings=pred.model_settings,
-                                         calc_ages=self.risk_age)
-        params = pedi.write_param_file(filepath=os.path.join(pred.cwd, self._type()+"_risk.params"),
-                                       model_settings=pred.model_settings,
-                                       mutation_freq=self._get_mutation_frequency(),
-                                       isashk=pred.model_params.isashk,
-                                       sensitivity=pred.model_params.mutation_sensitivity)
+        labels = (pred.model_settings['NAME'], self.calc, len(pedi.people))
+        with metrics.Timer("write_files", *labels):
+            ped_file = pedi.write_pedigree_file(file_type=pedigree.CANCER_RISKS,
+                                                risk_factor_code=self._get_risk_factor_code(),
+                                                hgt=self._get_hgt(),
+                                                prs=self._get_prs(),
+                                                filepath=os.path.join(pred.cwd, self._type()+"_risk.ped"),
+                                                model_settings=pred.model_settings)
+            bat_file = pedi.write_batch_file(pedigree.CANCER_RISKS, ped_file,
+                                             filepath=os.path.join(pred.cwd, self._type()+"_risk.bat"),
+                                             model_settings=pred.model_settings,
+                                             calc_ages=self.risk_age)
+            params = self._get_param_file()
         risks = Predictions.run(self.predictions.request, pedigree.CANCER_RISKS, bat_file,
                                 params=params,
                                 cancer_rates=pred.model_params.cancer_rates, cwd=pred.cwd,
                                 niceness=pred.niceness, name=self._get_name(),
-                                model=pred.model_settings)
-        return self._parse_risks_output(risks)
+                                model=pred.model_settings, calc=self.calc, npeople=len(pedi.people),
+                                features=estimate.get_features(pedi, pred.model_settings))
+        with metrics.Timer("parse_output", *labels):
+            return self._parse_risks_output(risks)
+
+    def _get_param_file(self):
+        """
+        Get the model parameters file.
+        @return: path to the model parameters file
+        """
+        pred = self.predictions
+        return get_param_file(pred.model_settings, self._get_mutation_frequency(),
+                              pred.model_params.mutation_sensitivity, isashk=pred.model_params.isashk, cwd=pred.cwd)
+
+    def _get_precomputed_risk(self, pedi):
+        """
+        Get precomputed risks instead of running the model.
+        @param pedi: L{Pedigree} used in the risk calculation
+        @return: list of risks for each age or None if the risks are to be calculated
+        """
+        return None
+
+    def _get_baseline_table_risk(self, pedi):
+        """
+        Get the risks from the precomputed baseline risk tables, see L{bws.baseline}. The tables
+        are for a woman without genetic tests, risk factors or cancers other than breast cancer.
+        @param pedi: single person L{Pedigree} used in the baseline risk calculation
+        @return: list of risks for each age or None if they are not in a table
+        """
+        if settings.BASELINE_TABLES_DIR is None:
+            return None
+        t = pedi.get_target()
+        d = t.cancers.diagnoses
+        if (t.sex() != "F" or len(pedi.people) != 1 or
+           any(getattr(d, c).age != "-1" for c in d._fields if c != "bc1")):
+            return None
+
+        pred = self.predictions
+        name = baseline.get_table_name(self._get_param_file(), pred.model_params.cancer_rates)
+        key = baseline.get_key(t.yob, t.age, "0" if d.bc1.age == "-1" else d.bc1.age)
+        risks = baseline.get_risks(name, getattr(pred, 'version', None), self.calc, key)
+        metrics.observe_baseline_table(pred.model_settings['NAME'], self._get_name(), risks is not None)
+        return None if risks is None else self._format_risks(risks)
+
+    def _format_risks(self, risks):
+        """
+        Format the cancer risk results.
+        @param risks: list of the (age, risk)
+        @return: list of containing dictionaries of the risk results for each age
+        """
+        ctype = "breast" if self.predictions.model_settings['NAME'] == 'BC' else "ovarian"
+        return [
+            OrderedDict([
+                ("age", age),
+                (ctype+" cancer risk", {
+                    "decimal": risk,
+                    "percent": round(risk*100, 1)
+                })
+            ]) for age, risk in risks
+        ]
 
     def _parse_risks_output(self, risks):
         """
@@ -174,17 +350,9 @@ class Risk(object):
                 pass
             elif not line.startswith('#'):
                 parts = line.split(sep=",")
-                ctype = "breast" if self.predictions.model_settings['NAME'] == 'BC' else "ovarian"
-
-                risks_arr.append(OrderedDict([
-                    ("age", int(parts[0])),
-                    (ctype+" cancer risk", {
-                        "decimal": float(parts[1]),
-                        "percent": round(float(parts[1])*100, 1)
-                    })
-                ]))
+                risks_arr.append((int(parts[0]), float(parts[1])))
 
-        return risks_arr
+        return self._format_risks(risks_arr)
 
 
 class RemainingLifetimeRisk(Risk):
@@ -236,6 +404,9 @@ class RemainingLifetimeBaselineRisk(Risk):
     def _get_prs(self):
         return None
 
+    def _get_precomputed_risk(self, pedi):
+        return self._get_baseline_table_risk(pedi)
+
     def _get_name(self):
         return "REMAINING LIFETIME BASELINE"
 
@@ -259,12 +430,13 @@ class RangeRisk(Risk):
         self.current_age = current_age
         self.risk_age = risk_age
         self.name = name
+        self.calc = "lifetime" if risk_age - current_age > 10 else "ten_year"
 
-    def get_risk(self):
+    def get_risk(self, precomputed=True):
         t = self.predictions.pedi.get_target()
         if t.cancers.is_cancer_diagnosed():   # not calculated for affected indivual's
             return None
-        return super().get_risk()
+        return super().get_risk(precomputed=precomputed)
 
     def _get_pedi(self):
         new_pedi = deepcopy(self.predictions.pedi)
@@ -311,6 +483,9 @@ class RangeRiskBaseline(RangeRisk):
     def _get_prs(self):
         return None
 
+    def _get_precomputed_risk(self, pedi):
+        return self._get_baseline_table_risk(pedi)
+
 
 class Predictions(object):
 
@@ -362,27 +537,31 @@ class Predictions(object):
         ''' Run risk and mutation probability calculations '''
         self.version = Predictions.get_version(model=self.model_settings, cwd=self.cwd)
         self.niceness = Predictions._get_niceness(self.pedi)
+        self.estimates = estimate.get_estimate(self.pedi, self.model_settings, self.calcs)
         start = time.time()
         # mutation probability calculation
         if self.pedi.is_carrier_probs_viable() and self.is_calculate('carrier_probs'):
-            ped_file = self.pedi.write_pedigree_file(file_type=pedigree.MUTATION_PROBS,
-                                                     risk_factor_code=self.risk_factor_code,
-                                                     hgt=self.hgt,
-                                                     prs=self.prs,
-                                                     filepath=os.path.join(self.cwd, "test_prob.ped"),
-                                                     model_settings=self.model_settings)
-            bat_file = self.pedi.write_batch_file(pedigree.MUTATION_PROBS, ped_file,
-                                                  filepath=os.path.join(self.cwd, "test_prob.bat"),
-                                                  model_settings=self.model_settings)
-            params = self.pedi.write_param_file(filepath=os.path.join(self.cwd, "test_prob.params"),
-                                                model_settings=self.model_settings,
-                                                mutation_freq=self.model_params.mutation_frequency,
-                                                isashk=self.model_params.isashk,
-                                                sensitivity=self.model_params.mutation_sensitivity)
+            labels = (self.model_settings['NAME'], 'carrier_probs', len(self.pedi.people))
+            with metrics.Timer("write_files", *labels):
+                ped_file = self.pedi.write_pedigree_file(file_type=pedigree.MUTATION_PROBS,
+                                                         risk_factor_code=self.risk_factor_code,
+                                                         hgt=self.hgt,
+                                                         prs=self.prs,
+                                                         filepath=os.path.join(self.cwd, "test_prob.ped"),
+                                                         model_settings=self.model_settings)
+                bat_file = self.pedi.write_batch_file(pedigree.MUTATION_PROBS, ped_file,
+                                                      filepath=os.path.join(self.cwd, "test_prob.bat"),
+                                                      model_settings=self.model_settings)
+                params = get_param_file(self.model_settings, self.model_params.mutation_frequency,
+                                        self.model_params.mutation_sensitivity, isashk=self.model_params.isashk,
+                                        cwd=self.cwd)
             probs = self.run(self.request, pedigree.MUTATION_PROBS, bat_file, params=params,
                              cancer_rates=self.model_params.cancer_rates,
-                             cwd=self.cwd, niceness=self.niceness, model=self.model_settings)
-            self.mutation_probabilties = self._parse_probs_output(probs, self.model_settings)
+                             cwd=self.cwd, niceness=self.niceness, model=self.model_settings,
+                             calc='carrier_probs', npeople=len(self.pedi.people),
+                             features=estimate.get_features(self.pedi, self.model_settings))
+            with metrics.Timer("parse_output", *labels):
+                self.mutation_probabilties = self._parse_probs_output(probs, self.model_settings)
 
         # cancer risk calculation
         if self.pedi.is_risks_calc_viable():
@@ -393,21 +572,24 @@ class Predictions(object):
 
             # lifetime risk
             if self.is_calculate("lifetime"):
-                self.lifetime_cancer_risk = RangeRisk(self, 20, 80, "LIFETIME").get_risk()
+                self.lifetime_cancer_risk = RangeRisk(self, *RISK_RANGES["lifetime"], "LIFETIME").get_risk()
                 if self.lifetime_cancer_risk is not None:
-                    self.baseline_lifetime_cancer_risk = RangeRiskBaseline(self, 20, 80, "LIFETIME BASELINE").get_risk()
+                    self.baseline_lifetime_cancer_risk = \
+                        RangeRiskBaseline(self, *RISK_RANGES["lifetime"], "LIFETIME BASELINE").get_risk()
 
             # ten year risk
             if self.is_calculate("ten_year"):
-                self.ten_yr_cancer_risk = RangeRisk(self, 40, 50, "10 YR RANGE").get_risk()
+                self.ten_yr_cancer_risk = RangeRisk(self, *RISK_RANGES["ten_year"], "10 YR RANGE").get_risk()
                 if self.ten_yr_cancer_risk is not None:
-                    self.baseline_ten_yr_cancer_risk = RangeRiskBaseline(self, 40, 50, "10YR RANGE BASELINE").get_risk()
+                    self.baseline_ten_yr_cancer_risk = \
+                        RangeRiskBaseline(self, *RISK_RANGES["ten_year"], "10YR RANGE BASELINE").get_risk()
 
         name = str(self.model_settings.get('NAME', ""))
         logger.info(
             f"{name} CALCULATIONS: user={self.request.user.id}; "
             f"elapsed time={time.time() - start}; "
             f"pedigree size={len(self.pedi.people)}; "
+            f"estimated time={sum(self.estimates.values())}; "
             f"version={getattr(self, 'version', 'N/A')}")
 
     @classmethod
@@ -438,15 +620,18 @@ class Predictions(object):
         @keyword cwd: working directory
         """
         try:
-            process = Popen(
+            process = ModelProcess(
                 [os.path.join(model['HOME'], model['EXE']), "-v"],
                 cwd=cwd,
                 stdout=PIPE,
                 stderr=PIPE,
                 env=settings.FORTRAN_ENV)
 
-            (outs, errs) = process.communicate(timeout=settings.FORTRAN_TIMEOUT)   # timeout in seconds
-            exit_code = process.wait()
+            try:
+                (outs, errs) = process.communicate(timeout=settings.FORTRAN_TIMEOUT)   # timeout in seconds
+                exit_code = process.wait()
+            finally:
+                process.kill_group()    # if timed out or interrupted
 
             if exit_code == 0:
                 return outs.decode("utf-8").replace('.exe', '').replace('\n', '')
@@ -456,7 +641,6 @@ class Predictions(object):
                 logger.error(errs)
                 raise ModelError(errs)
         except TimeoutExpired as to:
-            process.terminate()
             logger.error(model.get('NAME', "")+" PROCESS TIMED OUT.")
             logger.error(to)
             raise TimeOutException()
@@ -467,7 +651,7 @@ class Predictions(object):
 
     @classmethod
     def run(cls, request, process_type, bat_file, params=None, cancer_rates="UK", cwd="/tmp",
-            niceness=0, name="", model=settings.BC_MODEL):
+            niceness=0, name="", model=settings.BC_MODEL, calc="all", npeople=None, features=None):
         """
         Run a process.
         @param request: HTTP request
@@ -477,6 +661,10 @@ class Predictions(object):
         @keyword cwd: working directory
         @keyword niceness: niceness value
         @keyword name: log name for calculation, e.g. REMAINING LIFETIME
+        @keyword calc: calculation type used to label metrics, e.g. carrier_probs
+        @keyword npeople: number of people in the pedigree used to label metrics and to get the resource budget
+        @keyword features: features of the pedigree logged with the run time to fit the cost model, see
+        L{bws.estimate.get_features}
         """
         cmd = [os.path.join(model['HOME'], model['EXE'])]
         if process_type == pedigree.MUTATION_PROBS:
@@ -490,6 +678,24 @@ class Predictions(object):
         cmd.extend(["-o", out, bat_file, model['INCIDENCE'] + cancer_rates + ".nml"])
         mname = str(model.get('NAME', ""))
 
+        # coalesce identical runs in flight on the host
+        single_flight = get_single_flight()
+        if single_flight is None:
+            return cls._run_process(request, process_type, cmd, out, cwd, niceness, name, mname, calc, npeople,
+                                    features)
+        return single_flight.run(SingleFlight.get_key(cmd, cwd),
+                                 lambda: cls._run_process(request, process_type, cmd, out, cwd,
+                                                          niceness, name, mname, calc, npeople, features),
+                                 model=mname)
+
+    @classmethod
+    def _run_process(cls, request, process_type, cmd, out, cwd, niceness, name, mname, calc, npeople, features):
+        """
+        Run a model process, see L{run}.
+        @param cmd: model command line
+        @param out: output file name
+        @return: model output
+        """
         start = time.time()
         try:
             try:
@@ -498,42 +704,130 @@ class Predictions(object):
                 pass
 
             # logger.debug(' '.join(cmd))
-            process = Popen(
-                cmd,
-                cwd=cwd,
-                stdout=PIPE,
-                stderr=PIPE,
-                env=settings.FORTRAN_ENV,
-                preexec_fn=lambda: os.nice(niceness) and
-                resource.setrlimit(resource.RLIMIT_STACK, (resource.RLIM_INFINITY, resource.RLIM_INFINITY)))
-
-            (outs, errs) = process.communicate(timeout=settings.FORTRAN_TIMEOUT)   # timeout in seconds
-            exit_code = process.wait()
-
+            labels = (mname, calc, npeople)
+            queued = time.perf_counter()
+            budget = Budget.factory(npeople)
+            cost = None if features is None else estimate.get_cost_model().predict(mname, calc, features)
+            limiter = get_limiter()
+            with limiter.slot(cost, cls._get_tenant(request)) as idx:
+                metrics.observe("queue_wait", time.perf_counter() - queued, *labels)
+                metrics.observe_queue_wait(mname, cost, time.perf_counter() - queued)
+                idle_cores = limiter.idle_cores() + 1    # including the core of this slot
+                cpus = limiter.place(idx, budget.adapt_threads(cost, idle_cores), settings.FORTRAN_AFFINITY)
+                with metrics.Timer("subprocess", *labels):
+                    inputs = set(os.listdir(cwd))
+                    budget.create_cgroup()
+                    try:
+                        started = time.perf_counter()
+                        process = ModelProcess(
+                            budget.get_command(cmd),
+                            niceness=niceness,
+                            cpus=cpus,
+                            cwd=cwd,
+                            stdout=PIPE,
+                            stderr=PIPE,
+                            env=budget.get_env(settings.FORTRAN_ENV))
+
+                        try:
+                            (outs, errs) = process.communicate(timeout=settings.FORTRAN_TIMEOUT)   # timeout in seconds
+                            exit_code = process.wait()
+                        finally:
+                            process.kill_group()    # if timed out or interrupted, before the slot is freed
+                        metrics.observe_model_run(mname, cost, budget.threads, time.perf_counter() - started)
+                        breach = budget.get_breach(exit_code, process.rusage, errs.decode("utf-8", "replace"))
+                    finally:
+                        budget.remove_cgroup()
+
+            run_name = name if process_type == pedigree.CANCER_RISKS else "MUTATION PROBABILITY"
+            usage = cls._get_resource_usage(mname, run_name, process.rusage)
             if exit_code == 0:
                 with open(os.path.join(cwd, out), 'r') as result_file:
                     data = result_file.read()
                 logger.info(
                     f"{mname} {('MUTATION PROBABILITY' if process_type == pedigree.MUTATION_PROBS else 'RISK ')}"
                     f"{name} CALCULATION: user={request.user.id}; "
-                    f"elapsed time={time.time() - start}")
+                    f"elapsed time={time.time() - start}{usage}{cls._get_cost_log(calc, features, cost)}; "
+                    f"threads={budget.threads}; idle cores={idle_cores}; "
+                    f"cpus={placement.format_cpulist(cpus or [])}")
                 return data
             else:
-                logger.error(f"EXIT CODE ({out.replace('can_', '')}): {exit_code}")
+                logger.error(f"EXIT CODE ({out.replace('can_', '')}): {exit_code}{usage}")
                 logger.error(outs)
                 errs = errs.decode("utf-8").replace('\n', '')
                 logger.error(errs)
+                cls._remove_outputs(cwd, inputs)
+                if breach is not None:
+                    logger.error(f"{mname} PROCESS EXCEEDED RESOURCE LIMIT: {breach}")
+                    raise ResourceLimitException(resource=breach)
                 raise ModelError(errs)
         except TimeoutExpired as to:
-            process.terminate()
             logger.error(f"{mname} PROCESS TIMED OUT.")
             logger.error(to)
+            cls._remove_outputs(cwd, inputs)
             raise TimeOutException()
+        except (ServiceUnavailableException, ResourceLimitException):
+            raise
         except Exception as e:
             logger.error(f"{mname} PROCESS EXCEPTION: {cwd}")
             logger.error(e)
             raise
 
+    @classmethod
+    def _remove_outputs(cls, cwd, inputs):
+        """
+        Remove the partial outputs of a failed model run.
+        @param cwd: working directory
+        @param inputs: names of the files in the working directory before the model was run
+        """
+        for name in set(os.listdir(cwd)) - inputs:
+            try:
+                os.remove(os.path.join(cwd, name))
+            except OSError as e:
+                logger.warning("MODEL OUTPUT NOT REMOVED: " + str(e))
+
+    @classmethod
+    def _get_tenant(cls, request):
+        """
+        Get the API account and end user a model run is for, used to share the model process
+        slots between them, see L{bws.admission}.
+        @param request: HTTP request
+        @return: tuple of the account and end user (the user_id field)
+        """
+        data = getattr(request, "data", None)
+        end_user = data.get("user_id", "") if hasattr(data, "get") else ""
+        return (str(getattr(request, "user", "")), str(end_user))
+
+    @classmethod
+    def _get_cost_log(cls, calc, features, cost):
+        """
+        Get the calculation, pedigree features and estimated run time for the log message, which
+        are used with the run time to fit the cost model, see L{bws.estimate}.
+        @param calc: calculation, e.g. carrier_probs
+        @param features: features of the pedigree or None
+        @param cost: estimated run time in seconds
+        @return: features for the log message
+        """
+        if features is None:
+            return ""
+        return f"; calc={calc}; features={estimate.format_features(features)}; estimated time={cost:.3f}"
+
+    @classmethod
+    def _get_resource_usage(cls, mname, run_name, rusage):
+        """
+        Record the resources used by a model process in the metrics.
+        @param mname: model name
+        @param run_name: name of the model run, e.g. REMAINING LIFETIME
+        @param rusage: resource usage of the process or None if not available
+        @return: resource usage for the log message
+        """
+        if rusage is None:
+            return ""
+        metrics.observe_rusage(mname, run_name, rusage)
+        return (f"; user time={rusage.ru_utime}; system time={rusage.ru_stime}; "
+                f"max rss={rusage.ru_maxrss}KB; "
+                f"page faults={rusage.ru_majflt} major, {rusage.ru_minflt} minor; "
+                f"context switches={rusage.ru_nvcsw} voluntary, {rusage.ru_nivcsw} involuntary")
+
     def _parse_probs_output(self, probs, model_settings):
         """
         Parse computed mutation carrier probability results.
@@ -0,0 +1,33 @@
+"""
+System checks of the model installations, run by manage.py check and on starting the
+development server.
+"""
+import os
+
+from django.conf import settings
+from django.core.checks import Error, register
+
+
+@register()
+def check_model_files(app_configs, **kwargs):
+    """ Check that the cancer incidence rates files exist and the model parameters directory can be written. """
+    errors = []
+    for model in (settings.BC_MODEL, settings.OC_MODEL):
+        for name, rates in model['CANCER_RATES'].items():
+            filepath = model['INCIDENCE'] + rates + ".nml"
+            if not os.path.isfile(filepath):
+                errors.append(Error(
+                    "The " + model['NAME'] + " model cancer incidence rates file for '" + name +
+                    "' was not found: " + filepath,
+                    hint="Check FORTRAN_HOME and the model CANCER_RATES settings.",
+                    id="bws.E001"))
+
+    try:
+        os.makedirs(settings.PARAMS_DIR, exist_ok=True)
+        writable = os.access(settings.PARAMS_DIR, os.W_OK)
+    except OSError:
+        writable = False
+    if not writable:
+        errors.append(Error("The model parameters directory can not be written: " + settings.PARAMS_DIR,
+                            hint="Check the PARAMS_DIR setting.", id="bws.E002"))
+    return errors
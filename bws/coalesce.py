@@ -0,0 +1,234 @@
+"""
+Coalescing of identical model runs. Identical runs in flight at the same time on a host,
+e.g. from double-clicks, client retries or the BWS and ten year views of one family, are
+coalesced so that one runs and the others wait for and share its result.
+"""
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+from django.conf import settings
+
+from bws import metrics
+from bws.exceptions import ModelError, TimeOutException, ResourceLimitException
+
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight(object):
+    """
+    Coalesce identical model runs across all the worker processes sharing the lock directory.
+    The first run of a calculation (the leader) holds an exclusive lock on a file named by the
+    hash of the calculation's inputs while it runs and then writes its result next to it.
+    Identical runs started in the meantime (followers) wait for the lock to be released and
+    return the leader's result instead of running the model. Model errors, time outs and
+    breaches of the resource budgets are shared with the followers. Other failures (e.g. a full
+    queue) are not, and the followers run the model themselves.
+    """
+    SHARED_ERRORS = {"ModelError": ModelError, "TimeOutException": TimeOutException,
+                     "ResourceLimitException": ResourceLimitException}
+
+    def __init__(self, lock_dir, timeout, result_ttl=60, poll_interval=0.05):
+        """
+        @param lock_dir: directory for the lock and result files
+        @param timeout: maximum time in seconds to wait for a leader's result
+        @keyword result_ttl: seconds before unused lock and result files are removed
+        @keyword poll_interval: seconds between checks for the leader's result
+        """
+        self.lock_dir = lock_dir
+        self.timeout = timeout
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        self.last_sweep = time.time()
+        os.makedirs(self.lock_dir, exist_ok=True)
+
+    @classmethod
+    def get_key(cls, cmd, cwd):
+        """
+        Get the key of a model run from its command line and input files. The batch file and
+        the files in the working directory that it names (i.e. the pedigree file) are replaced
+        with their contents, so the key is the same for the same inputs in different working
+        directories. The other files are shared (e.g. the parameters files, see
+        L{bws.calcs.get_param_file}) so their paths identify them.
+        @param cmd: model command line
+        @param cwd: working directory
+        @return: key
+        """
+        digest = hashlib.sha256()
+
+        def add(value):
+            value = value.encode("utf-8")
+            digest.update(str(len(value)).encode("utf-8") + b":" + value)
+
+        cwd = os.path.abspath(cwd)
+        for arg in cmd:
+            if not arg.endswith(".bat"):
+                add(arg)
+                continue
+            with open(arg if os.path.isabs(arg) else os.path.join(cwd, arg), "r") as f:
+                lines = f.read().splitlines()
+            for line in lines:
+                if line.startswith(cwd + os.sep) and os.path.isfile(line):
+                    with open(line, "r") as f:
+                        add(f.read())
+                else:
+                    add(line)
+        return digest.hexdigest()
+
+    def run(self, key, func, model=""):
+        """
+        Run a calculation or wait for the result of an identical one already running.
+        @param key: key of the calculation, see L{get_key}
+        @param func: function that runs the calculation and returns its result (str)
+        @keyword model: model name used to label the metrics
+        @return: result of the calculation
+        """
+        lock_path = os.path.join(self.lock_dir, key + ".lock")
+        result_path = os.path.join(self.lock_dir, key + ".result")
+        fd = self._lock_leader(lock_path)
+        if fd is None:
+            result = self._wait(lock_path, result_path)
+            if result is not None:
+                metrics.observe_coalesced(model, True)
+                logger.info(f"{model} MODEL RUN COALESCED: key={key[:16]}")
+                if "error" in result:
+                    raise self.SHARED_ERRORS[result["error"]](result["detail"])
+                return result["data"]
+            # the leader's result is not available so run it
+            metrics.observe_coalesced(model, False)
+            return func()
+
+        metrics.observe_coalesced(model, False)
+        try:
+            # the result of an earlier run must not be read by the followers of this run
+            try:
+                os.remove(result_path)
+            except FileNotFoundError:
+                pass
+            try:
+                data = func()
+            except (ModelError, TimeOutException, ResourceLimitException) as e:
+                self._write_result(result_path, {"error": e.__class__.__name__, "detail": self._get_detail(e)})
+                raise
+            except BaseException:
+                self._write_result(result_path, {"retry": True})   # the followers run it themselves
+                raise
+            self._write_result(result_path, {"data": data})
+            return data
+        finally:
+            os.close(fd)
+            self._sweep()
+
+    def _lock_leader(self, lock_path):
+        """
+        Try to become the leader of a calculation.
+        @param lock_path: calculation lock file
+        @return: locked file descriptor or None if another run of the calculation is in flight
+        """
+        while True:
+            fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o666)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                return None
+            try:
+                # the lock file may have been removed by a sweep before it was locked
+                if os.fstat(fd).st_ino == os.stat(lock_path).st_ino:
+                    return fd
+            except OSError:
+                pass
+            os.close(fd)
+
+    def _wait(self, lock_path, result_path):
+        """
+        Wait for the leader of a calculation to finish.
+        @param lock_path: calculation lock file
+        @param result_path: calculation result file
+        @return: leader's result or None if it is not available, e.g. the leader could not run it
+        """
+        start = time.time()
+        try:
+            fd = os.open(lock_path, os.O_RDONLY)
+        except OSError:
+            return None
+        try:
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+                    break
+                except OSError:
+                    if time.time() - start > self.timeout:
+                        logger.warning(f"COALESCED MODEL RUN TIMED OUT: waited={time.time() - start}")
+                        raise TimeOutException()
+                    time.sleep(self.poll_interval)
+        finally:
+            os.close(fd)
+        try:
+            with open(result_path, "r") as f:
+                result = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return None if result.get("retry") else result
+
+    def _get_detail(self, e):
+        """ Get the message of an exception to raise again in the followers. """
+        if isinstance(e, ModelError):
+            return str(e.detail.get('Model Error', e.detail))
+        return str(e.detail)
+
+    def _write_result(self, result_path, result):
+        """ Write the result so that a partially written file is never read. """
+        try:
+            (fd, tmp) = tempfile.mkstemp(suffix=".tmp", dir=self.lock_dir)
+            with os.fdopen(fd, "w") as f:
+                json.dump(result, f)
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, result_path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.error("COALESCED MODEL RUN RESULT NOT WRITTEN: " + str(e))
+
+    def _sweep(self):
+        """ Remove the lock and result files not used for longer than result_ttl seconds. """
+        now = time.time()
+        if now - self.last_sweep < self.result_ttl:
+            return
+        self.last_sweep = now
+        for name in os.listdir(self.lock_dir):
+            path = os.path.join(self.lock_dir, name)
+            try:
+                if now - os.stat(path).st_mtime < self.result_ttl:
+                    continue
+                if not name.endswith(".lock"):
+                    os.remove(path)
+                    continue
+                fd = os.open(path, os.O_RDWR)
+            except OSError:
+                continue
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                os.remove(path)
+            except OSError:
+                pass
+            finally:
+                os.close(fd)
+
+
+_single_flight = None
+
+
+def get_single_flight():
+    """ Get the model run coalescing configured in the settings, None if it is disabled. """
+    global _single_flight
+    if settings.FORTRAN_COALESCE_DIR is None:
+        return None
+    args = (settings.FORTRAN_COALESCE_DIR, settings.FORTRAN_TIMEOUT + settings.FORTRAN_QUEUE_TIMEOUT)
+    if _single_flight is None or _single_flight.args != args:
+        _single_flight = SingleFlight(*args)
+        _single_flight.args = args
+    return _single_flight
@@ -0,0 +1,232 @@
+"""
+Model run time estimates. The run time of the models grows by orders of magnitude with the
+size and structure of a pedigree, so each model run is described by the features of the
+pedigree written for it:
+  - people:       number of people
+  - generations:  number of generations, i.e. the longest line of descent
+  - genotyped:    number of people with a genetic test result
+  - affected:     number of people with a cancer diagnosis
+  - twins:        number of people in a set of MZ twins
+  - genes:        number of genes in the model
+The run time is predicted by a log-linear model of the features for each model and
+calculation. The coefficients are fitted by the 'fit_cost_model' management command from
+the model run log lines (see L{bws.calcs.Predictions.run}), which include the features of the
+run, and are saved to COST_MODEL_FILE. Until then, a run is estimated from the number of
+people and genes. Estimates are of the model CPU time in seconds, i.e. the run time of the
+single threaded models when they are not competing for a CPU.
+"""
+import json
+import logging
+import math
+import os
+import re
+
+from django.conf import settings
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+FEATURES = ["people", "generations", "genotyped", "affected", "twins", "genes"]
+REGEX_FEATURES = re.compile(r"^(\w+:\d+)(,\w+:\d+)*$")
+
+# coefficients of the design (see L{get_design}) used before a cost model is fitted
+DEFAULT_COEFFICIENTS = {
+    "carrier_probs": [math.log(0.01), 1.0, 0.0, 0.0, 0.0, 0.0, 1.0],   # pedigree run for each genotype
+    "risks": [math.log(0.01), 1.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+}
+
+_COST_MODEL = {}    # loaded cost model by path, see L{get_cost_model}
+
+
+def get_features(pedi, model_settings=settings.BC_MODEL):
+    """
+    Get the features of a pedigree used to estimate the run time of the models.
+    @param pedi: L{bws.pedigree.Pedigree}
+    @keyword model_settings: cancer model settings
+    @return: dictionary of the features
+    """
+    pids = set(p.pid for p in pedi.people)
+    parents = {p.pid: [i for i in (p.fathid, p.mothid) if i in pids] for p in pedi.people}
+    depths = {}
+    for pid in parents:
+        # iterative depth first search, the pedigree may not have been validated
+        stack = [pid]
+        while stack:
+            individ = stack[-1]
+            pending = [i for i in parents.get(individ, []) if i not in depths and i not in stack]
+            if pending:
+                stack.extend(pending)
+                continue
+            stack.pop()
+            depths[individ] = 1 + max([depths.get(i, 0) for i in parents.get(individ, [])], default=0)
+
+    twins = {}
+    for p in pedi.people:
+        if p.mztwin != "0":
+            twins[p.mztwin] = twins.get(p.mztwin, 0) + 1
+    return {
+        "people": len(pedi.people),
+        "generations": max(depths.values(), default=0),
+        "genotyped": len([p for p in pedi.people if any(t.result != "0" for t in p.gtests)]),
+        "affected": len([p for p in pedi.people if any(c.age != "-1" for c in p.cancers.diagnoses)]),
+        "twins": sum(n for n in twins.values() if n > 1),
+        "genes": len(model_settings['GENES'])
+    }
+
+
+def get_baseline_features(model_settings=settings.BC_MODEL):
+    """
+    Get the features of the single person pedigree of a baseline risk calculation.
+    @keyword model_settings: cancer model settings
+    @return: dictionary of the features
+    """
+    return {"people": 1, "generations": 1, "genotyped": 0, "affected": 0, "twins": 0,
+            "genes": len(model_settings['GENES'])}
+
+
+def format_features(features):
+    """
+    Format features for a log line, e.g. 'people:3,generations:2,...'.
+    @param features: dictionary of the features
+    @return: string
+    """
+    return ",".join(f + ":" + str(int(features.get(f, 0))) for f in FEATURES)
+
+
+def parse_features(text):
+    """
+    Parse features formatted by L{format_features}.
+    @param text: formatted features
+    @return: dictionary of the features or None if they are not valid
+    """
+    if not REGEX_FEATURES.match(text):
+        return None
+    features = dict((k, int(v)) for (k, v) in (f.split(":") for f in text.split(",")))
+    return features if all(f in features for f in FEATURES) else None
+
+
+def get_design(features):
+    """
+    Get the design row of the log-linear model for the features of a run.
+    @param features: dictionary of the features
+    @return: list of the intercept and the transformed features
+    """
+    return [1.0, math.log(max(features["people"], 1)), float(features["generations"]),
+            math.log1p(features["genotyped"]), math.log1p(features["affected"]),
+            math.log1p(features["twins"]), math.log1p(features["genes"])]
+
+
+class CostModel(object):
+    """ Log-linear model of the run time of each model (e.g. 'BC') and calculation. """
+
+    def __init__(self, coefficients=None, stats=None):
+        """
+        @keyword coefficients: dictionary of the coefficients by model and calculation
+        @keyword stats: dictionary of the number of runs and root mean square error (of the log of
+        the run time) of the fit by model and calculation
+        """
+        self.coefficients = {} if coefficients is None else coefficients
+        self.stats = {} if stats is None else stats
+
+    def predict(self, model, calc, features):
+        """
+        Estimate the run time of a model run.
+        @param model: model name, e.g. 'BC'
+        @param calc: calculation, e.g. 'carrier_probs'
+        @param features: dictionary of the features of the run, see L{get_features}
+        @return: seconds
+        """
+        coefficients = self.coefficients.get(model, {}).get(calc)
+        if coefficients is None:
+            coefficients = DEFAULT_COEFFICIENTS["carrier_probs" if calc == "carrier_probs" else "risks"]
+        return math.exp(sum(c * x for (c, x) in zip(coefficients, get_design(features))))
+
+    @classmethod
+    def fit(cls, runs, min_runs=20):
+        """
+        Fit the coefficients by least squares of the log of the run times.
+        @param runs: list of the (model, calculation, features, seconds) of the model runs
+        @keyword min_runs: minimum number of runs of a model and calculation to fit it
+        @return: L{CostModel}
+        """
+        groups = {}
+        for (model, calc, features, seconds) in runs:
+            groups.setdefault((model, calc), []).append((get_design(features), math.log(max(seconds, 1e-3))))
+        cost_model = cls()
+        for ((model, calc), rows) in sorted(groups.items()):
+            if len(rows) < min_runs:
+                continue
+            x = np.array([r[0] for r in rows])
+            y = np.array([r[1] for r in rows])
+            coefficients = np.linalg.lstsq(x, y, rcond=None)[0]
+            rmse = float(np.sqrt(np.mean((x.dot(coefficients) - y) ** 2)))
+            cost_model.coefficients.setdefault(model, {})[calc] = [float(c) for c in coefficients]
+            cost_model.stats.setdefault(model, {})[calc] = {"runs": len(rows), "rmse": rmse}
+        return cost_model
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a cost model.
+        @param path: JSON file path
+        @return: L{CostModel}
+        """
+        with open(path, "r") as f:
+            data = json.load(f)
+        return cls(coefficients=data["coefficients"], stats=data.get("stats"))
+
+    def save(self, path):
+        """
+        Save the cost model, replacing the file atomically.
+        @param path: JSON file path
+        """
+        tmp = path + "." + str(os.getpid())
+        with open(tmp, "w") as f:
+            json.dump({"features": FEATURES, "coefficients": self.coefficients, "stats": self.stats}, f, indent=2)
+        os.replace(tmp, path)
+
+
+def get_cost_model():
+    """
+    Get the fitted cost model, reloading it if it has been refitted.
+    @return: L{CostModel}, with the default coefficients if a cost model has not been fitted
+    """
+    path = settings.COST_MODEL_FILE
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except (OSError, TypeError):
+        return CostModel()
+    cached = _COST_MODEL.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    try:
+        cost_model = CostModel.load(path)
+    except (OSError, ValueError, KeyError) as e:
+        logger.error("COST MODEL NOT LOADED: " + path + " " + str(e))
+        cost_model = CostModel()
+    _COST_MODEL[path] = (mtime, cost_model)
+    return cost_model
+
+
+def get_estimate(pedi, model_settings=settings.BC_MODEL, calcs=None):
+    """
+    Estimate the run time of the model runs of the calculations for a pedigree, i.e. of the
+    calculations that are viable for the pedigree and their baseline risk calculations.
+    @param pedi: L{bws.pedigree.Pedigree}
+    @keyword model_settings: cancer model settings
+    @keyword calcs: list of calculations, default the model calculations
+    @return: dictionary of the seconds for each calculation
+    """
+    cost_model = get_cost_model()
+    model = model_settings['NAME']
+    features = get_features(pedi, model_settings)
+    estimate = {}
+    for calc in (model_settings['CALCS'] if calcs is None else calcs):
+        if calc == "carrier_probs":
+            if pedi.is_carrier_probs_viable():
+                estimate[calc] = cost_model.predict(model, calc, features)
+        elif pedi.is_risks_calc_viable():
+            estimate[calc] = (cost_model.predict(model, calc, features) +
+                              cost_model.predict(model, calc, get_baseline_features(model_settings)))
+    return estimate
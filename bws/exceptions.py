@@ -82,3 +82,31 @@ class TimeOutException(APIException):
     status_code = status.HTTP_408_REQUEST_TIMEOUT
     default_detail = _('Request has timed out.')
     default_code = 'timeout'
+
+
+class ServiceUnavailableException(APIException):
+    ''' All the model process slots are in use and the queue is full '''
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = _('Service is busy, try again later.')
+    default_code = 'service_unavailable'
+
+    def __init__(self, detail=None, code=None, wait=None):
+        """
+        @keyword wait: seconds to wait before retrying, returned in the Retry-After header
+        """
+        super().__init__(detail, code)
+        self.wait = wait
+
+
+class ResourceLimitException(APIException):
+    ''' Model process exceeded its resource budget, see bws.budget '''
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = _('Calculation exceeded its resource limits.')
+    default_code = 'resource_limit'
+
+    def __init__(self, detail=None, code=None, resource=None):
+        """
+        @keyword resource: name of the resource limit exceeded, e.g. 'cpu_time'
+        """
+        super().__init__(detail, code)
+        self.resource = resource
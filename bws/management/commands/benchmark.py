@@ -0,0 +1,200 @@
+""" Command line utility. """
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from bws import pedigree
+from bws.calcs import Predictions, ModelParams, RemainingLifetimeRisk, get_param_file
+from bws.pedigree import PedigreeFile
+from bws.serializers import OutputSerializer
+from bws.synthetic import synthetic_pedigree_file
+
+
+STAGES = ["parse", "validate", "write_files", "subprocess", "parse_output", "serialise", "render"]
+
+
+class Command(BaseCommand):
+    help = 'Time each stage of the web-service request pipeline for pedigrees of increasing size and ' + \
+           'number of families, e.g. ./manage.py benchmark --output bench.json --compare baseline.json'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default="5,25,100,250", help='comma separated numbers of people per family')
+        parser.add_argument('--families', default="1,10", help='comma separated numbers of families per file')
+        parser.add_argument('--model', default='BC', choices=['BC', 'OC'], help='cancer model')
+        parser.add_argument('--repeat', type=int, default=5, help='number of times each case is timed')
+        parser.add_argument('--no-model', action='store_true', help='skip stages that run the model executable')
+        parser.add_argument('--output', help='write the results as JSON to this file')
+        parser.add_argument('--compare', help='JSON results file to compare against, e.g. from a previous commit')
+        parser.add_argument('--threshold', type=float, default=1.25,
+                            help='ratio of median times to the baseline above which a stage has regressed')
+        parser.add_argument('--min-time', type=float, default=0.001,
+                            help='baseline median time in seconds below which regressions are ignored as noise')
+
+    def handle(self, *args, **options):
+        model_settings = settings.BC_MODEL if options['model'] == 'BC' else settings.OC_MODEL
+        run_model = not options['no_model']
+        if run_model and not os.path.isfile(os.path.join(model_settings['HOME'], model_settings['EXE'])):
+            raise CommandError("Model executable not found, use --no-model or see bws/scripts/model_simulator.py")
+
+        results = {}
+        for nfamilies in [int(n) for n in options['families'].split(",")]:
+            for npeople in [int(n) for n in options['sizes'].split(",")]:
+                case = f"{options['model']}/{npeople}p/{nfamilies}f"
+                timings = {stage: [] for stage in STAGES}
+                data = synthetic_pedigree_file(nfamilies, size=npeople, seed=npeople)
+                for _i in range(options['repeat']):
+                    for stage, elapsed in self.time_stages(data, model_settings, run_model).items():
+                        timings[stage].append(elapsed)
+                results[case] = {
+                    stage: {"median": statistics.median(t), "min": min(t), "max": max(t)}
+                    for stage, t in timings.items() if len(t) > 0
+                }
+                self.stdout.write(case.ljust(16) + "  ".join(
+                    "%s=%.4fs" % (stage, r["median"]) for stage, r in results[case].items()))
+
+        report = {
+            "commit": self.get_commit(),
+            "timestamp": datetime.datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "model": options['model'],
+            "repeat": options['repeat'],
+            "results": results
+        }
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+
+        if options['compare']:
+            with open(options['compare'], 'r') as f:
+                baseline = json.load(f)
+            regressions = self.compare(baseline, report, options['threshold'], options['min_time'])
+            if len(regressions) > 0:
+                raise CommandError(str(len(regressions)) + " stage(s) regressed compared to " +
+                                   str(baseline.get('commit')))
+
+    def time_stages(self, data, model_settings, run_model):
+        """
+        Time each stage of the request pipeline for a pedigree file.
+        @param data: pedigree file content
+        @param model_settings: cancer model settings
+        @param run_model: run the model executable
+        @return: dictionary of the elapsed time in seconds for each stage
+        """
+        times = {}
+        start = time.perf_counter()
+        pf = PedigreeFile(data)
+        times["parse"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        PedigreeFile.validate(pf.pedigrees)
+        times["validate"] = time.perf_counter() - start
+
+        params = ModelParams(mutation_frequency=model_settings['MUTATION_FREQUENCIES']["UK"],
+                             mutation_sensitivity=model_settings['GENETIC_TEST_SENSITIVITY'],
+                             cancer_rates=model_settings['CANCER_RATES'].get("UK"))
+        cwd = tempfile.mkdtemp(prefix="benchmark_", dir=settings.CWD_DIR)
+        try:
+            output = {
+                "version": "benchmark",
+                "timestamp": datetime.datetime.now(),
+                "mutation_frequency": {params.population: params.mutation_frequency},
+                "mutation_sensitivity": params.mutation_sensitivity,
+                "cancer_incidence_rates": params.cancer_rates,
+                "pedigree_result": []
+            }
+            for stage in ("write_files", "subprocess", "parse_output"):
+                times[stage] = 0
+            for pedi in pf.pedigrees:
+                calcs = Predictions(pedi, model_params=params, cwd=cwd, run_risks=False, model_settings=model_settings)
+                calcs.niceness = Predictions._get_niceness(pedi)
+                risk = RemainingLifetimeRisk(calcs)
+
+                start = time.perf_counter()
+                probs_bat, risks_bat, param_file = self.write_files(pedi, cwd, params, model_settings)
+                times["write_files"] += time.perf_counter() - start
+
+                this_pedigree = {"family_id": pedi.famid, "proband_id": pedi.get_target().pid}
+                if run_model:
+                    start = time.perf_counter()
+                    probs = Predictions.run(calcs.request, pedigree.MUTATION_PROBS, probs_bat, params=param_file,
+                                            cancer_rates=params.cancer_rates, cwd=cwd, model=model_settings)
+                    risks = Predictions.run(calcs.request, pedigree.CANCER_RISKS, risks_bat, params=param_file,
+                                            cancer_rates=params.cancer_rates, cwd=cwd, model=model_settings)
+                    times["subprocess"] += time.perf_counter() - start
+
+                    start = time.perf_counter()
+                    this_pedigree["mutation_probabilties"] = calcs._parse_probs_output(probs, model_settings)
+                    this_pedigree["cancer_risks"] = risk._parse_risks_output(risks)
+                    times["parse_output"] += time.perf_counter() - start
+                output["pedigree_result"].append(this_pedigree)
+        finally:
+            shutil.rmtree(cwd)
+        if not run_model:
+            del times["subprocess"]
+            del times["parse_output"]
+
+        start = time.perf_counter()
+        serialised = OutputSerializer(output).data
+        times["serialise"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        JSONRenderer().render(serialised)
+        times["render"] = time.perf_counter() - start
+        return times
+
+    def write_files(self, pedi, cwd, params, model_settings):
+        """ Write the model input files for a mutation carrier probability and remaining lifetime risk run. """
+        probs_ped = pedi.write_pedigree_file(file_type=pedigree.MUTATION_PROBS,
+                                             filepath=os.path.join(cwd, "test_prob.ped"),
+                                             model_settings=model_settings)
+        probs_bat = pedi.write_batch_file(pedigree.MUTATION_PROBS, probs_ped,
+                                          filepath=os.path.join(cwd, "test_prob.bat"),
+                                          model_settings=model_settings)
+        risks_ped = pedi.write_pedigree_file(file_type=pedigree.CANCER_RISKS,
+                                             filepath=os.path.join(cwd, "test_risk.ped"),
+                                             model_settings=model_settings)
+        risks_bat = pedi.write_batch_file(pedigree.CANCER_RISKS, risks_ped,
+                                          filepath=os.path.join(cwd, "test_risk.bat"),
+                                          model_settings=model_settings)
+        param_file = get_param_file(model_settings, params.mutation_frequency, params.mutation_sensitivity,
+                                    cwd=cwd)
+        return probs_bat, risks_bat, param_file
+
+    def compare(self, baseline, report, threshold, min_time):
+        """
+        Compare the median stage times with a baseline report.
+        @return: list of the (case, stage, ratio) that regressed
+        """
+        regressions = []
+        self.stdout.write("Compared to " + str(baseline.get('commit')) + " (threshold=" + str(threshold) + "):")
+        for case, stages in report["results"].items():
+            for stage, result in stages.items():
+                try:
+                    base = baseline["results"][case][stage]["median"]
+                except KeyError:
+                    continue
+                ratio = result["median"] / base if base > 0 else float('inf')
+                regressed = ratio > threshold and base >= min_time
+                if regressed:
+                    regressions.append((case, stage, ratio))
+                self.stdout.write("  %-16s %-13s %8.4fs -> %8.4fs  x%.2f%s" %
+                                  (case, stage, base, result["median"], ratio, "  REGRESSION" if regressed else ""))
+        return regressions
+
+    def get_commit(self):
+        """ Get the git commit of the code being benchmarked. """
+        try:
+            return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                           cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
@@ -0,0 +1,66 @@
+""" Command line utility. """
+from concurrent.futures import ThreadPoolExecutor
+import os
+import shlex
+import shutil
+from subprocess import DEVNULL
+import sys
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from bws import placement
+from bws.admission import SlotLimiter
+from bws.calcs import ModelProcess
+
+
+# memory bound stand-in for a model run, strided passes over an array larger than the caches
+WORKLOAD = ("import array\n"
+            "a = array.array('d', bytes(%d))\n"
+            "for i in range(%d):\n"
+            "    s = sum(a[::8])\n")
+
+
+class Command(BaseCommand):
+    help = 'Compare the throughput of concurrent model processes placed by the kernel and pinned by ' + \
+           'each FORTRAN_AFFINITY policy, e.g. ./manage.py benchmark_affinity --jobs 16 --runs 64'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help='model processes run at once')
+        parser.add_argument('--runs', type=int, help='number of model processes run, default 4 per job')
+        parser.add_argument('--threads', type=int, default=1, help='threads of each model process')
+        parser.add_argument('--mb', type=int, default=64, help='array size of the stand-in model run in MB')
+        parser.add_argument('--passes', type=int, default=20, help='passes over the array of the stand-in model run')
+        parser.add_argument('--cmd', help='command run instead of the stand-in, e.g. a model command line')
+
+    def handle(self, *args, **options):
+        jobs = options['jobs']
+        runs = options['runs'] or 4 * jobs
+        threads = options['threads']
+        if options['cmd'] is not None:
+            cmd = shlex.split(options['cmd'])
+        else:
+            cmd = [sys.executable, "-c", WORKLOAD % (options['mb'] * 1024 * 1024, options['passes'])]
+        env = dict(os.environ, OMP_NUM_THREADS=str(threads), OPENBLAS_NUM_THREADS=str(threads))
+        self.stdout.write("NUMA nodes: " + " ".join(placement.format_cpulist(n) for n in placement.get_nodes()))
+
+        for policy in (None,) + placement.POLICIES:
+            lock_dir = tempfile.mkdtemp(prefix="bws_affinity_")
+            try:
+                limiter = SlotLimiter(lock_dir, nslots=jobs, queue_size=runs, timeout=3600, retry_after=1)
+
+                def run(_i):
+                    with limiter.slot() as idx:
+                        cpus = limiter.place(idx, threads, policy)
+                        started = time.perf_counter()
+                        ModelProcess(cmd, cpus=cpus, stdout=DEVNULL, env=env).wait()
+                        return time.perf_counter() - started
+
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=jobs) as pool:
+                    times = list(pool.map(run, range(runs)))
+                elapsed = time.perf_counter() - start
+            finally:
+                shutil.rmtree(lock_dir)
+            self.stdout.write("%-8s %8.3f runs/s %8.3f s/run" % (policy or "none", runs / elapsed, sum(times) / runs))
@@ -0,0 +1,50 @@
+""" Command line utility. """
+import resource
+from subprocess import DEVNULL, Popen
+import time
+
+from django.core.management.base import BaseCommand
+
+from bws.budget import Budget
+from bws.calcs import ModelProcess
+
+
+def preexec():
+    """ Python code run in the child, which forces subprocess to fork the worker. """
+    resource.setrlimit(resource.RLIMIT_NOFILE, resource.getrlimit(resource.RLIMIT_NOFILE))
+
+
+class Command(BaseCommand):
+    help = 'Time the per-launch cost of starting a model process from a worker with a large resident ' + \
+           'set, with a preexec_fn (fork) and with the budget wrapper (vfork), ' + \
+           'e.g. ./manage.py benchmark_spawn --rss 2048'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rss', type=int, default=1024, help='worker resident set to add in MB')
+        parser.add_argument('--launches', type=int, default=50, help='number of timed launches')
+        parser.add_argument('--cmd', default='true', help='command launched')
+
+    def handle(self, *args, **options):
+        # touch every page so it is resident and its page table entries are copied by fork
+        ballast = b'\x01' * (options['rss'] * 1024 * 1024)
+        self.stdout.write("worker max RSS: %d MB" % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024))
+        budget = Budget.factory()
+        cmd = [options['cmd']]
+        launchers = [
+            ("preexec_fn", lambda: Popen(cmd, stdout=DEVNULL, start_new_session=True, preexec_fn=preexec)),
+            ("no wrapper", lambda: ModelProcess(cmd, stdout=DEVNULL)),
+            ("budget wrapper", lambda: ModelProcess(budget.get_command(cmd), niceness=1, stdout=DEVNULL)),
+        ]
+        for (name, launch) in launchers:
+            launch().wait()     # warm up
+            spawn = 0
+            start = time.perf_counter()
+            for _i in range(options['launches']):
+                launched = time.perf_counter()
+                process = launch()
+                spawn += time.perf_counter() - launched
+                process.wait()
+            elapsed = time.perf_counter() - start
+            self.stdout.write("%-16s %8.2f ms/spawn %8.2f ms/run" %
+                              (name, spawn / options['launches'] * 1e3, elapsed / options['launches'] * 1e3))
+        del ballast
@@ -0,0 +1,68 @@
+""" Command line utility. """
+import time
+import uuid
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from rest_framework.throttling import UserRateThrottle
+
+from bws.throttles import CounterThrottleMixin
+
+
+class HistoryThrottle(UserRateThrottle):
+    """ DRF timestamp history throttle. """
+    scope = 'sustained'
+
+
+class CounterThrottle(CounterThrottleMixin, UserRateThrottle):
+    """ Sliding window counter throttle. """
+    scope = 'sustained'
+
+
+class BenchmarkUser(AnonymousUser):
+    """ Authenticated user used to key the throttle, with an identifier unique to the run. """
+
+    def __init__(self):
+        super().__init__()
+        self.pk = self.id = "benchmark-" + uuid.uuid4().hex
+
+    @property
+    def is_authenticated(self):
+        return True
+
+
+class BenchmarkRequest():
+    """ Minimal request used to exercise the throttles. """
+    def __init__(self):
+        self.user = BenchmarkUser()
+        self.META = {'REMOTE_ADDR': '127.0.0.1'}
+
+
+class Command(BaseCommand):
+    help = 'Time the per-request overhead of the throttles at full quota, e.g. ./manage.py benchmark_throttles. ' + \
+           'The throttles are keyed by a user unique to the run and only its keys are removed from the cache.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000, help='number of timed requests')
+
+    def handle(self, *args, **options):
+        for throttle_cls in (HistoryThrottle, CounterThrottle):
+            request = BenchmarkRequest()
+            throttle = throttle_cls()
+            first = int(throttle.timer() // throttle.duration)
+            try:
+                # fill the quota
+                for _i in range(throttle.num_requests):
+                    throttle_cls().allow_request(request, None)
+
+                start = time.perf_counter()
+                for _i in range(options['requests']):
+                    allowed = throttle_cls().allow_request(request, None)
+                elapsed = time.perf_counter() - start
+            finally:
+                # remove the history or window counters of the run, and nothing else
+                key = throttle.get_cache_key(request, None)
+                last = int(throttle.timer() // throttle.duration)
+                throttle.cache.delete_many([key] + [key + "_" + str(w) for w in range(first - 1, last + 1)])
+            self.stdout.write("%-16s rate=%-10s %8.1f us/request (allowed=%s)" %
+                              (throttle_cls.__name__, throttle.rate, elapsed / options['requests'] * 1e6, allowed))
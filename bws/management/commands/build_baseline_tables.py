@@ -0,0 +1,167 @@
+""" Command line utility. """
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from bws import baseline
+from bws.calcs import Predictions, ModelParams, RemainingLifetimeBaselineRisk, RangeRiskBaseline, RISK_RANGES, \
+    get_param_file
+from bws.cancer import Cancer, Cancers, BWSGeneticTests, CanRiskGeneticTests
+from bws.pedigree import Female, BwaPedigree, CanRiskPedigree
+
+
+class Command(BaseCommand):
+    help = 'Build the precomputed baseline risk tables (see bws.baseline) by running the model for each ' + \
+           'year of birth, age and age at breast cancer diagnosis, e.g. ./manage.py build_baseline_tables ' + \
+           '--model BC --cancer-rates UK --mut-freq UK'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', default='BC', choices=['BC', 'OC'], help='cancer model')
+        parser.add_argument('--cancer-rates', help='comma separated cancer incidence rates, default all')
+        parser.add_argument('--mut-freq', default='UK', help='comma separated mutation frequency populations')
+        parser.add_argument('--yobs', help='range of years of birth, e.g. 1940-2000, default the years of birth ' +
+                                           'of women aged 1-' + str(settings.MAX_AGE_FOR_RISK_CALCS))
+        parser.add_argument('--ages', help='comma separated ages, default the ages for each year of birth in the ' +
+                                           'current year')
+        parser.add_argument('--no-affected', action='store_true',
+                            help='only calculate the remaining lifetime risks for unaffected women')
+        parser.add_argument('--workers', type=int, default=settings.FAMILY_WORKERS,
+                            help='number of model runs at once')
+
+    def handle(self, *args, **options):
+        model_settings = settings.BC_MODEL if options['model'] == 'BC' else settings.OC_MODEL
+        if not os.path.isfile(os.path.join(model_settings['HOME'], model_settings['EXE'])):
+            raise CommandError("Model executable not found: " +
+                               os.path.join(model_settings['HOME'], model_settings['EXE']))
+        if settings.BASELINE_TABLES_DIR is None:
+            raise CommandError("BASELINE_TABLES_DIR is not set")
+
+        if options['cancer_rates']:
+            rates = options['cancer_rates'].split(",")
+            for r in rates:
+                if r not in model_settings['CANCER_RATES']:
+                    raise CommandError("Unknown cancer rates: " + r)
+        else:
+            rates = list(model_settings['CANCER_RATES'].keys())
+        populations = options['mut_freq'].split(",")
+        for p in populations:
+            if p not in model_settings['MUTATION_FREQUENCIES'] or p == 'Custom':
+                raise CommandError("Unknown mutation frequency population: " + p)
+
+        rows = self.get_rows(options)
+        cwd = tempfile.mkdtemp(prefix="baseline_", dir=settings.CWD_DIR)
+        try:
+            version = Predictions.get_version(model=model_settings, cwd=cwd)
+        finally:
+            shutil.rmtree(cwd)
+
+        built = set()
+        for population in populations:
+            # incidence rates with the same file share a table
+            for crates in sorted(set(model_settings['CANCER_RATES'][r] for r in rates)):
+                params = ModelParams(population, mutation_frequency=model_settings['MUTATION_FREQUENCIES'][population],
+                                     mutation_sensitivity=model_settings['GENETIC_TEST_SENSITIVITY'],
+                                     cancer_rates=crates)
+                param_file = get_param_file(model_settings, params.mutation_frequency, params.mutation_sensitivity,
+                                            isashk=params.isashk)
+                name = baseline.get_table_name(param_file, crates)
+                if name in built:
+                    continue
+                built.add(name)
+
+                table = {}
+                for calc, calc_rows in rows.items():
+                    with ThreadPoolExecutor(max_workers=max(options['workers'], 1)) as executor:
+                        risks = list(executor.map(lambda r: self.calculate(model_settings, params, version, calc, *r),
+                                                  calc_rows))
+                    table[calc] = {baseline.get_key(*r): risk for r, risk in zip(calc_rows, risks)}
+                meta = {
+                    "version": version,
+                    "model": model_settings['NAME'],
+                    "cancer_rates": crates,
+                    "population": population,
+                    "timestamp": datetime.datetime.now().isoformat()
+                }
+                baseline.BaselineTable.write(os.path.join(settings.BASELINE_TABLES_DIR, name), meta, table)
+                self.stdout.write(name + ": " + ", ".join(calc + "=" + str(len(table[calc])) for calc in table))
+
+    def get_rows(self, options):
+        """
+        Get the (year of birth, age, age at breast cancer diagnosis) of the rows of each calculation.
+        @param options: command options
+        @return: dictionary of the calculation to a list of the rows
+        """
+        year = datetime.date.today().year
+        max_age = settings.MAX_AGE_FOR_RISK_CALCS
+        if options['yobs']:
+            try:
+                (first, last) = [int(y) for y in options['yobs'].split("-")]
+            except ValueError:
+                raise CommandError("Invalid range of years of birth: " + options['yobs'])
+        else:
+            (first, last) = (year - max_age - 1, year - 1)
+        yobs = range(max(first, settings.MIN_YEAR_OF_BIRTH), min(last, year) + 1)
+
+        rows = {calc: [] for calc in baseline.CALCS}
+        for yob in yobs:
+            if options['ages']:
+                ages = [int(a) for a in options['ages'].split(",")]
+            else:
+                ages = [year - yob - 1, year - yob]     # before and after their birthday this year
+            for age in ages:
+                if age < 1 or age > max_age:
+                    continue
+                rows["remaining_lifetime"].append((yob, age, 0))
+                if not options['no_affected']:
+                    rows["remaining_lifetime"].extend((yob, age, dage) for dage in range(1, age + 1))
+            for calc in ("lifetime", "ten_year"):
+                rows[calc].append((yob, RISK_RANGES[calc][0], 0))
+        return rows
+
+    def get_pedigree(self, model_settings, yob, age, diagnosis_age=0):
+        """
+        Get a single person pedigree of a woman.
+        @param model_settings: cancer model settings
+        @param yob: year of birth
+        @param age: age at last follow up
+        @keyword diagnosis_age: age at breast cancer diagnosis, 0 if unaffected
+        @return: L{Pedigree}
+        """
+        if diagnosis_age > 0:
+            cancers = Cancers(bc1=Cancer(str(diagnosis_age)), bc2=Cancer(), oc=Cancer(), prc=Cancer(), pac=Cancer())
+        else:
+            cancers = Cancers()
+        if model_settings['NAME'] == 'BC':
+            target = Female("BASELINE", "F1", "1", "", "", target="1", age=str(age), yob=str(yob),
+                            cancers=cancers, gtests=BWSGeneticTests.default_factory())
+            return BwaPedigree(people=[target])
+        target = Female("BASELINE", "F1", "1", "", "", target="1", age=str(age), yob=str(yob),
+                        cancers=cancers, gtests=CanRiskGeneticTests.default_factory())
+        return CanRiskPedigree(people=[target])
+
+    def calculate(self, model_settings, params, version, calc, yob, age, diagnosis_age):
+        """
+        Run the model for a row of a table.
+        @return: list of the (age, risk)
+        """
+        pedi = self.get_pedigree(model_settings, yob, age, diagnosis_age)
+        cwd = tempfile.mkdtemp(prefix="baseline_", dir=settings.CWD_DIR)
+        try:
+            pred = Predictions(pedi, model_params=params, cwd=cwd, run_risks=False, model_settings=model_settings)
+            pred.version = version
+            pred.niceness = Predictions._get_niceness(pedi)
+            if calc == "remaining_lifetime":
+                risk = RemainingLifetimeBaselineRisk(pred)
+            else:
+                name = "LIFETIME BASELINE" if calc == "lifetime" else "10YR RANGE BASELINE"
+                risk = RangeRiskBaseline(pred, *RISK_RANGES[calc], name)
+            risks = risk.get_risk(precomputed=False)
+        finally:
+            shutil.rmtree(cwd)
+        ctype = "breast" if model_settings['NAME'] == 'BC' else "ovarian"
+        return [(r["age"], r[ctype + " cancer risk"]["decimal"]) for r in risks]
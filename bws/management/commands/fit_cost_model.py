@@ -0,0 +1,65 @@
+""" Command line utility. """
+import gzip
+import re
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from bws import estimate
+
+
+# model run log line, see bws.calcs.Predictions._run_process
+REGEX_RUN = re.compile(r"\b(\w+) (?:MUTATION PROBABILITY|RISK .*?) CALCULATION: .*?elapsed time=([\d.eE+-]+)"
+                       r"(?:; user time=([\d.eE+-]+); system time=([\d.eE+-]+))?"
+                       r".*?; calc=(\w+); features=([\w:,]+)")
+
+
+class Command(BaseCommand):
+    help = 'Fit the model run time estimates (see bws.estimate) from the model run log lines in log files, ' + \
+           'e.g. ./manage.py fit_cost_model /var/log/bws/bws.log*'
+
+    def add_arguments(self, parser):
+        parser.add_argument('logs', nargs='+', help='log files, optionally gzip compressed')
+        parser.add_argument('--min-runs', type=int, default=20,
+                            help='minimum number of runs of a model and calculation to fit it')
+        parser.add_argument('--output', default=settings.COST_MODEL_FILE, help='cost model file')
+
+    def handle(self, *args, **options):
+        runs = []
+        for log in options['logs']:
+            runs.extend(Command.read_runs(log))
+        if len(runs) == 0:
+            raise CommandError("No model run log lines with pedigree features found")
+
+        cost_model = estimate.CostModel.fit(runs, min_runs=options['min_runs'])
+        for model in sorted(cost_model.stats):
+            for (calc, stats) in sorted(cost_model.stats[model].items()):
+                self.stdout.write("%-3s %-20s runs=%-7d rmse(log seconds)=%.3f" %
+                                  (model, calc, stats["runs"], stats["rmse"]))
+        if options['output'] is None:
+            raise CommandError("COST_MODEL_FILE is not set")
+        cost_model.save(options['output'])
+        self.stdout.write("model runs: " + str(len(runs)) + "; saved: " + options['output'])
+
+    @staticmethod
+    def read_runs(log):
+        """
+        Read the model runs from a log file.
+        @param log: log file path
+        @return: list of the (model, calculation, features, seconds) of the model runs
+        """
+        runs = []
+        with (gzip.open(log, "rt") if log.endswith(".gz") else open(log, "r")) as f:
+            for line in f:
+                match = REGEX_RUN.search(line)
+                if match is None:
+                    continue
+                (model, elapsed, utime, stime, calc, text) = match.groups()
+                features = estimate.parse_features(text)
+                if features is None:
+                    continue
+                # CPU time of the model when the resource usage is logged, as the elapsed time
+                # includes the wait for a model process slot
+                seconds = float(elapsed) if utime is None else float(utime) + float(stime)
+                runs.append((model, calc, features, seconds))
+        return runs
@@ -0,0 +1,21 @@
+""" Command line utility. """
+import time
+
+from django.core.management.base import BaseCommand
+
+from bws.admission import get_limiter
+
+
+class Command(BaseCommand):
+    help = 'Report the model process slots in use and the model runs waiting for a slot, in the order ' + \
+           'they will be admitted'
+
+    def handle(self, *args, **options):
+        limiter = get_limiter()
+        self.stdout.write("slots in use: " + str(limiter.slots_in_use()) + "/" + str(limiter.nslots))
+        tickets = limiter.tickets()
+        self.stdout.write("queue depth: " + str(len(tickets)) + "/" + str(limiter.queue_size))
+        now = time.time()
+        for ticket in tickets:
+            self.stdout.write("  user=%s user_id=%s estimated time=%.3fs waited=%.1fs" %
+                              (ticket.account, ticket.end_user, ticket.cost, now - ticket.enqueued))
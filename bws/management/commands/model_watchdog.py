@@ -0,0 +1,35 @@
+""" Command line utility. """
+import time
+
+from django.core.management.base import BaseCommand
+
+from bws import watchdog
+
+
+class Command(BaseCommand):
+    help = 'Report the orphaned and overdue model processes on the host (see bws.watchdog), ' + \
+           'e.g. ./manage.py model_watchdog --kill --interval 60'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='report all the model processes')
+        parser.add_argument('--kill', action='store_true', help='kill the orphaned and overdue model processes')
+        parser.add_argument('--interval', type=float, help='seconds between checks, default check once')
+
+    def handle(self, *args, **options):
+        while True:
+            self.check(options)
+            if options['interval'] is None:
+                break
+            time.sleep(options['interval'])
+
+    def check(self, options):
+        """ Report, and optionally kill, the orphaned and overdue model processes. """
+        processes = watchdog.get_model_processes()
+        strays = watchdog.get_stray_processes()
+        self.stdout.write("model processes: " + str(len(processes)) + "; orphaned or overdue: " + str(len(strays)))
+        for p in (processes if options['all'] else strays):
+            status = "orphaned" if p.is_orphaned() else ("overdue" if p.is_overdue() else "running")
+            self.stdout.write("  " + status + " " + str(p))
+        if options['kill'] and len(strays) > 0:
+            watchdog.kill(strays)
+            self.stdout.write("killed: " + str(len(strays)))
@@ -0,0 +1,51 @@
+""" Command line utility. """
+from django.core.management.base import BaseCommand, CommandError
+
+from bws.exceptions import CanRiskError
+from bws.pedigree import PedigreeFile
+from bws.synthetic import FILE_TYPES, synthetic_pedigree_file
+
+
+class Command(BaseCommand):
+    help = 'Generate a synthetic pedigree file for benchmarks and stress tests, ' + \
+           'e.g. ./manage.py synthetic_pedigrees --size 275 --families 1000 --prs --output pedigrees.txt'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=20, help='number of people in each family')
+        parser.add_argument('--families', type=int, default=1, help='number of families')
+        parser.add_argument('--format', default='canrisk2', choices=FILE_TYPES, help='pedigree file format')
+        parser.add_argument('--depth', type=int, default=3, help='maximum number of generations below the founders')
+        parser.add_argument('--sibship', default="1,5", help='minimum and maximum number of children per couple')
+        parser.add_argument('--twins', type=int, default=0, help='maximum number of MZ twin pairs in each family')
+        parser.add_argument('--cancer-rate', type=float, default=0.15, help='fraction of people with a cancer')
+        parser.add_argument('--gtest-rate', type=float, default=0.05, help='fraction of people with a genetic test')
+        parser.add_argument('--risk-factors', action='store_true', help='add header risk factors (CanRisk only)')
+        parser.add_argument('--prs', action='store_true', help='add header PRS (CanRisk only)')
+        parser.add_argument('--ashkn', action='store_true', help='founders have Ashkenazi Jewish ancestry')
+        parser.add_argument('--seed', type=int, help='random seed, for reproducible files')
+        parser.add_argument('--validate', action='store_true', help='validate the generated pedigree file')
+        parser.add_argument('--output', help='write the pedigree file to this file rather than stdout')
+
+    def handle(self, *args, **options):
+        try:
+            sibship = tuple(int(n) for n in options['sibship'].split(","))
+            data = synthetic_pedigree_file(nfamilies=options['families'], file_type=options['format'],
+                                           risk_factors=options['risk_factors'], prs=options['prs'],
+                                           seed=options['seed'], size=options['size'], depth=options['depth'],
+                                           sibship=(sibship[0], sibship[-1]), twins=options['twins'],
+                                           cancer_rate=options['cancer_rate'], gtest_rate=options['gtest_rate'],
+                                           ashkn=options['ashkn'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if options['validate']:
+            try:
+                PedigreeFile.validate(PedigreeFile(data).pedigrees)
+            except CanRiskError as e:
+                raise CommandError("Generated pedigree file is not valid: " + str(e))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(data)
+        else:
+            self.stdout.write(data, ending='')
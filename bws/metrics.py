@@ -0,0 +1,416 @@
+"""
+Timing of the stages of the request pipeline (parsing, validation, writing the model input
+files, waiting for a model slot, running the model, parsing its output, calculating PRS from
+VCF files and serialising the results). Durations are recorded in histograms labelled by
+stage, model, calculation type and pedigree size. The CPU time, memory, page faults and
+context switches of each model process are recorded by the name of the model run, the time
+model runs wait for a slot and their run time by their estimated run time (and number of
+threads), as well as the pedigree validation cache hits and misses. The metrics are exposed
+in the Prometheus text format.
+
+The histogram counters are kept in the Django cache (METRICS_CACHE) and updated with atomic
+increments, so with a shared cache backend such as memcached or redis the metrics of all the
+web-service worker processes are aggregated. With the local memory cache each worker has its
+own metrics.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from bws import watchdog
+from bws.admission import get_limiter
+
+
+logger = logging.getLogger(__name__)
+
+STAGES = ["parse", "validate", "write_files", "queue_wait", "subprocess", "parse_output", "prs", "serialise"]
+MODELS = ["BC", "OC", "PRS"]
+CALCS = ["all"] + settings.ALLOWED_CALCS + ["prs"]
+# names of the model runs, see Predictions.run
+RUN_NAMES = ["MUTATION PROBABILITY", "REMAINING LIFETIME", "REMAINING LIFETIME BASELINE", "LIFETIME",
+             "LIFETIME BASELINE", "10 YR RANGE", "10YR RANGE BASELINE", "OTHER"]
+
+
+def size_labels():
+    """ Get the pedigree size labels, e.g. ['1', '2-10', ..., '276+', 'na']. """
+    labels = []
+    lower = 1
+    for upper in settings.METRICS_SIZE_BUCKETS:
+        labels.append(str(upper) if upper == lower else str(lower) + "-" + str(upper))
+        lower = upper + 1
+    return labels + [str(lower) + "+", "na"]
+
+
+def size_label(npeople):
+    """
+    Get the label of the size bucket for a pedigree.
+    @param npeople: number of people in the pedigree or None if not applicable
+    @return: size label, e.g. '26-50'
+    """
+    if npeople is None:
+        return "na"
+    labels = size_labels()
+    for idx, upper in enumerate(settings.METRICS_SIZE_BUCKETS):
+        if npeople <= upper:
+            return labels[idx]
+    return labels[-2]
+
+
+def cost_labels():
+    """ Get the estimated run time labels, e.g. ['0-1', '1-10', '10-60', '60+', 'na']. """
+    bounds = [0] + settings.METRICS_COST_BUCKETS
+    return [str(lower) + "-" + str(upper) for (lower, upper) in zip(bounds, bounds[1:])] + [str(bounds[-1]) + "+", "na"]
+
+
+def cost_label(cost):
+    """
+    Get the label of the estimated run time bucket of a model run.
+    @param cost: estimated run time in seconds or None if not estimated
+    @return: label, e.g. '1-10'
+    """
+    if cost is None:
+        return "na"
+    labels = cost_labels()
+    for idx, upper in enumerate(settings.METRICS_COST_BUCKETS):
+        if cost <= upper:
+            return labels[idx]
+    return labels[-2]
+
+
+def thread_labels():
+    """ Get the model process thread count labels, e.g. ['1', '2', '3', '4']. """
+    return [str(n) for n in range(1, max(settings.FORTRAN_MAX_THREADS, 1) + 1)]
+
+
+def pedigrees_size(pedigrees):
+    """ Size used to label request stages, i.e. the number of people in the largest family. """
+    return max([len(pedi.people) for pedi in pedigrees], default=None)
+
+
+class Metric(object):
+    """ Metric with its values stored as cache counters for each combination of label values. """
+    type = None
+
+    def __init__(self, name, documentation, labelnames, labelvalues, prefix="bws_metrics"):
+        """
+        @param name: metric name
+        @param documentation: metric help text
+        @param labelnames: label names
+        @param labelvalues: function returning a list of the allowed values of each label
+        @keyword prefix: cache key prefix
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.labelvalues = labelvalues
+        self.prefix = prefix
+
+    @property
+    def cache(self):
+        return caches[settings.METRICS_CACHE]
+
+    def _key(self, labels, suffix):
+        # memcached keys can not contain spaces
+        return (self.prefix + ":" + self.name + ":" + ":".join(labels) + ":" + suffix).replace(" ", "_")
+
+    def _incr(self, key, delta):
+        """ Atomically increment a counter, creating it if it does not exist. """
+        try:
+            return self.cache.incr(key, delta)
+        except ValueError:
+            if self.cache.add(key, delta, None):
+                return delta
+            return self.cache.incr(key, delta)
+
+    def series(self):
+        """ Get all the combinations of the allowed label values. """
+        combinations = [[]]
+        for values in self.labelvalues():
+            combinations = [c + [v] for c in combinations for v in values]
+        return combinations
+
+    def suffixes(self):
+        """ Get the suffixes of the cache keys of the counters of a series. """
+        return []
+
+    def header(self):
+        return ["# HELP " + self.name + " " + self.documentation, "# TYPE " + self.name + " " + self.type]
+
+    def format_labels(self, labels):
+        return ",".join('%s="%s"' % (n, v) for n, v in zip(self.labelnames, labels))
+
+    def clear(self):
+        """ Remove all the recorded values. """
+        self.cache.delete_many([self._key(labels, suffix) for labels in self.series() for suffix in self.suffixes()])
+
+
+class Counter(Metric):
+    """ Counter that only increases. """
+    type = "counter"
+
+    def suffixes(self):
+        return ["total"]
+
+    def inc(self, amount, *labels):
+        """
+        Increment the counter.
+        @param amount: non-negative integer amount
+        @param labels: label values, in the order of the label names
+        """
+        try:
+            self._incr(self._key(labels, "total"), int(amount))
+        except Exception as e:
+            # metrics must not fail a request
+            logger.warning("METRICS ERROR: " + str(e))
+
+    def collect(self):
+        """
+        Get the recorded series.
+        @return: list of (label values, total)
+        """
+        series = self.series()
+        totals = self.cache.get_many([self._key(labels, "total") for labels in series])
+        return [(labels, totals[self._key(labels, "total")]) for labels in series
+                if self._key(labels, "total") in totals]
+
+    def expose(self):
+        """ Get the counter in the Prometheus text exposition format. """
+        lines = self.header()
+        for labels, total in self.collect():
+            lines.append('%s_total{%s} %d' % (self.name, self.format_labels(labels), total))
+        return "\n".join(lines) + "\n"
+
+
+class Histogram(Metric):
+    """
+    Histogram with the counts of the observations in each bucket, the number of observations
+    and their sum stored as cache counters.
+    """
+    type = "histogram"
+
+    def __init__(self, name, documentation, buckets, labelnames, labelvalues, prefix="bws_metrics", scale=1e6):
+        """
+        @param name: metric name
+        @param documentation: metric help text
+        @param buckets: bucket upper bounds
+        @param labelnames: label names
+        @param labelvalues: function returning a list of the allowed values of each label
+        @keyword prefix: cache key prefix
+        @keyword scale: the sum is stored as an integer counter in units of 1/scale
+        """
+        super().__init__(name, documentation, labelnames, labelvalues, prefix=prefix)
+        self.buckets = buckets
+        self.scale = scale
+
+    def suffixes(self):
+        return ["b" + str(i) for i in range(len(self.buckets))] + ["sum", "count"]
+
+    def observe(self, value, *labels):
+        """
+        Record an observation.
+        @param value: observed value, e.g. duration in seconds
+        @param labels: label values, in the order of the label names
+        """
+        idx = len(self.buckets)
+        for i, upper in enumerate(self.buckets):
+            if value <= upper:
+                idx = i
+                break
+        try:
+            self._incr(self._key(labels, "b" + str(idx)), 1)
+            self._incr(self._key(labels, "sum"), int(round(value * self.scale)))
+            self._incr(self._key(labels, "count"), 1)
+        except Exception as e:
+            # metrics must not fail a request
+            logger.warning("METRICS ERROR: " + str(e))
+
+    def collect(self):
+        """
+        Get the recorded series.
+        @return: list of (label values, cumulative bucket counts, sum, count)
+        """
+        series = self.series()
+        counts = self.cache.get_many([self._key(labels, "count") for labels in series])
+        results = []
+        for labels in series:
+            count = counts.get(self._key(labels, "count"))
+            if count is None:
+                continue
+            keys = [self._key(labels, "b" + str(i)) for i in range(len(self.buckets))] + [self._key(labels, "sum")]
+            values = self.cache.get_many(keys)
+            cumulative = []
+            total = 0
+            for key in keys[:-1]:
+                total += values.get(key, 0)
+                cumulative.append(min(total, count))
+            results.append((labels, cumulative, values.get(keys[-1], 0) / self.scale, count))
+        return results
+
+    def expose(self):
+        """ Get the histogram in the Prometheus text exposition format. """
+        lines = self.header()
+        for labels, cumulative, total, count in self.collect():
+            lbls = self.format_labels(labels)
+            for upper, n in zip(self.buckets, cumulative):
+                lines.append('%s_bucket{%s,le="%s"} %d' % (self.name, lbls, repr(float(upper)), n))
+            lines.append('%s_bucket{%s,le="+Inf"} %d' % (self.name, lbls, count))
+            lines.append('%s_sum{%s} %s' % (self.name, lbls, repr(total)))
+            lines.append('%s_count{%s} %d' % (self.name, lbls, count))
+        return "\n".join(lines) + "\n"
+
+
+STAGE_DURATION = Histogram("bws_stage_duration_seconds", "Duration of each stage of the request pipeline.",
+                           settings.METRICS_BUCKETS, ["stage", "model", "calc", "size"],
+                           lambda: [STAGES, MODELS, CALCS, size_labels()])
+MODEL_CPU = Histogram("bws_model_cpu_seconds", "CPU time used by each model process.",
+                      settings.METRICS_BUCKETS, ["model", "name", "mode"],
+                      lambda: [MODELS[:2], RUN_NAMES, ["user", "system"]])
+MODEL_MAX_RSS = Histogram("bws_model_max_rss_bytes", "Maximum resident set size of each model process.",
+                          settings.METRICS_RSS_BUCKETS, ["model", "name"], lambda: [MODELS[:2], RUN_NAMES], scale=1)
+MODEL_PAGE_FAULTS = Counter("bws_model_page_faults", "Page faults of the model processes.",
+                            ["model", "name", "type"], lambda: [MODELS[:2], RUN_NAMES, ["major", "minor"]])
+MODEL_CONTEXT_SWITCHES = Counter("bws_model_context_switches", "Context switches of the model processes.",
+                                 ["model", "name", "type"],
+                                 lambda: [MODELS[:2], RUN_NAMES, ["voluntary", "involuntary"]])
+VALIDATION_CACHE = Counter("bws_validation_cache_lookups", "Pedigree validation cache lookups.",
+                           ["model", "result"], lambda: [MODELS[:2], ["hit", "miss"]])
+BASELINE_TABLE = Counter("bws_baseline_table_lookups", "Precomputed baseline risk table lookups.",
+                         ["model", "name", "result"], lambda: [MODELS[:2], RUN_NAMES, ["hit", "miss"]])
+COALESCED_RUNS = Counter("bws_model_runs_coalesced", "Model runs that ran or shared the result of an identical run.",
+                         ["model", "result"], lambda: [MODELS[:2], ["run", "coalesced"]])
+QUEUE_WAIT = Histogram("bws_model_queue_wait_seconds", "Time model runs waited for a slot by estimated run time.",
+                       settings.METRICS_BUCKETS, ["model", "cost"], lambda: [MODELS[:2], cost_labels()])
+MODEL_RUN = Histogram("bws_model_run_seconds", "Run time of the model processes by estimated run time and threads.",
+                      settings.METRICS_BUCKETS, ["model", "cost", "threads"],
+                      lambda: [MODELS[:2], cost_labels(), thread_labels()])
+REGISTRY = [STAGE_DURATION, MODEL_CPU, MODEL_MAX_RSS, MODEL_PAGE_FAULTS, MODEL_CONTEXT_SWITCHES, VALIDATION_CACHE,
+            BASELINE_TABLE, COALESCED_RUNS, QUEUE_WAIT, MODEL_RUN]
+
+
+def observe(stage, seconds, model, calc="all", npeople=None):
+    """
+    Record the duration of a stage.
+    @param stage: stage name, one of L{STAGES}
+    @param seconds: duration
+    @param model: model name, i.e. 'BC', 'OC' or 'PRS'
+    @keyword calc: calculation type, 'all' for stages of the whole request
+    @keyword npeople: number of people in the pedigree
+    """
+    if settings.METRICS_ENABLED:
+        STAGE_DURATION.observe(seconds, stage, model, calc, size_label(npeople))
+
+
+def observe_rusage(model, name, rusage):
+    """
+    Record the resources used by a model process.
+    @param model: model name, i.e. 'BC' or 'OC'
+    @param name: name of the model run, one of L{RUN_NAMES}
+    @param rusage: resource usage of the process, see os.wait4
+    """
+    if not settings.METRICS_ENABLED:
+        return
+    name = name if name in RUN_NAMES else "OTHER"
+    MODEL_CPU.observe(rusage.ru_utime, model, name, "user")
+    MODEL_CPU.observe(rusage.ru_stime, model, name, "system")
+    MODEL_MAX_RSS.observe(rusage.ru_maxrss * 1024, model, name)        # ru_maxrss is in kilobytes
+    MODEL_PAGE_FAULTS.inc(rusage.ru_majflt, model, name, "major")
+    MODEL_PAGE_FAULTS.inc(rusage.ru_minflt, model, name, "minor")
+    MODEL_CONTEXT_SWITCHES.inc(rusage.ru_nvcsw, model, name, "voluntary")
+    MODEL_CONTEXT_SWITCHES.inc(rusage.ru_nivcsw, model, name, "involuntary")
+
+
+def observe_validation_cache(model, hit):
+    """
+    Record a pedigree validation cache lookup.
+    @param model: model name, i.e. 'BC' or 'OC'
+    @param hit: true if the validation result was cached
+    """
+    if settings.METRICS_ENABLED:
+        VALIDATION_CACHE.inc(1, model, "hit" if hit else "miss")
+
+
+def observe_baseline_table(model, name, hit):
+    """
+    Record a precomputed baseline risk table lookup.
+    @param model: model name, i.e. 'BC' or 'OC'
+    @param name: name of the model run, e.g. 'LIFETIME BASELINE'
+    @param hit: true if the risks were in a table
+    """
+    if settings.METRICS_ENABLED:
+        BASELINE_TABLE.inc(1, model, name, "hit" if hit else "miss")
+
+
+def observe_coalesced(model, coalesced):
+    """
+    Record a model run.
+    @param model: model name, i.e. 'BC' or 'OC'
+    @param coalesced: true if the result of an identical run in flight was shared
+    """
+    if settings.METRICS_ENABLED:
+        COALESCED_RUNS.inc(1, model, "coalesced" if coalesced else "run")
+
+
+def observe_queue_wait(model, cost, seconds):
+    """
+    Record the time a model run waited for a slot in the shortest job first queue.
+    @param model: model name, i.e. 'BC' or 'OC'
+    @param cost: estimated run time in seconds or None if not estimated
+    @param seconds: time waited
+    """
+    if settings.METRICS_ENABLED:
+        QUEUE_WAIT.observe(seconds, model, cost_label(cost))
+
+
+def observe_model_run(model, cost, threads, seconds):
+    """
+    Record the run time of a model process, to compare the run times with different numbers of threads.
+    @param model: model name, i.e. 'BC' or 'OC'
+    @param cost: estimated run time in seconds or None if not estimated
+    @param threads: number of OpenMP and OpenBLAS threads
+    @param seconds: run time
+    """
+    if settings.METRICS_ENABLED:
+        MODEL_RUN.observe(seconds, model, cost_label(cost), str(min(max(threads, 1), len(thread_labels()))))
+
+
+class Timer(object):
+    """
+    Context manager that records the duration of a stage. The number of people can be set
+    within the block when it is not known beforehand, e.g.
+        with Timer("parse", "BC") as timer:
+            pf = PedigreeFile(data)
+            timer.npeople = pedigrees_size(pf.pedigrees)
+    """
+
+    def __init__(self, stage, model, calc="all", npeople=None):
+        self.stage = stage
+        self.model = model
+        self.calc = calc
+        self.npeople = npeople
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        observe(self.stage, time.perf_counter() - self.start, self.model, calc=self.calc, npeople=self.npeople)
+        return False
+
+
+def expose():
+    """ Get the metrics in the Prometheus text exposition format. """
+    lines = [m.expose() for m in REGISTRY]
+    try:
+        limiter = get_limiter()
+        for (name, documentation, value) in (
+                ("bws_model_slots", "Maximum number of model processes run at once.", limiter.nslots),
+                ("bws_model_slots_in_use", "Number of model processes running.", limiter.slots_in_use()),
+                ("bws_model_queue_depth", "Number of model runs waiting for a slot.", limiter.queue_depth()),
+                ("bws_model_stray_processes", "Orphaned and overdue model processes, see bws.watchdog.",
+                 len(watchdog.get_stray_processes(log=False)))):
+            lines.append("# HELP %s %s\n# TYPE %s gauge\n%s %d\n" % (name, documentation, name, name, value))
+    except OSError as e:
+        logger.warning("METRICS ERROR: " + str(e))
+    return "".join(lines)
@@ -1,11 +1,15 @@
 """ Pedigree data """
+import hashlib
 import re
 
 from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import get_language
 
 from bws.cancer import Cancer, GeneticTest, PathologyTests, PathologyTest, Cancers,\
     BWSGeneticTests, CanRiskGeneticTests, Genes
-from bws.exceptions import PedigreeFileError, PedigreeError, PersonError
+from bws import metrics
+from bws.exceptions import CanRiskError, PedigreeFileError, PedigreeError, PersonError
 from datetime import date
 from random import randint
 import abc
@@ -116,6 +120,15 @@ class PedigreeFile(object):
         bc_rfc = oc_rfc = 0
         bc_prs = oc_prs = None
 
+        # reject files that are too large before parsing them
+        if len(pedigree_data) > settings.MAX_PEDIGREE_FILE_SIZE:
+            raise PedigreeFileError("The pedigree file is larger than the maximum size of " +
+                                    str(settings.MAX_PEDIGREE_FILE_SIZE) + " bytes.")
+        nlines = pedigree_data.count('\n') + (0 if pedigree_data.endswith('\n') else 1)
+        if nlines > settings.MAX_PEDIGREE_FILE_LINES:
+            raise PedigreeFileError("The pedigree file has more than the maximum of " +
+                                    str(settings.MAX_PEDIGREE_FILE_LINES) + " lines.")
+
         for idx, line in enumerate(pedigree_data.splitlines()):
             if idx == 0:
                 if REGEX_CANRISK1_PEDIGREE_FILE_HEADER.match(line):
@@ -169,6 +182,10 @@ class PedigreeFile(object):
                                             "CanRisk format 2 pedigree files should have " +
                                             str(settings.BOADICEA_CANRISK_FORMAT_TWO_DATA_FIELDS) +
                                             " data items per line.")
+                if len(pedigrees_records[pid]) >= settings.MAX_PEDIGREE_SIZE:
+                    # reject a large pedigree before creating its family members
+                    raise PedigreeError("Pedigree (" + famid + ") has unexpected number of family members, " +
+                                        "the maximum is " + str(settings.MAX_PEDIGREE_SIZE) + ".", famid)
                 pedigrees_records[pid].append(line)
 
         self.pedigrees = []
@@ -184,8 +201,17 @@ class PedigreeFile(object):
 
     @classmethod
     def validate(cls, pedigrees):
+        """
+        Validate the pedigrees. The cheap structural checks of all the pedigrees are run
+        before the more expensive checks so that malformed pedigrees are rejected early.
+        @param pedigrees: pedigree or list of pedigrees
+        @return: list of warnings
+        """
         if isinstance(pedigrees, Pedigree):
             pedigrees = [pedigrees]
+        for pedigree in pedigrees:
+            pedigree.validate_structure()   # Validate family IDs, parents and MZ twins
+
         warnings = []
         for pedigree in pedigrees:
             people = pedigree.people
@@ -202,6 +228,43 @@ class PedigreeFile(object):
 
         return warnings
 
+    @classmethod
+    def validate_cached(cls, pedigrees, model):
+        """
+        Validate the pedigrees, see L{validate}. The warnings or the validation error are
+        cached keyed by a hash of the parsed pedigrees, so that a pedigree resubmitted to any
+        of the models is not validated again.
+        @param pedigrees: pedigree or list of pedigrees
+        @param model: model name used to label the cache hit-rate metrics, e.g. 'BC'
+        @return: list of warnings
+        """
+        if isinstance(pedigrees, Pedigree):
+            pedigrees = [pedigrees]
+        if not settings.VALIDATION_CACHE_TIMEOUT:
+            return cls.validate(pedigrees)
+
+        # warnings are translated so the language is part of the key
+        digest = hashlib.sha256(str(get_language()).encode("utf-8"))
+        for pedigree in pedigrees:
+            digest.update(pedigree.content_hash().encode("utf-8"))
+        key = "pedigree_validation_" + digest.hexdigest()
+        result = cache.get(key)
+        if result is not None:
+            metrics.observe_validation_cache(model, hit=True)
+            (warnings, error) = result
+            if error is not None:
+                raise error[0](error[1])
+            return warnings
+
+        metrics.observe_validation_cache(model, hit=False)
+        try:
+            warnings = [str(w) for w in cls.validate(pedigrees)]
+        except CanRiskError as e:
+            cache.set(key, ([], (type(e), str(e.detail[type(e).err]))), settings.VALIDATION_CACHE_TIMEOUT)
+            raise
+        cache.set(key, (warnings, None), settings.VALIDATION_CACHE_TIMEOUT)
+        return warnings
+
 
 class Pedigree(metaclass=abc.ABCMeta):
     """
@@ -265,9 +328,11 @@ class Pedigree(metaclass=abc.ABCMeta):
             if oc_prs is not None:
                 self.oc_prs = oc_prs
 
-    def validate(self):
-        """ Validation check for pedigree input.
-        @param p: Person to validate pedigree data.
+    def validate_structure(self):
+        """
+        Cheap structural checks of the pedigree, i.e. the family ID, the identifiers and
+        parents of the family members and the MZ twin identifiers. These are linear in the
+        size of the pedigree and are run before L{validate}.
         """
         if(len(self.famid) > settings.MAX_LENGTH_PEDIGREE_NUMBER_STR or
            not REGEX_ALPHANUM_HYPHENS.match(self.famid) or       # must be alphanumeric plus hyphen
@@ -278,11 +343,42 @@ class Pedigree(metaclass=abc.ABCMeta):
                 "'. Family IDs must be specified with between 1 and "+str(settings.MAX_LENGTH_PEDIGREE_NUMBER_STR) +
                 " non-zero number or alphanumeric characters.", self.famid)
 
-        unconnected = self.unconnected()
-        if len(unconnected) > 0:
-            raise PedigreeError("Pedigree (" + self.famid + ") family members are not physically " +
-                                "connected to the target: " + str(unconnected), self.famid)
+        for p in self.people:
+            p.validate_structure()
+
+        # check for missing parents
+        pids = set(p.pid for p in self.people)
+        for p in self.people:
+            if p.mothid != '0' and p.mothid not in pids:
+                raise PersonError("The mother '"+p.mothid+"' of family member '" + p.pid +
+                                  "' is missing from the pedigree.", p.famid)
+            elif p.fathid != '0' and p.fathid not in pids:
+                raise PersonError("The father '"+p.fathid+"' of family member '" + p.pid +
+                                  "' is missing from the pedigree.", p.famid)
 
+        # Check that MZ siblings are only specified as twins, no identical triplets etc
+        twin_store = self.get_twins()
+        for t in twin_store:
+            twins = twin_store[t]
+            if len(twins) != 2:
+                raise PedigreeError(
+                    "MZ twin identifier '" + str(twins[0].pid) + "' does not appear twice in the pedigree file. "
+                    "Only MZ twins are permitted in the pedigree, MZ triplets or quads are not allowed.",
+                    twins[0].famid)
+
+            # Check MZ twin characters are valid
+            if len(t) != 1 or t not in settings.UNIQUE_TWIN_IDS:
+                raise PedigreeError("Invalid MZ twin character '" + t + "'. MZ twins must be identified using one " +
+                                    "of the following ASCII characters: " + str(settings.UNIQUE_TWIN_IDS) + ".",
+                                    twins[0].famid)
+
+        # Check to ensure that the maximum number of MZ twin pairs per pedigree has not been exceeded
+        if len(twin_store.keys()) > settings.MAX_NUMBER_MZ_TWIN_PAIRS:
+            raise PedigreeError("Maximum number of MZ twin pairs has been exceeded. Input pedigrees must have a "
+                                "maximum of " + str(settings.MAX_NUMBER_MZ_TWIN_PAIRS) + " MZ twin pairs.", self.famid)
+
+    def validate(self):
+        """ Validation check for pedigree input, run after L{validate_structure}. """
         # Check that the index's parameters are valid
         target = self.get_target()
         if target.yob == '0':
@@ -304,25 +400,10 @@ class Pedigree(metaclass=abc.ABCMeta):
                 "breast cancer, ovarian cancer or pancreatic cancer.", target.famid)
 
         #
-        # Check monozygotic (MZ) twin data
+        # Check that monozygotic (MZ) twin data are consistent
         twin_store = self.get_twins()
-
-        # Check that MZ siblings are only specified as twins, no identical triplets etc
         for t in twin_store:
             twins = twin_store[t]
-            if len(twins) != 2:
-                raise PedigreeError(
-                    "MZ twin identifier '" + str(twins[0].pid) + "' does not appear twice in the pedigree file. "
-                    "Only MZ twins are permitted in the pedigree, MZ triplets or quads are not allowed.",
-                    twins[0].famid)
-
-            # Check MZ twin characters are valid
-            if len(t) != 1 or t not in settings.UNIQUE_TWIN_IDS:
-                raise PedigreeError("Invalid MZ twin character '" + t + "'. MZ twins must be identified using one " +
-                                    "of the following ASCII characters: " + str(settings.UNIQUE_TWIN_IDS) + ".",
-                                    twins[0].famid)
-
-            # Check that monozygotic (MZ) twin data are consistent
             if(twins[0].mothid != twins[1].mothid or
                twins[0].fathid != twins[1].fathid):
                 raise PedigreeError("Monozygotic (MZ) twins identified with the character '" + t + "' have different "
@@ -347,10 +428,22 @@ class Pedigree(metaclass=abc.ABCMeta):
                                     "for these individuals are different. Under these circumstances, the genetic test "
                                     "results must be the same.", twins[0].famid)
 
-        # Check to ensure that the maximum number of MZ twin pairs per pedigree has not been exceeded
-        if len(twin_store.keys()) > settings.MAX_NUMBER_MZ_TWIN_PAIRS:
-            raise PedigreeError("Maximum number of MZ twin pairs has been exceeded. Input pedigrees must have a "
-                                "maximum of " + str(settings.MAX_NUMBER_MZ_TWIN_PAIRS) + " MZ twin pairs.", self.famid)
+        unconnected = self.unconnected()
+        if len(unconnected) > 0:
+            raise PedigreeError("Pedigree (" + self.famid + ") family members are not physically " +
+                                "connected to the target: " + str(unconnected), self.famid)
+
+    def content_hash(self):
+        """
+        Hash of the parsed pedigree data that is validated, so that it is independent of the
+        layout of the pedigree file.
+        @return: hexadecimal SHA-256 digest
+        """
+        people = [(type(p).__name__, p.famid, p.name, p.pid, p.fathid, p.mothid, p.target, p.dead, p.age, p.yob,
+                   p.ashkn, p.mztwin, [c.age for c in p.cancers.diagnoses],
+                   type(p.gtests).__name__, [(t.test_type, t.result) for t in p.gtests],
+                   [(t.test_type, t.result) for t in p.pathology]) for p in self.people]
+        return hashlib.sha256(repr((type(self).__name__, self.famid, people)).encode("utf-8")).hexdigest()
 
     def add_parents(self, person, gtests=BWSGeneticTests.default_factory()):
         """
@@ -450,24 +543,22 @@ class Pedigree(metaclass=abc.ABCMeta):
         that are not connected.
         @return: return a list of individuals that aren't connected to the target
         """
+        # link each family member to their parents and children
+        relatives = {}
+        for p in self.people:
+            for parent in (p.mothid, p.fathid):
+                if parent != '0':
+                    relatives.setdefault(p.pid, set()).add(parent)
+                    relatives.setdefault(parent, set()).add(p.pid)
+
         target = self.get_target()
-        connected = [target.pid]
-        change = True
-        while change:
-            change = False
-            for p in self.people:
-                # If the person is in the connected group, but their parents aren't, then add them
-                if p.pid in connected:
-                    if((p.mothid != '0') and (p.mothid not in connected)):
-                        connected.append(p.mothid)
-                        change = True
-                    if((p.fathid != '0') and (p.fathid not in connected)):
-                        connected.append(p.fathid)
-                        change = True
-                # If the person parents is in the connected group, but they aren't, then add them
-                elif ((p.mothid in connected) or (p.fathid in connected)):
-                    connected.append(p.pid)
-                    change = True
+        connected = {target.pid}
+        stack = [target.pid]
+        while stack:
+            for pid in relatives.get(stack.pop(), ()):
+                if pid not in connected:
+                    connected.add(pid)
+                    stack.append(pid)
         # list of the individuals not connected to the target.
         return [p.pid for p in self.people if p.pid not in connected]
 
@@ -580,18 +671,30 @@ class Pedigree(metaclass=abc.ABCMeta):
         @param sensitivity: genetic test sensitivity
         @param isashk: true if AJ
         """
+        with open(filepath, "w") as f:
+            f.write(Pedigree.get_param_file_content(model_settings=model_settings, mutation_freq=mutation_freq,
+                                                    sensitivity=sensitivity, isashk=isashk))
+        return filepath
+
+    @staticmethod
+    def get_param_file_content(model_settings=settings.BC_MODEL,
+                               mutation_freq=settings.BC_MODEL['MUTATION_FREQUENCIES']['UK'],
+                               sensitivity=settings.BC_MODEL['GENETIC_TEST_SENSITIVITY'],
+                               isashk=False):
+        """
+        Get the content of the model parameters file, see L{write_param_file}.
+        @return: model parameters namelist
+        """
         # Note: population allele frequencies are used to compute the incidence rates
         # for each genotype, from the overall population incidences
         allele_freq = "PEDIGREE_ALLELE_FRQ" if isashk else "POPULATION_ALLELE_FRQ"
-        f = open(filepath, "w")
-        print("&settings", file=f, end='\n\n')
+        lines = ["&settings", ""]
         for idx, gene in enumerate(model_settings['GENES'], start=1):
-            print(f"{allele_freq}( {idx} ) = {mutation_freq[gene]}", file=f)
+            lines.append(f"{allele_freq}( {idx} ) = {mutation_freq[gene]}")
         for idx, gene in enumerate(model_settings['GENES'], start=1):
-            print(f"SCREENING_SENSITIVITIES( {idx} ) = {sensitivity[gene]}", file=f)
-        print("/", file=f)
-        f.close()
-        return filepath
+            lines.append(f"SCREENING_SENSITIVITIES( {idx} ) = {sensitivity[gene]}")
+        lines.append("/")
+        return "\n".join(lines) + "\n"
 
     def write_batch_file(self, batch_type, pedigree_file_name, filepath="/tmp/test.bat",
                          model_settings=settings.BC_MODEL, calc_ages=None):
@@ -833,14 +936,8 @@ class Person(object):
         self.gtests = gtests    # genetic tests
         self.pathology = pathology
 
-    def validate(self, pedigree):
-        """ Validation check for people input.
-        @param pedigree: Pedigree the person belongs to.
-        """
-        if(self.name == '' or
-           not REGEX_ALPHANUM_HYPHENS.match(self.name)):
-            raise PersonError("A name '"+self.name+"' is unspecified or is not an alphanumeric string.", self.famid)
-
+    def validate_structure(self):
+        """ Cheap structural checks of the identifiers of a person and their parents. """
         if(len(self.pid) < settings.MIN_FAMILY_ID_STR_LENGTH or
            len(self.pid) > settings.MAX_FAMILY_ID_STR_LENGTH or
            REGEX_ONLY_ZEROS.match(self.pid) or
@@ -868,13 +965,13 @@ class Person(object):
                               "have no parents specified (i.e. they must be founders) or both parents specified.",
                               self.famid)
 
-        # check for missing parents
-        if self.mothid != '0' and pedigree.get_person(self.mothid) is None:
-            raise PersonError("The mother '"+self.mothid+"' of family member '" + self.pid +
-                              "' is missing from the pedigree.", self.famid)
-        elif self.fathid != '0' and pedigree.get_person(self.fathid) is None:
-            raise PersonError("The father '"+self.fathid+"' of family member '" + self.pid +
-                              "' is missing from the pedigree.", self.famid)
+    def validate(self, pedigree):
+        """ Validation check for people input, run after L{validate_structure}.
+        @param pedigree: Pedigree the person belongs to.
+        """
+        if(self.name == '' or
+           not REGEX_ALPHANUM_HYPHENS.match(self.name)):
+            raise PersonError("A name '"+self.name+"' is unspecified or is not an alphanumeric string.", self.famid)
 
         # check all fathers are male
         if self.fathid != '0' and pedigree.get_person(self.fathid).sex() != 'M':
@@ -0,0 +1,117 @@
+"""
+Placement of the model processes on the CPUs of the host. By default the kernel places the
+model processes and may migrate them between the sockets of a many-core host, away from the
+memory of their large arrays. The FORTRAN_AFFINITY policy pins each model process, with
+os.sched_setaffinity, to:
+  - 'node':   the CPUs of the NUMA node with the fewest threads of the running model processes,
+              so that its memory is local and the kernel balances the load within the node
+  - 'cores':  its own cores, one for each of its threads, on the NUMA node with the most idle
+              cores, so that it also keeps its caches
+  - None:     any CPU, i.e. it is not pinned
+The CPUs of a model process are recorded with its slot (see L{bws.admission.SlotLimiter.place})
+so that the model processes of all the workers on the host are spread across the NUMA nodes.
+"""
+import glob
+import logging
+import os
+import re
+
+
+logger = logging.getLogger(__name__)
+
+POLICIES = ("node", "cores")
+REGEX_NODE = re.compile(r"node(\d+)$")
+
+
+def parse_cpulist(text):
+    """
+    Parse a kernel CPU list, e.g. '0-3,8-11'.
+    @param text: CPU list
+    @return: sorted list of the CPUs
+    """
+    cpus = set()
+    for part in text.strip().split(","):
+        if part == "" or part == "-":
+            continue
+        (first, _sep, last) = part.partition("-")
+        cpus.update(range(int(first), int(last or first) + 1))
+    return sorted(cpus)
+
+
+def format_cpulist(cpus):
+    """
+    Format CPUs as a kernel CPU list, see L{parse_cpulist}.
+    @param cpus: CPUs
+    @return: CPU list, '-' if there are no CPUs
+    """
+    ranges = []
+    for cpu in sorted(set(cpus)):
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(str(a) if a == b else "%d-%d" % (a, b) for (a, b) in ranges) or "-"
+
+
+def get_nodes(sysfs="/sys/devices/system/node"):
+    """
+    Get the CPUs of each NUMA node that the model processes can run on, i.e. that are in the
+    CPU affinity of this worker.
+    @keyword sysfs: NUMA node sysfs directory
+    @return: list of the sorted CPUs of each node, a single node if NUMA is not available
+    """
+    allowed = os.sched_getaffinity(0)
+    nodes = []
+    paths = [p for p in glob.glob(os.path.join(sysfs, "node*")) if REGEX_NODE.search(p)]
+    for path in sorted(paths, key=lambda p: int(REGEX_NODE.search(p).group(1))):
+        try:
+            with open(os.path.join(path, "cpulist"), "r") as f:
+                cpus = [c for c in parse_cpulist(f.read()) if c in allowed]
+        except (OSError, ValueError):
+            continue
+        if len(cpus) > 0:
+            nodes.append(cpus)
+    return nodes if len(nodes) > 0 else [sorted(allowed)]
+
+
+def get_cpus(threads, placed, policy, nodes=None):
+    """
+    Choose the CPUs of a model process.
+    @param threads: number of threads of the model process
+    @param placed: list of the number of threads and CPUs of the other running model processes
+    @param policy: placement policy, see the module documentation
+    @keyword nodes: CPUs of each NUMA node, default L{get_nodes}
+    @return: sorted list of the CPUs, or None if the model process is not pinned
+    """
+    if policy not in POLICIES:
+        return None
+    nodes = get_nodes() if nodes is None else nodes
+    # threads of the running model processes per CPU, spread over the CPUs they are pinned to
+    load = {}
+    for (nthreads, cpus) in placed:
+        for cpu in cpus:
+            load[cpu] = load.get(cpu, 0) + nthreads / len(cpus)
+    if policy == "node":
+        return list(min(nodes, key=lambda n: sum(load.get(c, 0) for c in n) / len(n)))
+    node = max(nodes, key=lambda n: len([c for c in n if load.get(c, 0) == 0]))
+    return sorted(sorted(node, key=lambda c: load.get(c, 0))[:max(1, threads)])
+
+
+def set_affinity(pid, cpus):
+    """
+    Pin a process, and any threads it has started, to CPUs. Threads it starts later inherit them.
+    @param pid: process id
+    @param cpus: CPUs or None to leave it unpinned
+    @return: true if the process was pinned
+    """
+    if cpus is None:
+        return False
+    try:
+        os.sched_setaffinity(pid, cpus)
+        for tid in os.listdir("/proc/%d/task" % pid):
+            if int(tid) != pid:
+                os.sched_setaffinity(int(tid), cpus)
+        return True
+    except OSError as e:
+        logger.warning("MODEL PROCESS NOT PINNED: " + str(e))
+        return False
@@ -0,0 +1,222 @@
+"""
+Opt-in profiling of web-service requests. A request is profiled when an admin (staff) user
+sends the PROFILE_HEADER header (e.g. 'X-BWS-Profile: 1') or it is picked at random at the
+PROFILE_SAMPLE_RATE. The profile is written to PROFILE_DIR as either:
+  - 'pstats':    a cProfile file, e.g. python -m pstats file.prof or snakeviz file.prof
+  - 'collapsed': stacks sampled from the request thread in the collapsed stack format used
+                 by flamegraph.pl and speedscope
+Both measure wall clock time, so include the time spent waiting for the model processes. Work
+run for the request in other threads, i.e. the families of a multi-family pedigree file run by
+the 'bws-family' workers (see L{bws.rest_api.run_families}), is included in the profile when
+it is run in the L{follow} context of the request's profiler. With python 3.12+, where only
+one cProfile profiler can be active at a time, the 'pstats' profile is of the request thread.
+"""
+from contextlib import contextmanager
+from functools import wraps
+import cProfile
+import datetime
+import logging
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import uuid
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ['pstats', 'collapsed']
+
+_local = threading.local()     # profiler of the request run by a thread, see L{get_profiler}
+
+
+class CProfiler(object):
+    """
+    cProfile profiler of the request thread and of the threads that follow it, see L{follow}.
+    """
+
+    def __init__(self):
+        self.thread_id = threading.get_ident()
+        self.profile = cProfile.Profile()      # default timer is wall clock time
+        self.followers = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    @contextmanager
+    def follow(self):
+        """ Profile this thread, which is running work for the request. """
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # only one cProfile profiler can be active at a time (python 3.12+)
+            yield
+            return
+        try:
+            yield
+        finally:
+            profile.disable()
+            with self._lock:
+                self.followers.append(profile)
+
+    def write(self, filepath):
+        """ Write the profile of all the threads as a cProfile file. """
+        stats = pstats.Stats(self.profile)
+        with self._lock:
+            for profile in self.followers:
+                stats.add(profile)
+        stats.dump_stats(filepath)
+
+
+class StackSampler(object):
+    """
+    Sample the stack of a thread, and of the threads that follow it (see L{follow}), at a fixed
+    interval from a background thread and count the samples of each distinct stack.
+    """
+
+    def __init__(self, thread_id, interval=0.005):
+        """
+        @param thread_id: identifier of the thread to sample
+        @keyword interval: seconds between samples
+        """
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}
+        self.followers = {}     # name of the following threads by identifier
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="bws-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    @contextmanager
+    def follow(self):
+        """ Sample this thread, which is running work for the request. """
+        thread = threading.current_thread()
+        self.followers[thread.ident] = thread.name
+        try:
+            yield
+        finally:
+            del self.followers[thread.ident]
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            # stacks of the following threads are rooted at the thread name
+            threads = [(self.thread_id, None)] + list(self.followers.copy().items())
+            for (thread_id, name) in threads:
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(code.co_name + " (" + os.path.basename(code.co_filename) + ":" +
+                                 str(code.co_firstlineno) + ")")
+                    frame = frame.f_back
+                if name is not None:
+                    stack.append(name)
+                key = ";".join(reversed(stack))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def write(self, filepath):
+        """ Write the sampled stacks in the collapsed stack format, i.e. 'frame;frame;frame count'. """
+        with open(filepath, 'w') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(stack + " " + str(count) + "\n")
+
+
+def get_profiler():
+    """
+    Get the profiler of the request run by this thread.
+    @return: profiler or None if the request is not profiled
+    """
+    return getattr(_local, "profiler", None)
+
+
+@contextmanager
+def follow(profiler):
+    """
+    Include the work run in this thread for a profiled request in its profile.
+    @param profiler: profiler of the request, see L{get_profiler}, or None if it is not profiled
+    """
+    if profiler is None or profiler.thread_id == threading.get_ident():
+        yield
+        return
+    with profiler.follow():
+        yield
+
+
+def is_profiled(request):
+    """
+    Return true if the request is to be profiled.
+    @param request: HTTP request
+    """
+    header = "HTTP_" + settings.PROFILE_HEADER.upper().replace("-", "_")
+    if request.META.get(header, "0") not in ("", "0") and getattr(request.user, "is_staff", False):
+        return True
+    return settings.PROFILE_SAMPLE_RATE > 0 and random.random() < settings.PROFILE_SAMPLE_RATE
+
+
+def profile(name):
+    """
+    Decorator for the post method of a view to profile requests, see L{is_profiled}.
+    @param name: name used as the prefix of the profile files, e.g. 'bws'
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(view, request, *args, **kwargs):
+            if not is_profiled(request):
+                return func(view, request, *args, **kwargs)
+
+            fmt = settings.PROFILE_FORMAT
+            if fmt not in FORMATS:
+                logger.error("Unknown PROFILE_FORMAT: " + str(fmt))
+                return func(view, request, *args, **kwargs)
+            filename = "%s_%s_%s_%s.%s" % (name, datetime.datetime.now().strftime("%Y%m%d-%H%M%S"),
+                                           str(request.user)[:20], uuid.uuid4().hex[:8],
+                                           "prof" if fmt == 'pstats' else "collapsed")
+            filepath = os.path.join(settings.PROFILE_DIR, filename)
+            start = time.time()
+            if fmt == 'pstats':
+                profiler = CProfiler()
+                try:
+                    profiler.start()
+                except ValueError as e:
+                    # only one cProfile profiler can be active at a time (python 3.12+)
+                    logger.warning("PROFILE NOT RUN: " + str(e))
+                    return func(view, request, *args, **kwargs)
+            else:
+                profiler = StackSampler(threading.get_ident(), interval=settings.PROFILE_INTERVAL)
+                profiler.start()
+            _local.profiler = profiler
+            try:
+                response = func(view, request, *args, **kwargs)
+            finally:
+                _local.profiler = None
+                profiler.stop()
+                try:
+                    os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+                    profiler.write(filepath)
+                    logger.info(f"PROFILE: user={request.user.id}; file={filepath}; "
+                                f"elapsed time={time.time() - start}")
+                except OSError as e:
+                    logger.error("PROFILE NOT WRITTEN: " + str(e))
+            if getattr(request.user, "is_staff", False):
+                response[settings.PROFILE_HEADER + "-File"] = filename
+            return response
+        return wrapper
+    return decorator
@@ -1,43 +1,97 @@
 ''' API for the BWS/OWS REST resources. '''
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 import datetime
 import logging
+import os
 import re
 import shutil
 import tempfile
 
 from django.conf import settings
-from django.http.response import JsonResponse
+from django.http.response import HttpResponse, JsonResponse
+from django.utils import translation
 from django.utils.translation import gettext_lazy as _
 from rest_framework import status
 from rest_framework.authentication import BasicAuthentication, TokenAuthentication, SessionAuthentication
 from rest_framework.compat import coreapi, coreschema
-from rest_framework.exceptions import ValidationError
+from rest_framework.exceptions import APIException, ValidationError
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.renderers import JSONRenderer, TemplateHTMLRenderer  # , BrowsableAPIRenderer
 from rest_framework.response import Response
 from rest_framework.schemas import ManualSchema
 from rest_framework.views import APIView
 
+from bws import estimate, metrics
 from bws.calcs import Predictions, ModelParams, RangeRisk
 from bws.pedigree import PedigreeFile, CanRiskPedigree, Prs
+from bws.profiling import follow, get_profiler, profile
 from bws.risk_factors.bc import BCRiskFactors
 from bws.risk_factors.oc import OCRiskFactors
 from bws.serializers import BwsInputSerializer, OutputSerializer, OwsInputSerializer, CombinedInputSerializer, \
     CombinedOutputSerializer, BCTenYrSerializer
-from bws.throttles import BurstRateThrottle, EndUserIDRateThrottle, SustainedRateThrottle
+from bws.throttles import BurstRateThrottle, EndUserIDRateThrottle, SustainedRateThrottle, \
+    PedigreeCostRateThrottle
 
 
 logger = logging.getLogger(__name__)
 
 
+def run_families(func, pedigrees):
+    """
+    Run a function for each family of a pedigree file. The families are independent so are run
+    in a pool of up to FAMILY_WORKERS threads, so that the model processes of the families run
+    at once.
+    @param func: function taking the index of the family in the file and its pedigree
+    @param pedigrees: pedigrees of the families
+    @return: list of the function results, or the validation or model run error (APIException) raised,
+    in the order of the pedigrees
+    """
+    language = translation.get_language()
+    profiler = get_profiler()
+
+    def run(idx, pedi):
+        try:
+            # the active language and profiler are set per thread
+            with translation.override(language), follow(profiler):
+                return func(idx, pedi)
+        except APIException as e:
+            # e.g. a validation or model error, time out, exceeded resource limit or full queue
+            logger.error(e)
+            return e
+
+    nworkers = min(settings.FAMILY_WORKERS, len(pedigrees))
+    if nworkers <= 1:
+        return [run(idx, pedi) for idx, pedi in enumerate(pedigrees)]
+    with ThreadPoolExecutor(max_workers=nworkers, thread_name_prefix="bws-family") as executor:
+        return list(executor.map(run, range(len(pedigrees)), pedigrees))
+
+
+def family_cwd(cwd, idx, nfamilies):
+    """
+    Get the working directory for the model files of a family, a sub-directory for each family
+    of a multi-family pedigree file as the files have the same names.
+    @param cwd: working directory of the request
+    @param idx: index of the family in the pedigree file
+    @param nfamilies: number of families in the pedigree file
+    """
+    if nfamilies == 1:
+        return cwd
+    path = os.path.join(cwd, str(idx))
+    os.mkdir(path)
+    return path
+
+
 class ModelWebServiceMixin():
 
     def post_to_model(self, request, model_settings):
         serializer = self.serializer_class(data=request.data)
         if serializer.is_valid(raise_exception=True):
             validated_data = serializer.validated_data
-            pf = PedigreeFile(validated_data.get('pedigree_data'))
+            mname = model_settings['NAME']
+            with metrics.Timer("parse", mname) as timer:
+                pf = PedigreeFile(validated_data.get('pedigree_data'))
+                timer.npeople = npeople = metrics.pedigrees_size(pf.pedigrees)
             params = ModelParams.factory(validated_data, model_settings)
 
             output = {
@@ -52,76 +106,167 @@ class ModelWebServiceMixin():
             if prs is not None:
                 prs = Prs(prs.get('alpha'), prs.get('zscore'))
 
-            try:
-                warnings = PedigreeFile.validate(pf.pedigrees)
-                if len(warnings) > 0:
-                    output['warnings'] = warnings
-            except ValidationError as e:
-                logger.error(e)
-                return JsonResponse(e.detail, content_type="application/json", status=status.HTTP_400_BAD_REQUEST)
-
             # note limit username string length used here to avoid paths too long for model code
             cwd = tempfile.mkdtemp(prefix=str(request.user)[:20]+"_", dir=settings.CWD_DIR)
+            nfamilies = len(pf.pedigrees)
             try:
-                for pedi in pf.pedigrees:
-                    risk_factor_code = 0
-                    this_params = deepcopy(params)
-                    # check if Ashkenazi Jewish status set & correct mutation frequencies
-                    if pedi.is_ashkn() and not settings.REGEX_ASHKN.match(params.population):
-                        msg = 'mutation frequencies set to Ashkenazi Jewish population values ' \
-                              'for family ('+pedi.famid+') as a family member has Ashkenazi Jewish status.'
-                        logger.debug('mutation frequencies set to Ashkenazi Jewish population values')
-                        if 'warnings' in output:
-                            output['warnings'].append(msg)
-                        else:
-                            output['warnings'] = [msg]
-                        this_params.isashk = True
-                        this_params.population = 'Ashkenazi'
-                        this_params.mutation_frequency = model_settings['MUTATION_FREQUENCIES']['Ashkenazi']
-
-                    if isinstance(pedi, CanRiskPedigree):
-                        # for canrisk format files check if risk factors and/or prs set in the header
-                        mname = model_settings['NAME']
-                        risk_factor_code = pedi.get_rfcode(mname)
-
-                        if prs is None or len(pf.pedigrees) > 1:
-                            prs = pedi.get_prs(mname)
-
-                    this_hgt = (pedi.hgt if hasattr(pedi, 'hgt') else -1)
-                    calcs = Predictions(pedi, model_params=this_params,
-                                        risk_factor_code=risk_factor_code, hgt=this_hgt, prs=prs,
-                                        cwd=cwd, request=request, model_settings=model_settings)
-                    # Add input parameters and calculated results as attributes to 'this_pedigree'
-                    this_pedigree = {}
-                    this_pedigree["family_id"] = pedi.famid
-                    this_pedigree["proband_id"] = pedi.get_target().pid
-                    this_pedigree["risk_factors"] = self.get_risk_factors(model_settings, risk_factor_code)
-                    this_pedigree["risk_factors"][_('Height (cm)')] = this_hgt if this_hgt != -1 else "-"
-                    if prs is not None:
-                        this_pedigree["prs"] = {'alpha': prs.alpha, 'zscore': prs.zscore}
-                    this_pedigree["mutation_frequency"] = {this_params.population: this_params.mutation_frequency}
-                    self.add_attr("version", output, calcs, output)
-                    self.add_attr("mutation_probabilties", this_pedigree, calcs, output)
-                    self.add_attr("cancer_risks", this_pedigree, calcs, output)
-                    self.add_attr("baseline_cancer_risks", this_pedigree, calcs, output)
-                    self.add_attr("lifetime_cancer_risk", this_pedigree, calcs, output)
-                    self.add_attr("baseline_lifetime_cancer_risk", this_pedigree, calcs, output)
-                    self.add_attr("ten_yr_cancer_risk", this_pedigree, calcs, output)
-                    self.add_attr("baseline_ten_yr_cancer_risk", this_pedigree, calcs, output)
-
-                    output["pedigree_result"].append(this_pedigree)
-            except ValidationError as e:
-                logger.error(e)
-                return JsonResponse(e.detail, content_type="application/json",
-                                    status=status.HTTP_400_BAD_REQUEST, safe=False)
+                results = run_families(
+                    lambda idx, pedi: self.get_family_result(request, pedi, params, prs, model_settings,
+                                                             family_cwd(cwd, idx, nfamilies), nfamilies > 1),
+                    pf.pedigrees)
             finally:
                 shutil.rmtree(cwd)
                 # print(model_settings['NAME']+" :: "+cwd)
-            output_serialiser = OutputSerializer(output)
-            return Response(output_serialiser.data, template_name='result_tab_gp.html')
+            response = self.add_family_results(output, pf.pedigrees, results)
+            if response is not None:
+                return response
+            with metrics.Timer("serialise", mname, npeople=npeople):
+                data = OutputSerializer(output).data
+            return Response(data, template_name='result_tab_gp.html')
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    def estimate_model(self, request, model_settings):
+        """
+        Dry run of the model calculations. The pedigrees are parsed and validated and the run time
+        of the calculations is estimated (see L{bws.estimate}) without running the model.
+        @param request: HTTP request
+        @param model_settings: model settings
+        @return: response with the pedigree features and estimated seconds of each calculation
+        """
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        mname = model_settings['NAME']
+        pf = PedigreeFile(serializer.validated_data.get('pedigree_data'))
+        PedigreeFile.validate_cached(pf.pedigrees, mname)
+        results = []
+        for pedi in pf.pedigrees:
+            estimates = estimate.get_estimate(pedi, model_settings)
+            results.append({
+                "family_id": pedi.famid,
+                "features": estimate.get_features(pedi, model_settings),
+                "estimated_time": estimates,
+                "total_estimated_time": sum(estimates.values())
+            })
+        total = sum(r["total_estimated_time"] for r in results)
+        logger.info(f"{mname} ESTIMATE: user={request.user.id}; families={len(results)}; estimated time={total}")
+        return Response({
+            "timestamp": datetime.datetime.now(),
+            "total_estimated_time": total,
+            "pedigree_result": results
+        })
+
+    def get_family_result(self, request, pedi, params, prs, model_settings, cwd, multi):
+        """
+        Validate a family and run the model calculations for it.
+        @param request: HTTP request
+        @param pedi: pedigree of the family
+        @param params: model parameters
+        @param prs: polygenic risk score from the request or None
+        @param model_settings: model settings
+        @param cwd: working directory for the model files of the family
+        @param multi: true if the family is one of several in the pedigree file
+        @return: dictionary of the family 'pedigree_result', model 'version', 'validation_warnings'
+        and other 'warnings'
+        """
+        mname = model_settings['NAME']
+        family = {"warnings": []}
+        with metrics.Timer("validate", mname, npeople=len(pedi.people)):
+            family["validation_warnings"] = PedigreeFile.validate_cached(pedi, mname)
+        (this_params, risk_factor_code, prs, this_hgt) = \
+            self.get_family_params(pedi, params, prs, model_settings, multi, family)
+
+        calcs = Predictions(pedi, model_params=this_params,
+                            risk_factor_code=risk_factor_code, hgt=this_hgt, prs=prs,
+                            cwd=cwd, request=request, model_settings=model_settings)
+        # Add input parameters and calculated results as attributes to 'this_pedigree'
+        this_pedigree = self.get_family_attrs(pedi, this_params, risk_factor_code, prs, this_hgt, model_settings)
+        self.add_attr("version", family, calcs, family)
+        self.add_attr("mutation_probabilties", this_pedigree, calcs, family)
+        self.add_attr("cancer_risks", this_pedigree, calcs, family)
+        self.add_attr("baseline_cancer_risks", this_pedigree, calcs, family)
+        self.add_attr("lifetime_cancer_risk", this_pedigree, calcs, family)
+        self.add_attr("baseline_lifetime_cancer_risk", this_pedigree, calcs, family)
+        self.add_attr("ten_yr_cancer_risk", this_pedigree, calcs, family)
+        self.add_attr("baseline_ten_yr_cancer_risk", this_pedigree, calcs, family)
+        family["pedigree_result"] = this_pedigree
+        return family
+
+    def get_family_params(self, pedi, params, prs, model_settings, multi, family):
+        """
+        Get the model parameters, risk factor code, PRS and height used for a family.
+        @param pedi: pedigree of the family
+        @param params: model parameters from the request
+        @param prs: polygenic risk score from the request or None
+        @param model_settings: model settings
+        @param multi: true if the family is one of several in the pedigree file
+        @param family: family result the warnings are added to
+        @return: tuple of the model parameters, risk factor code, PRS and height
+        """
+        risk_factor_code = 0
+        this_params = deepcopy(params)
+        # check if Ashkenazi Jewish status set & correct mutation frequencies
+        if pedi.is_ashkn() and not settings.REGEX_ASHKN.match(params.population):
+            msg = 'mutation frequencies set to Ashkenazi Jewish population values ' \
+                  'for family ('+pedi.famid+') as a family member has Ashkenazi Jewish status.'
+            logger.debug('mutation frequencies set to Ashkenazi Jewish population values')
+            family['warnings'].append(msg)
+            this_params.isashk = True
+            this_params.population = 'Ashkenazi'
+            this_params.mutation_frequency = model_settings['MUTATION_FREQUENCIES']['Ashkenazi']
+
+        if isinstance(pedi, CanRiskPedigree):
+            # for canrisk format files check if risk factors and/or prs set in the header
+            mname = model_settings['NAME']
+            risk_factor_code = pedi.get_rfcode(mname)
+
+            if prs is None or multi:
+                prs = pedi.get_prs(mname)
+
+        this_hgt = (pedi.hgt if hasattr(pedi, 'hgt') else -1)
+        return (this_params, risk_factor_code, prs, this_hgt)
+
+    def get_family_attrs(self, pedi, params, risk_factor_code, prs, hgt, model_settings):
+        """ Get the input parameters of a family result. """
+        this_pedigree = {}
+        this_pedigree["family_id"] = pedi.famid
+        this_pedigree["proband_id"] = pedi.get_target().pid
+        this_pedigree["risk_factors"] = self.get_risk_factors(model_settings, risk_factor_code)
+        this_pedigree["risk_factors"][_('Height (cm)')] = hgt if hgt != -1 else "-"
+        if prs is not None:
+            this_pedigree["prs"] = {'alpha': prs.alpha, 'zscore': prs.zscore}
+        this_pedigree["mutation_frequency"] = {params.population: params.mutation_frequency}
+        return this_pedigree
+
+    def add_family_results(self, output, pedigrees, results):
+        """
+        Add the results of the families to the output in the order of the families in the pedigree
+        file. The validation warnings of all the families are added before the other warnings.
+        @param output: web-service output
+        @param pedigrees: pedigrees of the families
+        @param results: family results or the error raised for each family, see L{run_families}
+        @return: bad request response if there is no result for any of the families, otherwise None
+        """
+        errors = [r for r in results if isinstance(r, APIException)]
+        if len(errors) == len(results):
+            if not isinstance(errors[0], ValidationError):
+                raise errors[0]     # with its status code, e.g. 503 with a Retry-After
+            return JsonResponse(errors[0].detail, content_type="application/json",
+                                status=status.HTTP_400_BAD_REQUEST, safe=False)
+
+        warnings = [w for r in results if not isinstance(r, APIException) for w in r["validation_warnings"]]
+        for pedi, result in zip(pedigrees, results):
+            if isinstance(result, APIException):
+                output["pedigree_result"].append({"family_id": pedi.famid, "error": result.detail})
+            else:
+                output["pedigree_result"].append(result["pedigree_result"])
+                warnings.extend(result["warnings"])
+                if "version" in result:
+                    output["version"] = result["version"]
+        if len(warnings) > 0:
+            output['warnings'] = warnings
+        return None
+
     def get_risk_factors(self, model_settings, risk_factor_code):
         ''' Get a dictionary of the decoded risk factor categories from the risk factor code. '''
         rf_cls = BCRiskFactors if model_settings['NAME'] == 'BC' else OCRiskFactors
@@ -242,7 +387,7 @@ class BwsView(APIView, ModelWebServiceMixin):
     serializer_class = BwsInputSerializer
     authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication, )
     permission_classes = (IsAuthenticated,)
-    throttle_classes = (BurstRateThrottle, SustainedRateThrottle, EndUserIDRateThrottle)
+    throttle_classes = (BurstRateThrottle, SustainedRateThrottle, EndUserIDRateThrottle, PedigreeCostRateThrottle)
     model = settings.BC_MODEL
     if coreapi is not None and coreschema is not None:
         schema = ManualSchema(
@@ -256,7 +401,7 @@ for each the genes and the population to use for cancer incidence rates.
 """
         )
 
-    # @profile("profile_bws.profile")
+    @profile("bws")
     def post(self, request):
         """
         BOADICEA Web-Service (BWS) used to calculate the risks of breast cancer and the probability
@@ -341,7 +486,7 @@ class OwsView(APIView, ModelWebServiceMixin):
     serializer_class = OwsInputSerializer
     authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication, )
     permission_classes = (IsAuthenticated,)
-    throttle_classes = (BurstRateThrottle, SustainedRateThrottle, EndUserIDRateThrottle)
+    throttle_classes = (BurstRateThrottle, SustainedRateThrottle, EndUserIDRateThrottle, PedigreeCostRateThrottle)
     model = settings.OC_MODEL
     if coreapi is not None and coreschema is not None:
         schema = ManualSchema(
@@ -355,7 +500,7 @@ for each the genes and the population to use for cancer incidence rates.
 """
             )
 
-    # @profile("profile_bws.profile")
+    @profile("ows")
     def post(self, request):
         """
         Ovarian Web-Service (OWS) used to calculate the risks of ovarian cancer and the probability
@@ -432,6 +577,30 @@ for each the genes and the population to use for cancer incidence rates.
         return self.post_to_model(request, settings.OC_MODEL)
 
 
+class BwsEstimateView(BwsView):
+    """
+    Dry run of the BOADICEA Web-Service that estimates the model run time (in seconds) of the
+    calculations for each family, without running them.
+    """
+    renderer_classes = (JSONRenderer, )
+    throttle_classes = (BurstRateThrottle, SustainedRateThrottle, EndUserIDRateThrottle)
+
+    def post(self, request):
+        return self.estimate_model(request, settings.BC_MODEL)
+
+
+class OwsEstimateView(OwsView):
+    """
+    Dry run of the Ovarian Web-Service that estimates the model run time (in seconds) of the
+    calculations for each family, without running them.
+    """
+    renderer_classes = (JSONRenderer, )
+    throttle_classes = (BurstRateThrottle, SustainedRateThrottle, EndUserIDRateThrottle)
+
+    def post(self, request):
+        return self.estimate_model(request, settings.OC_MODEL)
+
+
 class BCTenYrView(APIView, ModelWebServiceMixin):
     """
     Ten year breast cancer risks calculation Web-Service
@@ -440,7 +609,7 @@ class BCTenYrView(APIView, ModelWebServiceMixin):
     serializer_class = BCTenYrSerializer
     authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication, )
     permission_classes = (IsAuthenticated,)
-    throttle_classes = (BurstRateThrottle, SustainedRateThrottle, EndUserIDRateThrottle)
+    throttle_classes = (BurstRateThrottle, SustainedRateThrottle, EndUserIDRateThrottle, PedigreeCostRateThrottle)
     model = settings.BC_MODEL
     if coreapi is not None and coreschema is not None:
         fields = ModelWebServiceMixin.get_fields(model)
@@ -465,12 +634,14 @@ ages to calculate the 10-year risks for, e.g. [25, 26, 27, 28, 29] or [29].
 """
         )
 
-    # @profile("profile_bws.profile")
+    @profile("bc_tenyr")
     def post(self, request):
         serializer = self.serializer_class(data=request.data)
         if serializer.is_valid(raise_exception=True):
             validated_data = serializer.validated_data
-            pf = PedigreeFile(validated_data.get('pedigree_data'))
+            with metrics.Timer("parse", "BC", "ten_year") as timer:
+                pf = PedigreeFile(validated_data.get('pedigree_data'))
+                timer.npeople = npeople = metrics.pedigrees_size(pf.pedigrees)
             model_settings = settings.BC_MODEL
             params = ModelParams.factory(validated_data, model_settings)
 
@@ -489,78 +660,56 @@ ages to calculate the 10-year risks for, e.g. [25, 26, 27, 28, 29] or [29].
             if prs is not None:
                 prs = Prs(prs.get('alpha'), prs.get('zscore'))
 
-            try:
-                warnings = PedigreeFile.validate(pf.pedigrees)
-                if len(warnings) > 0:
-                    output['warnings'] = warnings
-            except ValidationError as e:
-                logger.error(e)
-                return JsonResponse(e.detail, content_type="application/json", status=status.HTTP_400_BAD_REQUEST)
-
             # note limit username string length used here to avoid paths too long for model code
             cwd = tempfile.mkdtemp(prefix=str(request.user)[:20]+"_", dir=settings.CWD_DIR)
+            nfamilies = len(pf.pedigrees)
             try:
-                for pedi in pf.pedigrees:
-                    risk_factor_code = 0
-                    this_params = deepcopy(params)
-                    # check if Ashkenazi Jewish status set & correct mutation frequencies
-                    if pedi.is_ashkn() and not settings.REGEX_ASHKN.match(params.population):
-                        msg = 'mutation frequencies set to Ashkenazi Jewish population values ' \
-                              'for family ('+pedi.famid+') as a family member has Ashkenazi Jewish status.'
-                        logger.debug('mutation frequencies set to Ashkenazi Jewish population values')
-                        if 'warnings' in output:
-                            output['warnings'].append(msg)
-                        else:
-                            output['warnings'] = [msg]
-                        this_params.isashk = True
-                        this_params.population = 'Ashkenazi'
-                        this_params.mutation_frequency = model_settings['MUTATION_FREQUENCIES']['Ashkenazi']
-
-                    if isinstance(pedi, CanRiskPedigree):
-                        # for canrisk format files check if risk factors and/or prs set in the header
-                        mname = model_settings['NAME']
-                        risk_factor_code = pedi.get_rfcode(mname)
-
-                        if prs is None or len(pf.pedigrees) > 1:
-                            prs = pedi.get_prs(mname)
-
-                    this_hgt = (pedi.hgt if hasattr(pedi, 'hgt') else -1)
-                    calcs = Predictions(pedi, model_params=this_params,
-                                        risk_factor_code=risk_factor_code, hgt=this_hgt, prs=prs, run_risks=False,
-                                        cwd=cwd, request=request, model_settings=model_settings)
-                    calcs.niceness = Predictions._get_niceness(calcs.pedi)
-
-                    calcs.ten_yr_cancer_risk = []
-                    for tenyr in tenyr_ages:
-                        ten_yr_risk = RangeRisk(calcs, int(tenyr), int(tenyr+10), "10 YR RANGE").get_risk()
-                        if ten_yr_risk is not None:
-                            calcs.ten_yr_cancer_risk.append(ten_yr_risk[0])
-
-                    # Add input parameters and calculated results as attributes to 'this_pedigree'
-                    this_pedigree = {}
-                    this_pedigree["family_id"] = pedi.famid
-                    this_pedigree["proband_id"] = pedi.get_target().pid
-                    this_pedigree["risk_factors"] = self.get_risk_factors(model_settings, risk_factor_code)
-                    this_pedigree["risk_factors"][_('Height (cm)')] = this_hgt if this_hgt != -1 else "-"
-                    if prs is not None:
-                        this_pedigree["prs"] = {'alpha': prs.alpha, 'zscore': prs.zscore}
-                    this_pedigree["mutation_frequency"] = {this_params.population: this_params.mutation_frequency}
-                    self.add_attr("version", output, calcs, output)
-                    self.add_attr("ten_yr_cancer_risk", this_pedigree, calcs, output)
-
-                    output["pedigree_result"].append(this_pedigree)
-            except ValidationError as e:
-                logger.error(e)
-                return JsonResponse(e.detail, content_type="application/json",
-                                    status=status.HTTP_400_BAD_REQUEST, safe=False)
+                results = run_families(
+                    lambda idx, pedi: self.get_tenyr_result(request, pedi, params, prs, tenyr_ages,
+                                                            family_cwd(cwd, idx, nfamilies), nfamilies > 1),
+                    pf.pedigrees)
             finally:
                 shutil.rmtree(cwd)
                 # print("BCTenYr :: "+cwd)
-            output_serialiser = OutputSerializer(output)
-            return Response(output_serialiser.data, template_name='result_tab_gp.html')
+            response = self.add_family_results(output, pf.pedigrees, results)
+            if response is not None:
+                return response
+            with metrics.Timer("serialise", "BC", "ten_year", npeople):
+                data = OutputSerializer(output).data
+            return Response(data, template_name='result_tab_gp.html')
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    def get_tenyr_result(self, request, pedi, params, prs, tenyr_ages, cwd, multi):
+        """
+        Validate a family and calculate the 10-year risks for it, see L{get_family_result}.
+        @param tenyr_ages: list of ages to calculate the 10-year risks for
+        """
+        model_settings = settings.BC_MODEL
+        family = {"warnings": []}
+        with metrics.Timer("validate", "BC", "ten_year", len(pedi.people)):
+            family["validation_warnings"] = PedigreeFile.validate_cached(pedi, "BC")
+        (this_params, risk_factor_code, prs, this_hgt) = \
+            self.get_family_params(pedi, params, prs, model_settings, multi, family)
+
+        calcs = Predictions(pedi, model_params=this_params,
+                            risk_factor_code=risk_factor_code, hgt=this_hgt, prs=prs, run_risks=False,
+                            cwd=cwd, request=request, model_settings=model_settings)
+        calcs.niceness = Predictions._get_niceness(calcs.pedi)
+
+        calcs.ten_yr_cancer_risk = []
+        for tenyr in tenyr_ages:
+            ten_yr_risk = RangeRisk(calcs, int(tenyr), int(tenyr+10), "10 YR RANGE").get_risk()
+            if ten_yr_risk is not None:
+                calcs.ten_yr_cancer_risk.append(ten_yr_risk[0])
+
+        # Add input parameters and calculated results as attributes to 'this_pedigree'
+        this_pedigree = self.get_family_attrs(pedi, this_params, risk_factor_code, prs, this_hgt, model_settings)
+        self.add_attr("version", family, calcs, family)
+        self.add_attr("ten_yr_cancer_risk", this_pedigree, calcs, family)
+        family["pedigree_result"] = this_pedigree
+        return family
+
 
 class CombineModelResultsView(APIView):
     """
@@ -603,3 +752,14 @@ class CombineModelResultsView(APIView):
             validated_data = serializer.validated_data
             output_serialiser = CombinedOutputSerializer(validated_data)
             return Response(output_serialiser.data, template_name='result_tab.html')
+
+
+class MetricsView(APIView):
+    """
+    Request pipeline timing metrics in the Prometheus text format, for scraping by a monitoring server.
+    """
+    authentication_classes = (SessionAuthentication, BasicAuthentication, TokenAuthentication, )
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request):
+        return HttpResponse(metrics.expose(), content_type="text/plain; version=0.0.4; charset=utf-8")
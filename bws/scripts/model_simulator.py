@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+#
+# Stand-in for the BOADICEA (boadicea.exe) and ovarian (ovarian.exe) model executables, used to
+# load test and benchmark the web-services without the licensed Fortran binaries. It takes the
+# same arguments as the model executables, reads the pedigree and batch files written by the
+# web-service and writes mutation carrier probability or cancer risk output files in the same
+# format. Results are plausible but NOT clinically meaningful.
+#
+# usage: model_simulator.py -v
+#        model_simulator.py [-p] [-s PARAMS] [-o OUTPUT] BATCH_FILE INCIDENCE_FILE
+#        model_simulator.py --install FORTRAN_HOME
+#
+# --install creates the directory layout expected by bws.settings (model HOME directories,
+# executables, Data/locus.loc and incidence rate files) under FORTRAN_HOME, e.g.
+#    model_simulator.py --install /tmp/boadicea_sim
+# and then set FORTRAN_HOME = "/tmp/boadicea_sim/" in the settings.
+#
+# The run time is simulated as:
+#    BWS_SIM_BASE + BWS_SIM_PER_PERSON x (no. of people) x (no. of genotypes or risk ages)
+# seconds, by busy looping (BWS_SIM_MODE=spin, default) or sleeping (BWS_SIM_MODE=sleep).
+#
+# Environment variables:
+#  BWS_SIM_GENES       comma separated gene names (default: by the number of genes in the pedigree file)
+#  BWS_SIM_BASE        fixed run time in seconds (default: 0.005)
+#  BWS_SIM_PER_PERSON  run time in seconds per person per genotype/risk age (default: 0.0001)
+#  BWS_SIM_MODE        'spin' to use CPU or 'sleep' (default: spin)
+#  BWS_SIM_NAME        version name reported with -v (default: name of the executable)
+
+import argparse
+import math
+import os
+import re
+import stat
+import sys
+import time
+
+
+GENES = {
+    8: ['BRCA1', 'BRCA2', 'PALB2', 'CHEK2', 'ATM', 'BARD1', 'RAD51C', 'RAD51D'],
+    6: ['BRCA1', 'BRCA2', 'RAD51D', 'RAD51C', 'BRIP1', 'PALB2']
+}
+
+
+class SimulatorError(Exception):
+    pass
+
+
+def read_batch_file(bat_file):
+    ''' Get the pedigree file and the list of risk age offsets from a batch file. '''
+    with open(bat_file, 'r') as f:
+        lines = [line.strip() for line in f]
+    ped_file = None
+    offsets = []
+    for code, value in zip(lines[0::2], lines[1::2]):     # option code followed by its value
+        if code == "3":
+            ped_file = value
+        elif code == "9":
+            offsets.append(int(value))
+    if ped_file is None:
+        raise SimulatorError("ERRORS IN THE BATCH FILE: no pedigree file")
+    return ped_file, offsets
+
+
+def read_pedigree_file(ped_file):
+    '''
+    Read the pedigree file written by Pedigree.write_pedigree_file.
+    @return: number of cancer columns, number of genes and a list of the pedigree blocks
+    (one per target genotype), each a list of people as dictionaries
+    '''
+    with open(ped_file, 'r') as f:
+        lines = f.read().splitlines()
+    fmt = lines[1]
+    ncancers = int(re.search(r"(\d+)\(A3,X\),\d+\(A2,X\)", fmt).group(1)) - 1
+    ngenes = int(re.search(r"(\d+)\(A2,X\)", fmt).group(1))
+
+    blocks = []
+    idx = 2
+    while idx < len(lines):
+        if lines[idx].strip() == "":
+            idx += 1
+            continue
+        npeople = int(lines[idx].split()[0])
+        people = []
+        for line in lines[idx+1:idx+1+npeople]:
+            tail = line[36:].split()
+            people.append({
+                'pid': line[0:7].strip(),
+                'fathid': line[8:15].strip(),
+                'mothid': line[16:23].strip(),
+                'sex': line[24:25],
+                'mztwin': line[26:27].strip(),
+                'cancers': [int(a) for a in tail[:ncancers]],
+                'age': int(tail[ncancers]),
+                'gtests': tail[ncancers+1:ncancers+1+ngenes],
+                'target': tail[-5] == "1",
+                'rfcode': int(tail[-4]),
+                'zscore': float(tail[-1])
+            })
+        blocks.append(people)
+        idx += 1 + npeople
+    return ncancers, ngenes, blocks
+
+
+def read_param_file(params):
+    ''' Get the allele frequencies from a model parameters file. '''
+    if params is None:
+        return []
+    with open(params, 'r') as f:
+        return [float(m.group(1)) for m in re.finditer(r"ALLELE_FRQ\(\s*\d+\s*\)\s*=\s*([-+.eE\d]+)", f.read())]
+
+
+def check_pedigree(people):
+    ''' Checks made by the model on the pedigree. '''
+    twins = {}
+    for p in people:
+        if p['mztwin'] != '':
+            twins[p['mztwin']] = twins.get(p['mztwin'], 0) + 1
+    if any(n != 2 for n in twins.values()) or sum(1 for p in people if p['target']) != 1:
+        raise SimulatorError("ERRORS IN THE PEDIGREE FILE")
+
+
+def simulate_run_time(npeople, nruns):
+    ''' Use up the simulated run time. '''
+    run_time = (float(os.environ.get('BWS_SIM_BASE', 0.005)) +
+                float(os.environ.get('BWS_SIM_PER_PERSON', 0.0001)) * npeople * max(nruns, 1))
+    if os.environ.get('BWS_SIM_MODE', 'spin') == 'sleep':
+        time.sleep(run_time)
+        return
+    end = time.process_time() + run_time
+    x = 0.0
+    while time.process_time() < end:
+        for i in range(1000):
+            x += math.sqrt(i)
+
+
+def family_load(people, allele_freqs):
+    '''
+    A deterministic score for the pedigree that increases with the number of cancers and positive
+    genetic tests in the family, the allele frequencies and the target's risk factors and
+    polygenic z-score.
+    '''
+    affected = sum(1 for p in people for a in p['cancers'] if a > 0)
+    positive = sum(1 for p in people for g in p['gtests'] if g in ('1', '3'))
+    target = [p for p in people if p['target']][0]
+    return (0.5 * affected / max(len(people), 1) + 0.3 * positive + 0.2 * target['zscore'] +
+            0.05 * math.log1p(target['rfcode']) + 10 * sum(allele_freqs))
+
+
+def write_probs(out, genes, people, allele_freqs):
+    ''' Write mutation carrier probabilities. '''
+    load = family_load(people, allele_freqs)
+    probs = [0.001 * (i+1) * math.exp(5 * math.tanh(load / 5)) / len(genes) for i in range(len(genes))]
+    total = sum(probs)
+    if total > 0.9:
+        probs = [p * 0.9 / total for p in probs]
+    with open(out, 'w') as f:
+        print("# simulated mutation carrier probabilities", file=f)
+        print(",".join(["NONE"] + genes), file=f)
+        print(",".join(["%.8f" % (1.0 - sum(probs))] + ["%.8f" % p for p in probs]), file=f)
+
+
+def write_risks(out, people, offsets, allele_freqs):
+    ''' Write cancer risks at each of the risk ages. '''
+    target = [p for p in people if p['target']][0]
+    rr = math.exp(3 * math.tanh(family_load(people, allele_freqs) / 3))
+
+    def cumulative(age):
+        return 1.0 - math.exp(-rr * 2e-5 * max(age - 20, 0) ** 1.8)
+
+    base = cumulative(target['age'])
+    with open(out, 'w') as f:
+        print("# simulated cancer risks", file=f)
+        print("age,risk", file=f)
+        for offset in offsets:
+            if offset == 0:
+                continue
+            age = target['age'] + offset
+            print("%d,%.8f" % (age, (cumulative(age) - base) / (1.0 - base)), file=f)
+
+
+def run(args):
+    if not os.path.isfile(args.incidence):
+        raise SimulatorError("INCIDENCE FILE NOT FOUND: " + args.incidence)
+    if args.settings is not None and not os.path.isfile(args.settings):
+        raise SimulatorError("SETTINGS FILE NOT FOUND: " + args.settings)
+
+    ped_file, offsets = read_batch_file(args.batch)
+    _ncancers, ngenes, blocks = read_pedigree_file(ped_file)
+    people = blocks[0]
+    check_pedigree(people)
+    allele_freqs = read_param_file(args.settings)
+    genes = os.environ['BWS_SIM_GENES'].split(',') if 'BWS_SIM_GENES' in os.environ else GENES[ngenes]
+
+    if args.probs:
+        simulate_run_time(len(people), len(blocks))
+        write_probs(args.output or "can_probs.out", genes, people, allele_freqs)
+    else:
+        simulate_run_time(len(people), len(offsets))
+        write_risks(args.output or "can_risks.out", people, offsets, allele_freqs)
+
+
+def install(fortran_home):
+    ''' Create the model directories, executables and data files under fortran_home. '''
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+    from bws import settings
+
+    script = os.path.abspath(__file__)
+    for model in (settings.BC_MODEL, settings.OC_MODEL):
+        home = os.path.join(fortran_home, os.path.basename(model['HOME']))
+        os.makedirs(os.path.join(home, 'Data'), exist_ok=True)
+        exe = os.path.join(home, model['EXE'])
+        with open(exe, 'w') as f:
+            print("#!/bin/sh", file=f)
+            print('BWS_SIM_GENES="' + ','.join(model['GENES']) + '" exec "' + sys.executable + '" "' +
+                  script + '" "$@"', file=f)
+        os.chmod(exe, os.stat(exe).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+        open(os.path.join(home, 'Data', 'locus.loc'), 'a').close()
+        for rates in set(model['CANCER_RATES'].values()):
+            with open(os.path.join(home, 'Data', 'incidences_' + rates + '.nml'), 'w') as f:
+                print("&incidences\n/", file=f)
+        print("Installed " + exe)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Stand-in for the BOADICEA and ovarian model executables')
+    parser.add_argument('-v', '--version', action='store_true', help='print the version')
+    parser.add_argument('-p', '--probs', action='store_true', help='mutation carrier probability calculation')
+    parser.add_argument('-s', '--settings', help='model parameters file')
+    parser.add_argument('-o', '--output', help='output file')
+    parser.add_argument('--install', metavar='FORTRAN_HOME', help='install the simulator as the model executables')
+    parser.add_argument('batch', nargs='?', help='batch file')
+    parser.add_argument('incidence', nargs='?', help='cancer incidence rates file')
+    args = parser.parse_args()
+
+    if args.version:
+        print(os.environ.get('BWS_SIM_NAME', os.path.basename(sys.argv[0]).replace('.py', '') + '-simulator'))
+    elif args.install:
+        install(args.install)
+    else:
+        if args.batch is None or args.incidence is None:
+            parser.error("the batch and incidence rate files are required")
+        try:
+            run(args)
+        except SimulatorError as e:
+            print(str(e), file=sys.stderr)
+            sys.exit(1)
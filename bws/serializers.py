@@ -28,10 +28,24 @@ class FileField(serializers.Field):
             return obj
 
 
+class PedigreeFileField(FileField):
+    """
+    Pedigree file field, limited to MAX_PEDIGREE_FILE_SIZE bytes.
+    """
+    def to_internal_value(self, obj):
+        assert(isinstance(obj, str) or isinstance(obj, File))
+
+        # reject large files before reading and decoding them
+        if (obj.size if isinstance(obj, File) else len(obj)) > settings.MAX_PEDIGREE_FILE_SIZE:
+            raise serializers.ValidationError("Pedigree file is larger than the maximum size of " +
+                                              str(settings.MAX_PEDIGREE_FILE_SIZE) + " bytes.")
+        return super().to_internal_value(obj)
+
+
 class BaseInputSerializer(serializers.Serializer):
     """ Base serializer for cancer risk calculation input. """
     user_id = serializers.CharField(min_length=4, max_length=40, required=True)
-    pedigree_data = FileField()
+    pedigree_data = PedigreeFileField()
 
     @classmethod
     def get_mutation_frequency_field(cls, model):
@@ -123,6 +137,7 @@ class PedigreeResultSerializer(serializers.Serializer):
     ten_yr_cancer_risk = serializers.ListField(read_only=True, required=False)
     baseline_ten_yr_cancer_risk = serializers.ListField(read_only=True, required=False)
     mutation_probabilties = serializers.ListField(read_only=True)
+    error = serializers.JSONField(read_only=True, required=False)
 
 
 class OutputSerializer(serializers.Serializer):
@@ -15,6 +15,14 @@ def get_alpha(ref_file):
 # FORTRAN settings
 FORTRAN_HOME = "/home/tim/boadicea/"
 FORTRAN_TIMEOUT = 60*4   # seconds
+FORTRAN_KILL_GRACE = 5    # seconds between SIGTERM and SIGKILL when a model process is killed
+# Resource budgets of the model processes (see bws.budget), the first tier with a maximum number of
+# people at least the size of the pedigree is used
+FORTRAN_BUDGETS = [
+    (50, {'address_space': 8*1024**3, 'cpu_time': 4*60, 'open_files': 256}),
+    (275, {'address_space': 32*1024**3, 'cpu_time': 4*FORTRAN_TIMEOUT, 'open_files': 256}),
+]
+FORTRAN_CGROUP = None     # cgroup v2 directory for the model process cgroups, e.g. '/sys/fs/cgroup/bws'
 CWD_DIR = "/tmp"
 
 # Environment variables for OpenBLAS (http://www.openblas.net)
@@ -23,13 +31,62 @@ FORTRAN_ENV['LD_LIBRARY_PATH'] = (FORTRAN_ENV['LD_LIBRARY_PATH']
                                   if 'LD_LIBRARY_PATH' in FORTRAN_ENV else "") + ":/usr/local/lib"
 FORTRAN_ENV['OMP_STACKSIZE'] = '10M'
 FORTRAN_ENV['OPENBLAS_NUM_THREADS'] = '1'
+# OpenMP and OpenBLAS threads of a model run, chosen from its estimated run time and the idle cores
+FORTRAN_MAX_THREADS = 4     # maximum number of threads of a model run, 1 to always run single threaded
+FORTRAN_THREADS_COST = 30   # estimated run time (s) of a model run for each of its threads
+# pin the model runs to CPUs (see bws.placement), None, 'node' (a NUMA node) or 'cores' (own cores on a NUMA node)
+FORTRAN_AFFINITY = None
+
+# model parameter files shared by the model runs with the same settings, named by a hash of their content
+PARAMS_DIR = os.path.join(CWD_DIR, "bws_params")
+# precomputed baseline risk tables (see bws.baseline), None to always run the model for the baseline risks
+BASELINE_TABLES_DIR = os.path.join(CWD_DIR, "bws_baseline")
+# model run time estimates (see bws.estimate) fitted by the fit_cost_model command
+COST_MODEL_FILE = os.path.join(CWD_DIR, "bws_cost_model.json")
+
+# Host-wide admission control for the model processes, shared by all the web-service workers
+FORTRAN_MAX_PROCESSES = os.cpu_count() or 1             # maximum number of model processes run at once
+FORTRAN_QUEUE_SIZE = 4*FORTRAN_MAX_PROCESSES            # maximum number of model runs waiting for a slot
+FORTRAN_QUEUE_TIMEOUT = 60                              # seconds to wait for a slot
+FORTRAN_RETRY_AFTER = 30                                # seconds, Retry-After when the queue is full
+FORTRAN_QUEUE_AGING = 10    # estimated run time (s) a queued run is brought forward per second waited, 0 for none
+FORTRAN_SHARE_WEIGHTS = {}  # fair share weights of the API accounts by username, default 1, e.g. {'canrisk': 4}
+FORTRAN_LOCK_DIR = os.path.join(CWD_DIR, "bws_slots")   # slot lock files and queue tickets
+FAMILY_WORKERS = 4                                      # families of a pedigree file run at once
+FORTRAN_COALESCE_DIR = os.path.join(CWD_DIR, "bws_inflight")  # identical runs in flight, None to not coalesce
+
+# Request pipeline stage timing and model process resource usage metrics, stored in the cache
+# so that a shared cache (e.g. memcached) aggregates the metrics of all the web-service workers
+METRICS_ENABLED = True
+METRICS_CACHE = 'default'
+METRICS_BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 240]    # seconds
+METRICS_SIZE_BUCKETS = [1, 10, 25, 50, 100, 275]     # upper bounds of the pedigree size labels
+METRICS_COST_BUCKETS = [1, 10, 60]                   # upper bounds of the estimated run time labels, seconds
+METRICS_RSS_BUCKETS = [2**n * 1024 * 1024 for n in range(4, 14)]   # model process memory, 16MB to 8GB
+
+# Opt-in request profiling, see bws.profiling
+PROFILE_HEADER = "X-BWS-Profile"     # request header used by admin users to profile a request
+PROFILE_SAMPLE_RATE = 0.0            # fraction of requests profiled at random
+PROFILE_FORMAT = 'pstats'            # 'pstats' (cProfile) or 'collapsed' (sampled stacks for flame graphs)
+PROFILE_INTERVAL = 0.005             # seconds between stack samples for the 'collapsed' format
+PROFILE_DIR = os.path.join(CWD_DIR, "bws_profiles")
 
 # wkhtmltopdf executable used to generate PDF from HTML
 # WKHTMLTOPDF = '/usr/bin/wkhtmltopdf'
 # WKHTMLTOPDF_TIMEOUT = 10  # seconds
 REGEX_ASHKN = re.compile("^(Ashkenazi)$")
 
+# time (seconds) to cache the index of the VCF records at the PRS reference positions
+VCF_INDEX_CACHE_TIMEOUT = 60*60
+# maximum number of z-scores converted to percentages in a single request
+MAX_ZSCORES = 10000
+
 MAX_PEDIGREE_SIZE = 275
+# limits checked before the pedigree file is parsed into pedigrees
+MAX_PEDIGREE_FILE_SIZE = 5*1024*1024        # maximum size (bytes) of a pedigree file
+MAX_PEDIGREE_FILE_LINES = 50000             # maximum number of lines in a pedigree file
+# time (seconds) to cache the result of validating a pedigree, 0 to disable the cache
+VALIDATION_CACHE_TIMEOUT = 60*60
 MIN_BASELINE_PEDIGREE_SIZE = 1
 MENDEL_NULL_YEAR_OF_BIRTH = -1
 
@@ -227,6 +284,7 @@ REST_FRAMEWORK = {
     'DEFAULT_THROTTLE_RATES': {
         'sustained': '6000/day',
         'burst': '250/min',
-        'enduser_burst': '150/min'
+        'enduser_burst': '150/min',
+        'cpu_budget': '500000/day'         # cost units, i.e. number of people x model runs
     }
 }
@@ -0,0 +1,275 @@
+"""
+Synthetic pedigree generator used for benchmarks, stress and scale tests. Generates
+CanRisk (v1 and v2) and BOADICEA v4 pedigree files of families of a given size descended
+from a founder couple, with cancer diagnoses, genetic tests, pathology, MZ twins and
+(for CanRisk files) header risk factors and PRS.
+"""
+from datetime import date
+import random
+
+from django.conf import settings
+
+from bws.pedigree import BwaPedigree, CanRiskPedigree
+
+
+FILE_TYPES = ['canrisk1', 'canrisk2', 'bwa']
+CANCERS = ['bc1', 'bc2', 'oc', 'prc', 'pac']
+
+
+def get_genes(file_type):
+    """ Get the genes with genetic test columns in the given file type. """
+    if file_type == 'bwa':
+        return [c[:-1] for c in BwaPedigree.COLUMNS if c.endswith('t') and c != 'Target']
+    cols = CanRiskPedigree.COLUMNS1 if file_type == 'canrisk1' else CanRiskPedigree.COLUMNS2
+    return cols[cols.index('Ashkn')+1:-1]
+
+
+class SyntheticPedigree(object):
+    """
+    A randomly generated family descended from a founder couple. Descendants with
+    children have a partner who is a founder. Each generation is born 20 to 34 years
+    after its parents and people over 90 are recorded as dead.
+    """
+
+    def __init__(self, famid, size=20, file_type='canrisk2', depth=3, sibship=(1, 5), twins=0,
+                 cancer_rate=0.15, gtest_rate=0.05, pathology_rate=0.5, ashkn=False, rng=None):
+        """
+        @param famid: family ID
+        @keyword size: number of people in the family, 1 or at least 3 (may exceed MAX_PEDIGREE_SIZE)
+        @keyword file_type: 'canrisk1', 'canrisk2' or 'bwa'
+        @keyword depth: maximum number of generations below the founder couple
+        @keyword sibship: range of the number of children per couple
+        @keyword twins: maximum number of MZ twin pairs (up to MAX_NUMBER_MZ_TWIN_PAIRS)
+        @keyword cancer_rate: fraction of people with a cancer diagnosis
+        @keyword gtest_rate: fraction of people with a genetic test
+        @keyword pathology_rate: fraction of breast cancers with pathology test results
+        @keyword ashkn: founders have Ashkenazi Jewish ancestry
+        @keyword rng: random number generator
+        """
+        if size == 2 or size < 1:
+            raise ValueError("A connected pedigree must have 1 or at least 3 people: " + str(size))
+        if twins > settings.MAX_NUMBER_MZ_TWIN_PAIRS:
+            raise ValueError("Maximum number of MZ twin pairs exceeded: " + str(twins))
+        self.famid = famid
+        self.size = size
+        self.file_type = file_type
+        self.genes = get_genes(file_type)
+        self.depth = depth
+        self.sibship = (max(1, sibship[0]), min(sibship[1], settings.MAX_NUMBER_OF_SIBS_PER_NUCLEAR_FAMILY))
+        self.ntwins = twins
+        self.ashkn = ashkn
+        self.rng = rng if rng is not None else random.Random()
+        self.year = date.today().year
+        self.people = []
+
+        if size == 1:
+            self.add_person("0", "0", "F", self.year - 40, 0)
+        else:
+            self.add_descendants()
+        self.set_target()
+        for p in self.people:
+            if not p['target']:
+                self.add_cancers(p, cancer_rate, pathology_rate)
+                if self.rng.random() < gtest_rate:
+                    self.add_genetic_test(p)
+        for p in self.people:
+            if p['mztwin'] != "0" and p['twin_of'] is not None:
+                p['gtests'] = dict(p['twin_of']['gtests'])
+
+    def add_person(self, fathid, mothid, sex, yob, gen):
+        """ Add a person born in the given year. """
+        pid = "P" + str(len(self.people) + 1)
+        age = self.year - yob
+        dead = "0"
+        if age > 90:
+            dead = "1"
+            age = self.rng.randint(60, 90)
+        p = {
+            'pid': pid, 'fathid': fathid, 'mothid': mothid, 'sex': sex, 'yob': yob, 'age': age, 'dead': dead,
+            'gen': gen, 'mztwin': "0", 'twin_of': None, 'target': False,
+            'ashkn': "1" if self.ashkn and fathid == "0" else "0",
+            'cancers': {c: "0" for c in CANCERS}, 'gtests': {}, 'pathology': ["0"] * 5
+        }
+        self.people.append(p)
+        return p
+
+    def founder_yob(self):
+        """ Year of birth of the founders, so that the youngest generation filled is aged about 40. """
+        avg = sum(self.sibship) / 2.0
+        (total, couples, gen) = (2, 1, 0)
+        while total < self.size and gen < self.depth:
+            gen += 1
+            total += 2 * couples * avg
+            couples *= avg
+        return max(settings.MIN_YEAR_OF_BIRTH + 1, self.year - 35 - 27 * max(gen, 1) - self.rng.randint(0, 6))
+
+    def add_descendants(self):
+        """ Add the founder couple and their descendants breadth first until the family is full. """
+        yob = self.founder_yob()
+        father = self.add_person("0", "0", "M", yob - self.rng.randint(0, 4), 0)
+        mother = self.add_person("0", "0", "F", yob, 0)
+        couples = [(father, mother)]
+        queue = [(father, mother, self.rng.randint(*self.sibship))]
+
+        # first pass with random sibship sizes, then top up sibships to the maximum and finally
+        # add a child to existing couples to fill a last place that has no room for a new couple
+        max_children = settings.MAX_NUMBER_OF_SIBS_PER_NUCLEAR_FAMILY + 1
+        for max_sibs in (None, max_children - 1, max_children):
+            if max_sibs is not None:
+                partnered = set(p['pid'] for c in couples for p in c)
+                queue = [(f, m, max_sibs) for (f, m) in couples]
+                if max_sibs < max_children:
+                    queue.extend((p, None, max_sibs) for p in self.people if p['fathid'] != "0" and
+                                 p['pid'] not in partnered and self.is_parent_viable(p))
+            while len(self.people) < self.size and len(queue) > 0:
+                (parent1, parent2, nchildren) = queue.pop(0)
+                if parent2 is None:
+                    # a partner is added for a descendant when they have children
+                    if len(self.people) > self.size - 2:
+                        continue
+                    parent2 = self.add_person("0", "0", "M" if parent1['sex'] == "F" else "F",
+                                              parent1['yob'], parent1['gen'])
+                    couples.append((parent1, parent2))
+                (father, mother) = (parent1, parent2) if parent1['sex'] == "M" else (parent2, parent1)
+                nsibs = len([p for p in self.people if p['mothid'] == mother['pid']])
+                while nsibs < nchildren:
+                    yob = mother['yob'] + 20 + nsibs + self.rng.randint(0, 1)
+                    if len(self.people) >= self.size or yob >= self.year:
+                        break
+                    child = self.add_person(father['pid'], mother['pid'], self.rng.choice("FM"), yob, mother['gen']+1)
+                    nsibs += 1
+                    if self.ntwins > len(self.get_twins()) and len(self.people) < self.size and \
+                            nsibs < nchildren and self.rng.random() < 0.3:
+                        self.add_twin(child)
+                        nsibs += 1
+                    if self.is_parent_viable(child):
+                        queue.append((child, None, max_sibs or self.rng.randint(*self.sibship)))
+        if len(self.people) < self.size:
+            raise ValueError("Family size " + str(self.size) + " too large for a depth of " + str(self.depth))
+
+    def is_parent_viable(self, p):
+        """ Return true if children can be added for a descendant. """
+        return p['gen'] < self.depth and p['yob'] + 22 < self.year
+
+    def get_twins(self):
+        return set(p['mztwin'] for p in self.people if p['mztwin'] != "0")
+
+    def add_twin(self, sib):
+        """ Add an MZ twin of a person. """
+        twin = self.add_person(sib['fathid'], sib['mothid'], sib['sex'], sib['yob'], sib['gen'])
+        twin['age'] = sib['age']
+        twin['dead'] = sib['dead']
+        twin['mztwin'] = sib['mztwin'] = settings.UNIQUE_TWIN_IDS[len(self.get_twins())]
+        twin['twin_of'] = sib
+
+    def set_target(self):
+        """ Set the target to a living woman, preferably in the youngest generation, aged 20-79. """
+        candidates = [p for p in self.people if p['sex'] == "F" and p['dead'] == "0" and
+                      20 <= p['age'] <= settings.MAX_AGE_FOR_RISK_CALCS]
+        if len(candidates) > 0:
+            target = sorted(candidates, key=lambda p: (-p['gen'], p['mztwin'] != "0"))[0]
+        else:
+            target = [p for p in self.people if p['sex'] == "F" and p['mztwin'] == "0"][-1]
+            target.update({'dead': "0", 'age': 40, 'yob': self.year - 40})
+        target['target'] = True
+
+    def add_cancers(self, p, cancer_rate, pathology_rate):
+        """ Randomly add cancer diagnoses (and breast cancer pathology) to a person. """
+        if p['age'] < 20 or self.rng.random() >= cancer_rate:
+            return
+        rng = self.rng
+        if p['sex'] == "F":
+            cancer = rng.choices(['bc1', 'oc', 'pac'], weights=[7, 2, 1])[0]
+        else:
+            cancer = rng.choices(['prc', 'pac', 'bc1'], weights=[6, 2, 2])[0]
+        dage = rng.randint(min(30, p['age']), p['age'])
+        p['cancers'][cancer] = str(dage)
+        if cancer == 'bc1':
+            if p['sex'] == "F" and rng.random() < 0.1:
+                p['cancers']['bc2'] = str(rng.randint(dage, p['age']))
+            if rng.random() < pathology_rate:
+                er = rng.choice("NP")
+                pr = her2 = ck14 = ck56 = "0"
+                if er == "N":
+                    pr, her2 = rng.choice("NP"), rng.choice("NP")
+                    if pr == "N" and her2 == "N":
+                        ck14, ck56 = rng.choice("NP"), rng.choice("NP")
+                p['pathology'] = [er, pr, her2, ck14, ck56]
+
+    def add_genetic_test(self, p):
+        """ Add a mutation search or direct gene test result for a gene to a person. """
+        result = "P" if not p['target'] and self.rng.random() < 0.2 else "N"
+        p['gtests'][self.rng.choice(self.genes)] = (self.rng.choice("ST"), result)
+
+    def records(self):
+        """ Get the pedigree file data records. """
+        lines = []
+        for p in self.people:
+            cols = [self.famid, p['pid'], "1" if p['target'] else "0", p['pid'], p['fathid'], p['mothid'], p['sex'],
+                    p['mztwin'], p['dead'], str(p['age']), str(p['yob'])]
+            cols.extend(p['cancers'][c] for c in CANCERS)
+            cols.append(p['ashkn'])
+            for g in self.genes:
+                (ttype, result) = p['gtests'].get(g, ("0", "0"))
+                cols.extend([ttype, result] if self.file_type == 'bwa' else [ttype + ":" + result])
+            cols.extend(p['pathology'] if self.file_type == 'bwa' else [":".join(p['pathology'])])
+            lines.append("\t".join(cols))
+        return lines
+
+    def header(self, risk_factors=False, prs=False):
+        """
+        Get CanRisk header lines declaring the target's risk factors and PRS.
+        @keyword risk_factors: include breast and ovarian cancer risk factors
+        @keyword prs: include breast and ovarian cancer PRS
+        """
+        rng = self.rng
+        lines = []
+        if risk_factors:
+            parity = rng.randint(0, 3)
+            lines.extend([
+                "##menarche=" + str(rng.randint(10, 16)),
+                "##parity=" + str(parity),
+                "##oc_use=" + rng.choice(["N", "F:" + str(rng.randint(1, 15)), "C:" + str(rng.randint(1, 15))]),
+                "##mht_use=" + rng.choice("NFEC"),
+                "##BMI=%.1f" % rng.uniform(17, 35),
+                "##alcohol=%.1f" % rng.uniform(0, 40),
+                "##menopause=" + str(rng.randint(40, 56)),
+                "##birads=" + rng.choice("abcd"),
+                "##height=%.1f" % rng.uniform(150, 180),
+                "##TL=" + rng.choice("NY"),
+                "##endo=" + rng.choice("NY")
+            ])
+            if parity > 0:
+                lines.append("##first_live_birth=" + str(rng.randint(18, 35)))
+        if prs:
+            lines.append("##PRS_BC=alpha=0.45,zscore=%.3f" % rng.gauss(0, 1))
+            lines.append("##PRS_OC=alpha=0.45,zscore=%.3f" % rng.gauss(0, 1))
+        return lines
+
+
+def synthetic_pedigree_file(nfamilies=1, file_type='canrisk2', risk_factors=False, prs=False, seed=None, **kwargs):
+    """
+    Generate a pedigree file.
+    @keyword nfamilies: number of families
+    @keyword file_type: 'canrisk1', 'canrisk2' or 'bwa'
+    @keyword risk_factors: include header risk factors for each family (CanRisk files only)
+    @keyword prs: include header PRS for each family (CanRisk files only)
+    @keyword seed: random seed, for reproducible files
+    @keyword kwargs: family options passed to L{SyntheticPedigree}, e.g. size
+    @return: pedigree file content
+    """
+    if file_type not in FILE_TYPES:
+        raise ValueError("Unknown pedigree file type: " + file_type)
+    rng = random.Random(seed)
+    if file_type == 'bwa':
+        lines = ["BOADICEA import pedigree file format 4.0", "\t".join(BwaPedigree.COLUMNS)]
+    else:
+        cols = CanRiskPedigree.COLUMNS1 if file_type == 'canrisk1' else CanRiskPedigree.COLUMNS2
+        lines = ["##CanRisk " + ("1.0" if file_type == 'canrisk1' else "2.0"), "##" + "\t".join(cols)]
+
+    for fam in range(nfamilies):
+        pedi = SyntheticPedigree("F" + str(fam+1), file_type=file_type, rng=rng, **kwargs)
+        if file_type != 'bwa':
+            lines.extend(pedi.header(risk_factors=risk_factors, prs=prs))
+        lines.extend(pedi.records())
+    return "\n".join(lines) + "\n"
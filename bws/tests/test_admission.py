@@ -0,0 +1,130 @@
+""" Model process admission control tests.  """
+from contextlib import ExitStack
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from django.test import TestCase
+
+from bws.admission import SlotLimiter
+from bws.exceptions import ServiceUnavailableException
+
+
+class SlotLimiterTests(TestCase):
+
+    def setUp(self):
+        self.lock_dir = tempfile.mkdtemp(prefix="test_slots_")
+
+    def tearDown(self):
+        shutil.rmtree(self.lock_dir)
+
+    def test_slots_limited(self):
+        ''' Test the number of slots held at once is limited and the queue is bounded. '''
+        limiter = SlotLimiter(self.lock_dir, nslots=1, queue_size=1, timeout=5, retry_after=7, poll_interval=0.01)
+        admitted = []
+
+        def wait_for_slot():
+            with limiter.slot():
+                admitted.append(time.time())
+
+        with limiter.slot() as idx:
+            self.assertEqual(idx, 0)
+            self.assertEqual(limiter.slots_in_use(), 1)
+            waiting = threading.Thread(target=wait_for_slot)
+            waiting.start()
+            while limiter.queue_depth() == 0:
+                time.sleep(0.01)
+
+            # queue is full
+            with self.assertRaises(ServiceUnavailableException) as cm:
+                with limiter.slot():
+                    pass
+            self.assertEqual(cm.exception.wait, 7)
+            self.assertEqual(len(admitted), 0)
+            released = time.time()
+        waiting.join()
+        self.assertEqual(len(admitted), 1)
+        self.assertGreaterEqual(admitted[0], released)
+        self.assertEqual(limiter.queue_depth(), 0)
+        self.assertEqual(limiter.slots_in_use(), 0)
+
+    def admission_order(self, limiter, runs, delay=0, running=None):
+        """
+        Queue model runs while the slots are held and return the order they are admitted.
+        @param runs: list of the estimated cost and tenant of the model runs
+        @keyword delay: seconds between queueing the model runs
+        @keyword running: estimated cost and tenant of a model run that holds a slot until the first is admitted
+        """
+        admitted = []
+
+        def wait_for_slot(cost, tenant):
+            with limiter.slot(cost, tenant):
+                admitted.append(cost)
+
+        with ExitStack() as stack:
+            if running is not None:
+                stack.enter_context(limiter.slot(*running))
+            with limiter.slot():
+                threads = []
+                for run in runs:
+                    threads.append(threading.Thread(target=wait_for_slot, args=run))
+                    threads[-1].start()
+                    while limiter.queue_depth() < len(threads):
+                        time.sleep(0.01)
+                    time.sleep(delay)
+            while len(admitted) == 0:
+                time.sleep(0.01)
+        for t in threads:
+            t.join()
+        return admitted
+
+    def test_shortest_first(self):
+        ''' Test model runs with a lower estimated cost are admitted first. '''
+        limiter = SlotLimiter(self.lock_dir, nslots=1, queue_size=4, timeout=5, retry_after=7, aging=10,
+                              poll_interval=0.01)
+        self.assertEqual(self.admission_order(limiter, [(15, ("", "")), (None, ("", "")), (3, ("", ""))]),
+                         [None, 3, 15])
+
+    def test_aging(self):
+        ''' Test a costly model run is admitted before cheaper runs queued long enough after it. '''
+        limiter = SlotLimiter(self.lock_dir, nslots=1, queue_size=4, timeout=5, retry_after=7, aging=1,
+                              poll_interval=0.01)
+        runs = [(0.3, ("", "")), (0.1, ("", ""))]
+        self.assertEqual(self.admission_order(limiter, runs, delay=0.5), [0.3, 0.1])
+        limiter.aging = 0
+        self.assertEqual(self.admission_order(limiter, runs, delay=0.5), [0.1, 0.3])
+
+    def test_fair_share(self):
+        ''' Test the model runs of an account with a backlog wait for those of other accounts and end users. '''
+        limiter = SlotLimiter(self.lock_dir, nslots=2, queue_size=4, timeout=5, retry_after=7, aging=10,
+                              poll_interval=0.01)
+        running = (60, ("batch", "end1"))
+        self.assertEqual(self.admission_order(limiter, [(1, ("batch", "end1")), (2, ("clinic", "end1"))],
+                                              running=running), [2, 1])
+        self.assertEqual(self.admission_order(limiter, [(1, ("batch", "end1")), (2, ("batch", "end2"))],
+                                              running=running), [2, 1])
+        # the account has a larger share
+        limiter.weights = {"batch": 100}
+        self.assertEqual(self.admission_order(limiter, [(1, ("batch", "end1")), (2, ("clinic", "end1"))],
+                                              running=running), [1, 2])
+
+    def test_idle_cores(self):
+        ''' Test the cores used by the threads of the model runs holding a slot are not idle. '''
+        limiter = SlotLimiter(self.lock_dir, nslots=2, queue_size=2, timeout=5, retry_after=7)
+        ncores = os.cpu_count()
+        self.assertEqual(limiter.idle_cores(), ncores)
+        with limiter.slot(1, ("", "")) as idx:
+            self.assertEqual(limiter.idle_cores(), ncores - 1)
+            limiter.set_threads(idx, 3)
+            self.assertEqual(limiter.idle_cores(), ncores - 3)
+        self.assertEqual(limiter.idle_cores(), ncores)
+
+    def test_timeout(self):
+        ''' Test a 503 is raised when no slot becomes free. '''
+        limiter = SlotLimiter(self.lock_dir, nslots=1, queue_size=2, timeout=0.1, retry_after=7, poll_interval=0.01)
+        with limiter.slot():
+            with self.assertRaises(ServiceUnavailableException):
+                with limiter.slot():
+                    pass
@@ -0,0 +1,82 @@
+""" Precomputed baseline risk table tests. """
+from io import StringIO
+import os
+import shutil
+import tempfile
+from unittest.mock import patch
+
+from django.conf import settings
+from django.core.management import call_command
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from bws import baseline
+from bws.calcs import Predictions, RemainingLifetimeBaselineRisk, RangeRiskBaseline, RISK_RANGES
+from bws.cancer import Cancer, Cancers
+from bws.pedigree import Female, Male, BwaPedigree
+
+
+class BaselineTableTests(TestCase):
+    ''' Test building and looking up the baseline risk tables. '''
+
+    def setUp(self):
+        self.tables_dir = tempfile.mkdtemp(prefix="test_baseline_")
+        self.cwd = tempfile.mkdtemp(prefix="test_baseline_cwd_")
+
+    def tearDown(self):
+        shutil.rmtree(self.tables_dir)
+        shutil.rmtree(self.cwd)
+
+    def test_table(self):
+        ''' Test the risks are only returned for the rows in a table built with the same model version. '''
+        path = os.path.join(self.tables_dir, "BC_test_UK")
+        key = baseline.get_key("1980", "40")
+        rows = {"remaining_lifetime": {key: [(41, 0.0012), (50, 0.02), (80, 0.1)]}}
+        baseline.BaselineTable.write(path, {"version": "v1"}, rows)
+        with override_settings(BASELINE_TABLES_DIR=self.tables_dir):
+            self.assertEqual(baseline.get_risks("BC_test_UK", "v1", "remaining_lifetime", key),
+                             [(41, 0.0012), (50, 0.02), (80, 0.1)])
+            self.assertIsNone(baseline.get_risks("BC_test_UK", "v2", "remaining_lifetime", key))
+            self.assertIsNone(baseline.get_risks("BC_test_UK", "v1", "remaining_lifetime",
+                                                 baseline.get_key("1980", "40", "35")))
+            self.assertIsNone(baseline.get_risks("BC_test_UK", "v1", "lifetime", key))
+            self.assertIsNone(baseline.get_risks("BC_test_US", "v1", "remaining_lifetime", key))
+
+            # a rebuilt table is reloaded
+            baseline.BaselineTable.write(path, {"version": "v2"}, rows)
+            self.assertIsNotNone(baseline.get_risks("BC_test_UK", "v2", "remaining_lifetime", key))
+        self.assertIsNone(baseline.get_key("1980", "40", "AU"))
+
+    def test_build(self):
+        ''' Test the baseline risks are looked up in a built table instead of running the model. '''
+        with override_settings(BASELINE_TABLES_DIR=self.tables_dir, PARAMS_DIR=self.cwd):
+            call_command('build_baseline_tables', '--cancer-rates', 'UK', '--yobs', '1980-1981', '--ages', '40',
+                         '--no-affected', '--workers', '2', stdout=StringIO())
+            self.assertEqual(len(os.listdir(self.tables_dir)), 1)
+
+            target = Female("FAM1", "F0", "001", "002", "003", target="1", age="40", yob="1980")
+            pedi = BwaPedigree(people=[target, Male("FAM1", "M2", "002", "", "", age="70", yob="1950"),
+                                       Female("FAM1", "F3", "003", "", "", age="68", yob="1952",
+                                              cancers=Cancers(bc1=Cancer("50")))])
+            with patch.object(Predictions, 'run', wraps=Predictions.run) as run:
+                pred = Predictions(pedi, cwd=self.cwd, model_settings=settings.BC_MODEL,
+                                   calcs=["remaining_lifetime", "lifetime", "ten_year"])
+            names = [c[1]["name"] for c in run.call_args_list]
+            self.assertEqual(names, ["REMAINING LIFETIME", "LIFETIME", "10 YR RANGE"])
+
+            self.assertEqual(pred.baseline_cancer_risks,
+                             RemainingLifetimeBaselineRisk(pred).get_risk(precomputed=False))
+            self.assertEqual(pred.baseline_lifetime_cancer_risk,
+                             RangeRiskBaseline(pred, *RISK_RANGES["lifetime"], "LIFETIME BASELINE")
+                             .get_risk(precomputed=False))
+            self.assertEqual(pred.baseline_ten_yr_cancer_risk,
+                             RangeRiskBaseline(pred, *RISK_RANGES["ten_year"], "10YR RANGE BASELINE")
+                             .get_risk(precomputed=False))
+
+            # affected women are not in the table so the model is run
+            pedi.get_target().cancers = Cancers(bc1=Cancer("35"))
+            with patch.object(Predictions, 'run', wraps=Predictions.run) as run:
+                pred = Predictions(pedi, cwd=self.cwd, model_settings=settings.BC_MODEL,
+                                   calcs=["remaining_lifetime"])
+            self.assertIn("REMAINING LIFETIME BASELINE", [c[1]["name"] for c in run.call_args_list])
+            self.assertTrue(len(pred.baseline_cancer_risks) > 0)
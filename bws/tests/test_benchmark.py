@@ -0,0 +1,47 @@
+""" Benchmark management command tests. """
+from io import StringIO
+import json
+import os
+import tempfile
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+
+class BenchmarkTests(TestCase):
+    ''' Test the request pipeline benchmark. '''
+
+    def setUp(self):
+        self.output = os.path.join(tempfile.mkdtemp(), "bench.json")
+
+    def tearDown(self):
+        if os.path.exists(self.output):
+            os.remove(self.output)
+        os.rmdir(os.path.dirname(self.output))
+
+    def test_results(self):
+        ''' Test each stage is timed for each case and written as JSON. '''
+        call_command('benchmark', '--no-model', '--repeat', '1', '--sizes', '3,40', '--families', '1,2',
+                     '--output', self.output, stdout=StringIO())
+        with open(self.output, 'r') as f:
+            report = json.load(f)
+        self.assertEqual(sorted(report['results'].keys()), ['BC/3p/1f', 'BC/3p/2f', 'BC/40p/1f', 'BC/40p/2f'])
+        for stages in report['results'].values():
+            self.assertEqual(list(stages.keys()), ['parse', 'validate', 'write_files', 'serialise', 'render'])
+            for result in stages.values():
+                self.assertLessEqual(result['min'], result['median'])
+
+    def test_regression(self):
+        ''' Test a stage slower than the baseline by more than the threshold is a regression. '''
+        call_command('benchmark', '--no-model', '--repeat', '1', '--sizes', '3', '--families', '1',
+                     '--output', self.output, stdout=StringIO())
+        with open(self.output, 'r') as f:
+            report = json.load(f)
+        for result in report['results']['BC/3p/1f'].values():
+            result['median'] /= 100.0
+        with open(self.output, 'w') as f:
+            json.dump(report, f)
+        with self.assertRaises(CommandError):
+            call_command('benchmark', '--no-model', '--repeat', '1', '--sizes', '3', '--families', '1',
+                         '--compare', self.output, '--min-time', '0', stdout=StringIO())
@@ -0,0 +1,105 @@
+""" Model process resource budget tests. """
+import os
+import shutil
+from subprocess import PIPE
+import sys
+import tempfile
+
+from django.conf import settings
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from bws.budget import Budget
+from bws.calcs import ModelProcess, Predictions
+from bws.exceptions import ResourceLimitException
+from bws.pedigree import Female, BwaPedigree
+
+
+class BudgetTests(TestCase):
+
+    def run_process(self, budget, code):
+        """ Run python code with the budget and return the exceeded limit. """
+        process = ModelProcess(budget.get_command([sys.executable, "-c", code]), stdout=PIPE, stderr=PIPE,
+                               env=budget.get_env(settings.FORTRAN_ENV))
+        (_outs, errs) = process.communicate(timeout=30)
+        return budget.get_breach(process.returncode, process.rusage, errs.decode("utf-8"))
+
+    @override_settings(FORTRAN_BUDGETS=[(10, {'cpu_time': 10}), (100, {'cpu_time': 20, 'threads': 2})])
+    def test_tiers(self):
+        ''' Test the budget is from the smallest tier for the pedigree size. '''
+        self.assertEqual(Budget.factory(5).cpu_time, 10)
+        self.assertEqual(Budget.factory(10).cpu_time, 10)
+        self.assertEqual(Budget.factory(11).cpu_time, 20)
+        self.assertEqual(Budget.factory(1000).cpu_time, 20)
+        self.assertEqual(Budget.factory().cpu_time, 20)
+        self.assertEqual(Budget.factory(50).get_env({})['OMP_NUM_THREADS'], "2")
+
+    @override_settings(FORTRAN_MAX_THREADS=4, FORTRAN_THREADS_COST=30)
+    def test_adapt_threads(self):
+        ''' Test costly model runs are multi-threaded when there are idle cores. '''
+        self.assertEqual(Budget().adapt_threads(None, 8), 1)
+        self.assertEqual(Budget().adapt_threads(10, 8), 1)
+        self.assertEqual(Budget().adapt_threads(100, 8), 3)
+        self.assertEqual(Budget().adapt_threads(1000, 8), 4)
+        self.assertEqual(Budget().adapt_threads(1000, 2), 2)
+        self.assertEqual(Budget().adapt_threads(1000, 0), 1)
+        budget = Budget(threads=2)
+        self.assertEqual(budget.adapt_threads(1000, 8), 2)
+        self.assertEqual(budget.get_env({})['OMP_NUM_THREADS'], "2")
+
+    @override_settings(FORTRAN_MAX_THREADS=4, FORTRAN_THREADS_COST=30)
+    def test_threads_cpu_time(self):
+        ''' Test the CPU time limit is scaled by the number of threads. '''
+        grace = int(settings.FORTRAN_KILL_GRACE) + 1
+        budget = Budget(cpu_time=10)
+        self.assertIn("ulimit -S -t 10; ulimit -H -t %d;" % (10 + grace), budget.get_command(["true"])[2])
+        budget.adapt_threads(1000, 8)
+        self.assertEqual(budget.cpu_time, 40)
+        self.assertIn("ulimit -S -t 40; ulimit -H -t %d;" % (40 + grace), budget.get_command(["true"])[2])
+        budget.adapt_threads(60, 8)
+        self.assertEqual(budget.cpu_time, 20)
+        self.assertIn("ulimit -S -t 20; ulimit -H -t %d;" % (20 + grace), budget.get_command(["true"])[2])
+
+    def test_cpu_time(self):
+        ''' Test a process exceeding its CPU time limit is reported. '''
+        self.assertEqual(self.run_process(Budget(cpu_time=1), "while True: pass"), "cpu_time")
+
+    def test_address_space(self):
+        ''' Test a process exceeding its address space limit is reported. '''
+        self.assertEqual(self.run_process(Budget(address_space=1024**3), "b = bytearray(2*1024**3)"),
+                         "address_space")
+
+    def test_open_files(self):
+        ''' Test a process exceeding its open files limit is reported. '''
+        self.assertEqual(self.run_process(Budget(open_files=32), "fs = [open('/dev/null') for i in range(64)]"),
+                         "open_files")
+
+    def test_command(self):
+        ''' Test the limits and niceness are applied to the model process without a preexec_fn. '''
+        code = "import os, resource; print(resource.getrlimit(resource.RLIMIT_CPU), os.getpriority(os.PRIO_PROCESS, 0))"
+        budget = Budget(cpu_time=10)
+        process = ModelProcess(budget.get_command([sys.executable, "-c", code]), niceness=3, stdout=PIPE)
+        (outs, _errs) = process.communicate(timeout=30)
+        grace = int(settings.FORTRAN_KILL_GRACE) + 1
+        nice = min(os.getpriority(os.PRIO_PROCESS, 0) + 3, 19)
+        self.assertEqual(outs.decode("utf-8").split("\n")[0], "(10, %d) %d" % (10 + grace, nice))
+
+    def test_failure(self):
+        ''' Test a failure that is not due to the budget is not reported as a breach. '''
+        self.assertIsNone(self.run_process(Budget(cpu_time=10, open_files=64), "raise ValueError('bad input')"))
+        self.assertIsNone(self.run_process(Budget(cpu_time=10), "print('ok')"))
+
+    def test_model_run(self):
+        ''' Test a model run exceeding its budget raises a ResourceLimitException. '''
+        pedi = BwaPedigree(people=[Female("FAM1", "F0", "001", "", "", target="1", age="40", yob="1980")])
+        cwd = tempfile.mkdtemp(prefix="test_budget_")
+        try:
+            env = dict(settings.FORTRAN_ENV, BWS_SIM_BASE="30", BWS_SIM_MODE="spin")
+            with override_settings(FORTRAN_ENV=env, FORTRAN_BUDGETS=[(10, {'cpu_time': 1})],
+                                   FORTRAN_COALESCE_DIR=None):
+                with self.assertRaises(ResourceLimitException) as cm:
+                    Predictions(pedi, cwd=cwd, model_settings=settings.BC_MODEL, calcs=["carrier_probs"])
+            self.assertEqual(cm.exception.resource, "cpu_time")
+            self.assertEqual(cm.exception.status_code, 422)
+        finally:
+            shutil.rmtree(cwd)
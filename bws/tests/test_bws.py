@@ -2,11 +2,13 @@
 
 from bws.calcs import Predictions
 from bws.cancer import CanRiskGeneticTests
-from bws.exceptions import ModelError
+from bws.exceptions import ModelError, ServiceUnavailableException
 from bws.pedigree import CanRiskPedigree, Female
+from bws.rest_api import BwsView
 from datetime import date
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.test import TestCase
 from django.test.utils import override_settings
 from django.urls import reverse
@@ -17,6 +19,7 @@ from rest_framework.exceptions import ValidationError
 from rest_framework.test import APIClient
 import json
 import os
+from unittest.mock import patch
 
 
 class BwsMixin(TestCase):
@@ -93,6 +96,18 @@ class BwsTests(BwsMixin):
         self.assertTrue("pedigree_result" in content)
         self.assertTrue("family_id" in content["pedigree_result"][0])
 
+    @override_settings(MAX_PEDIGREE_FILE_SIZE=100)
+    def test_pedigree_file_size(self):
+        ''' Test an uploaded pedigree file larger than the maximum size is rejected. '''
+        # the file is charged the whole CPU budget, so start and leave the budget unused
+        cache.clear()
+        self.addCleanup(cache.clear)
+        data = {'mut_freq': 'UK', 'cancer_rates': 'UK', 'pedigree_data': self.pedigree_data, 'user_id': 'test_XXX'}
+        response = BwsTests.client.post(BwsTests.url, data, format='multipart', HTTP_ACCEPT="application/json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        content = json.loads(force_text(response.content))
+        self.assertTrue("larger than the maximum size" in content['pedigree_data'][0])
+
     def test_multi_pedigree_bws(self):
         ''' Test POSTing multiple pedigrees to the BWS. '''
         multi_pedigree_data = open(os.path.join(BwsTests.TEST_DATA_DIR, "multi", "d1.bwa"), "r")
@@ -106,6 +121,71 @@ class BwsTests(BwsMixin):
             self.assertTrue(res['family_id'] in family_ids)
         multi_pedigree_data.close()
 
+    @override_settings(FAMILY_WORKERS=4)
+    def test_multi_pedigree_order(self):
+        ''' Test the results of families run at once are in the order of the families in the file. '''
+        with open(os.path.join(BwsTests.TEST_DATA_DIR, "multi", "d3.4x.canrisk"), "r") as multi_pedigree_data:
+            data = {'mut_freq': 'UK', 'cancer_rates': 'UK', 'pedigree_data': multi_pedigree_data,
+                    'user_id': 'test_XXX'}
+            response = BwsTests.client.post(BwsTests.url, data, format='multipart', HTTP_ACCEPT="application/json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        content = json.loads(force_text(response.content))
+        self.assertEqual([res['family_id'] for res in content['pedigree_result']], ["XXX0", "XXX2", "XXXX", "XXX3"])
+        for res in content['pedigree_result']:
+            self.assertTrue("cancer_risks" in res or "mutation_probabilties" in res)
+            self.assertFalse("error" in res)
+
+    def test_multi_pedigree_error(self):
+        ''' Test an error in one family of a multi-family file is returned with the results of the others. '''
+        with open(os.path.join(BwsTests.TEST_DATA_DIR, "multi", "d1.bwa"), "r") as f:
+            lines = f.read().split('\n')
+        lines[-2] = lines[-2].replace("\tM\t", "\tF\t")      # father of the target in XXX1 is not male
+        data = {'mut_freq': 'UK', 'cancer_rates': 'UK', 'pedigree_data': '\n'.join(lines), 'user_id': 'test_XXX'}
+        response = BwsTests.client.post(BwsTests.url, data, format='multipart', HTTP_ACCEPT="application/json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        content = json.loads(force_text(response.content))
+        (res0, res1) = content['pedigree_result']
+        self.assertEqual(res0['family_id'], "XXX0")
+        self.assertTrue("cancer_risks" in res0)
+        self.assertEqual(res1['family_id'], "XXX1")
+        self.assertTrue("All fathers in the pedigree must have sex specified as 'M'" in res1['error']['Person Error'])
+        self.assertFalse("cancer_risks" in res1)
+
+    def test_multi_pedigree_model_error(self):
+        ''' Test a model run error in one family of a multi-family file is returned with the results of the others. '''
+        get_family_result = BwsView.get_family_result
+
+        def fail_xxx1(view, request, pedi, *args):
+            if pedi.famid == "XXX1":
+                raise ModelError("model failed")
+            return get_family_result(view, request, pedi, *args)
+
+        with open(os.path.join(BwsTests.TEST_DATA_DIR, "multi", "d1.bwa"), "r") as multi_pedigree_data:
+            data = {'mut_freq': 'UK', 'cancer_rates': 'UK', 'pedigree_data': multi_pedigree_data,
+                    'user_id': 'test_XXX'}
+            with patch.object(BwsView, "get_family_result", fail_xxx1):
+                response = BwsTests.client.post(BwsTests.url, data, format='multipart', HTTP_ACCEPT="application/json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        content = json.loads(force_text(response.content))
+        (res0, res1) = content['pedigree_result']
+        self.assertEqual(res0['family_id'], "XXX0")
+        self.assertTrue("cancer_risks" in res0)
+        self.assertEqual(res1['family_id'], "XXX1")
+        self.assertEqual(res1['error']['Model Error'], "model failed")
+
+    def test_multi_pedigree_busy(self):
+        ''' Test a multi-family file is rejected with a 503 if the queue is full for all its families. '''
+        def busy(*args):
+            raise ServiceUnavailableException(wait=7)
+
+        with open(os.path.join(BwsTests.TEST_DATA_DIR, "multi", "d1.bwa"), "r") as multi_pedigree_data:
+            data = {'mut_freq': 'UK', 'cancer_rates': 'UK', 'pedigree_data': multi_pedigree_data,
+                    'user_id': 'test_XXX'}
+            with patch.object(BwsView, "get_family_result", busy):
+                response = BwsTests.client.post(BwsTests.url, data, format='multipart', HTTP_ACCEPT="application/json")
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response["Retry-After"], "7")
+
     def test_canrisk_format_bws(self):
         ''' Test POSTing canrisk format pedigree to the BWS. '''
         canrisk_data = open(os.path.join(BwsTests.TEST_DATA_DIR, "d0.canrisk"), "r")
@@ -0,0 +1,109 @@
+""" Model run coalescing tests. """
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from django.test import TestCase
+
+from bws.coalesce import SingleFlight
+from bws.exceptions import ServiceUnavailableException, ModelError
+
+
+class SingleFlightTests(TestCase):
+
+    def setUp(self):
+        self.lock_dir = tempfile.mkdtemp(prefix="test_inflight_")
+        self.single_flight = SingleFlight(self.lock_dir, timeout=5, poll_interval=0.01)
+
+    def tearDown(self):
+        shutil.rmtree(self.lock_dir)
+
+    def run_concurrently(self, leader, follower, nfollowers=3):
+        """ Run a leader and then followers with the same key while the leader is running. """
+        started = threading.Event()
+        release = threading.Event()
+        results = []
+
+        def lead():
+            started.set()
+            release.wait(5)
+            return leader()
+
+        def run(func):
+            try:
+                results.append(self.single_flight.run("key", func, model="BC"))
+            except Exception as e:
+                results.append(e)
+
+        threads = [threading.Thread(target=run, args=(lead,))]
+        threads[0].start()
+        started.wait(5)
+        for _i in range(nfollowers):
+            threads.append(threading.Thread(target=run, args=(follower,)))
+            threads[-1].start()
+        time.sleep(0.2)
+        release.set()
+        for t in threads:
+            t.join()
+        return results
+
+    def test_coalesced(self):
+        ''' Test identical runs in flight wait for and share the result of the first. '''
+        calls = []
+
+        def follower():
+            calls.append("follower")
+            return "follower result"
+        results = self.run_concurrently(lambda: "leader result", follower)
+        self.assertEqual(results, ["leader result"] * 4)
+        self.assertEqual(calls, [])
+
+        # a later run is not coalesced
+        self.assertEqual(self.single_flight.run("key", follower), "follower result")
+        self.assertEqual(calls, ["follower"])
+
+    def test_model_error(self):
+        ''' Test a model error is raised in the runs that waited for it. '''
+        def leader():
+            raise ModelError("ERRORS IN THE PEDIGREE FILE")
+        results = self.run_concurrently(leader, lambda: "follower result")
+        self.assertEqual(len(results), 4)
+        for e in results:
+            self.assertIsInstance(e, ModelError)
+            self.assertEqual(str(e.detail['Model Error']), "ERRORS IN THE PEDIGREE FILE")
+
+    def test_unavailable(self):
+        ''' Test a run is not shared if it could not be run, e.g. when the queue is full. '''
+        def leader():
+            raise ServiceUnavailableException()
+        results = self.run_concurrently(leader, lambda: "follower result", nfollowers=1)
+        self.assertIsInstance(results[0], ServiceUnavailableException)
+        self.assertEqual(results[1], "follower result")
+
+    def test_stale_result(self):
+        ''' Test the result of an earlier run is not shared when the leader could not run it. '''
+        def leader():
+            raise ModelError("ERRORS IN THE PEDIGREE FILE")
+        self.assertIsInstance(self.run_concurrently(leader, leader, nfollowers=0)[0], ModelError)
+        self.assertTrue(os.path.exists(os.path.join(self.lock_dir, "key.result")))
+
+        def unavailable():
+            raise ServiceUnavailableException()
+        results = self.run_concurrently(unavailable, lambda: "follower result", nfollowers=2)
+        self.assertIsInstance(results[0], ServiceUnavailableException)
+        self.assertEqual(results[1:], ["follower result"] * 2)
+
+    def test_key(self):
+        ''' Test the key is the same for the same input files in different working directories. '''
+        keys = []
+        for ped in ("pedigree", "pedigree", "another pedigree"):
+            cwd = tempfile.mkdtemp(dir=self.lock_dir)
+            with open(os.path.join(cwd, "test.ped"), "w") as f:
+                f.write(ped)
+            with open(os.path.join(cwd, "test.bat"), "w") as f:
+                f.write("3\n" + os.path.join(cwd, "test.ped") + "\n0\n")
+            keys.append(SingleFlight.get_key(["model.exe", "-o", "can_risks.out", "test.bat", "UK.nml"], cwd))
+        self.assertEqual(keys[0], keys[1])
+        self.assertNotEqual(keys[0], keys[2])
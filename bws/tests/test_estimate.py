@@ -0,0 +1,103 @@
+""" Model run time estimate tests. """
+from io import StringIO
+import json
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from bws import estimate
+from bws.cancer import Cancer, Cancers, BWSGeneticTests, GeneticTest
+from bws.pedigree import Female, Male, BwaPedigree
+
+
+def get_pedigree():
+    """ Three generation pedigree with MZ twin sisters, one affected and one genotyped. """
+    gtests = BWSGeneticTests.default_factory()._replace(brca1=GeneticTest("S", "N"))
+    return BwaPedigree(people=[
+        Female("FAM1", "F0", "001", "002", "003", target="1", age="40", yob="1980", mztwin="1", gtests=gtests),
+        Female("FAM1", "F1", "004", "002", "003", age="40", yob="1980", mztwin="1",
+               cancers=Cancers(bc1=Cancer("38"))),
+        Male("FAM1", "M2", "002", "", "", age="70", yob="1950"),
+        Female("FAM1", "F3", "003", "005", "006", age="68", yob="1952"),
+        Male("FAM1", "M5", "005", "", "", age="90", yob="1920"),
+        Female("FAM1", "F6", "006", "", "", age="90", yob="1922")])
+
+
+class EstimateTests(TestCase):
+
+    def setUp(self):
+        self.cwd = tempfile.mkdtemp(prefix="test_estimate_")
+
+    def tearDown(self):
+        shutil.rmtree(self.cwd)
+
+    def test_features(self):
+        ''' Test the features of a pedigree. '''
+        features = estimate.get_features(get_pedigree(), settings.BC_MODEL)
+        self.assertEqual(features, {"people": 6, "generations": 3, "genotyped": 1, "affected": 1, "twins": 2,
+                                    "genes": len(settings.BC_MODEL['GENES'])})
+        self.assertEqual(estimate.parse_features(estimate.format_features(features)), features)
+        self.assertIsNone(estimate.parse_features("people:6"))
+
+    def test_default(self):
+        ''' Test the default estimates grow with the pedigree size and are given for the viable calculations. '''
+        with override_settings(COST_MODEL_FILE=None):
+            pedi = get_pedigree()
+            small = estimate.get_estimate(BwaPedigree(people=[pedi.people[0]]), settings.BC_MODEL)
+            large = estimate.get_estimate(pedi, settings.BC_MODEL)
+        self.assertEqual(sorted(large.keys()), sorted(settings.BC_MODEL['CALCS']))
+        for calc in settings.BC_MODEL['CALCS']:
+            self.assertGreater(large[calc], small[calc])
+
+    def test_fit(self):
+        ''' Test the cost model is fitted from the model run log lines and reloaded. '''
+        path = os.path.join(self.cwd, "cost_model.json")
+        log = os.path.join(self.cwd, "bws.log")
+        with open(log, "w") as f:
+            for npeople in range(1, 41):
+                features = dict(estimate.get_baseline_features(), people=npeople, generations=1 + npeople // 10)
+                f.write("INFO bws.calcs: BC MUTATION PROBABILITY CALCULATION: user=1; elapsed time=9.0; "
+                        f"user time={0.02 * npeople ** 2}; system time=0.0; max rss=100KB; calc=carrier_probs; "
+                        f"features={estimate.format_features(features)}; estimated time=1.000\n")
+            f.write("INFO bws.calcs: BC CALCULATIONS: user=1; elapsed time=9.0; pedigree size=2\n")
+        with override_settings(COST_MODEL_FILE=path):
+            out = StringIO()
+            call_command('fit_cost_model', log, '--min-runs', '10', stdout=out)
+            self.assertIn("model runs: 40", out.getvalue())
+            features = dict(estimate.get_baseline_features(), people=30, generations=4)
+            self.assertAlmostEqual(estimate.get_cost_model().predict("BC", "carrier_probs", features), 18, delta=0.5)
+            # calculations and models not fitted use the default coefficients
+            self.assertEqual(estimate.get_cost_model().predict("OC", "carrier_probs", features),
+                             estimate.CostModel().predict("OC", "carrier_probs", features))
+
+
+class EstimateViewTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user('testuser', email='testuser@test.com', password='testing')
+
+    def test_estimate(self):
+        ''' Test the dry run estimate of a pedigree file. '''
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        with open(os.path.join(os.path.dirname(__file__), "data", "d0.canrisk"), "r") as f:
+            data = {'mut_freq': 'UK', 'cancer_rates': 'UK', 'pedigree_data': f.read(), 'user_id': 'test_XXX'}
+        response = client.post(reverse('bws_estimate'), data, format='multipart', HTTP_ACCEPT="application/json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        content = json.loads(response.content)
+        self.assertEqual(len(content["pedigree_result"]), 1)
+        result = content["pedigree_result"][0]
+        self.assertEqual(sorted(result["estimated_time"].keys()), sorted(settings.BC_MODEL['CALCS']))
+        self.assertGreater(content["total_estimated_time"], 0)
+        self.assertIn("generations", result["features"])
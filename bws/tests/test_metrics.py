@@ -0,0 +1,155 @@
+""" Request pipeline timing metrics tests. """
+import os
+import sys
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils.encoding import force_text
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from bws import metrics
+from bws.calcs import ModelProcess
+
+
+class MetricsTests(TestCase):
+    ''' Test the stage timing histograms. '''
+
+    def setUp(self):
+        for m in metrics.REGISTRY:
+            m.clear()
+
+    def tearDown(self):
+        for m in metrics.REGISTRY:
+            m.clear()
+
+    def get_series(self, **labels):
+        ''' Get the recorded series with the given label values. '''
+        series = {}
+        for lbls, cumulative, total, count in metrics.STAGE_DURATION.collect():
+            lbls = dict(zip(metrics.STAGE_DURATION.labelnames, lbls))
+            if all(lbls[k] == v for k, v in labels.items()):
+                series[lbls['stage']] = (cumulative, total, count)
+        return series
+
+    def test_size_label(self):
+        ''' Test pedigree sizes are labelled by their size bucket. '''
+        with override_settings(METRICS_SIZE_BUCKETS=[1, 10, 275]):
+            self.assertEqual(metrics.size_labels(), ['1', '2-10', '11-275', '276+', 'na'])
+            self.assertEqual(metrics.size_label(1), '1')
+            self.assertEqual(metrics.size_label(10), '2-10')
+            self.assertEqual(metrics.size_label(11), '11-275')
+            self.assertEqual(metrics.size_label(1000), '276+')
+            self.assertEqual(metrics.size_label(None), 'na')
+
+    def test_queue_wait(self):
+        ''' Test queue waits are labelled by the estimated run time bucket. '''
+        with override_settings(METRICS_COST_BUCKETS=[1, 10]):
+            self.assertEqual(metrics.cost_labels(), ['0-1', '1-10', '10+', 'na'])
+            self.assertEqual(metrics.cost_label(0.2), '0-1')
+            self.assertEqual(metrics.cost_label(100), '10+')
+            metrics.observe_queue_wait("BC", 5, 0.5)
+            metrics.observe_queue_wait("BC", None, 0.5)
+            self.assertEqual(sorted(lbls for lbls, _c, _t, _n in metrics.QUEUE_WAIT.collect()),
+                             [["BC", "1-10"], ["BC", "na"]])
+
+    def test_observe(self):
+        ''' Test observations are counted in cumulative buckets. '''
+        hist = metrics.Histogram("test_seconds", "Test.", [0.1, 1, 10], ["stage", "model", "calc", "size"],
+                                 lambda: [metrics.STAGES, metrics.MODELS, metrics.CALCS, metrics.size_labels()])
+        for seconds in (0.05, 0.5, 0.6, 100):
+            hist.observe(seconds, "parse", "BC", "all", "1")
+        ((labels, cumulative, total, count), ) = hist.collect()
+        hist.clear()
+        self.assertEqual(labels, ["parse", "BC", "all", "1"])
+        self.assertEqual(cumulative, [1, 3, 3])
+        self.assertEqual(count, 4)
+        self.assertAlmostEqual(total, 101.15)
+
+    def test_timer(self):
+        ''' Test the timer records the duration with the size set in the block. '''
+        with metrics.Timer("parse", "OC") as timer:
+            timer.npeople = 30
+        series = self.get_series(model="OC", calc="all", size="26-50")
+        self.assertEqual(series["parse"][2], 1)
+
+    def test_model_process_rusage(self):
+        ''' Test the resource usage of a model process is recorded when it is waited for. '''
+        process = ModelProcess([sys.executable, "-c", "x = bytearray(64*1024*1024); sum(range(10**6))"])
+        process.wait()
+        self.assertEqual(process.returncode, 0)
+        self.assertGreater(process.rusage.ru_maxrss * 1024, 64*1024*1024)
+        self.assertGreater(process.rusage.ru_utime + process.rusage.ru_stime, 0)
+
+        metrics.observe_rusage("BC", "LIFETIME BASELINE", process.rusage)
+        metrics.observe_rusage("BC", "XXX", process.rusage)
+        cpu = {tuple(labels): count for labels, _c, _t, count in metrics.MODEL_CPU.collect()}
+        self.assertEqual(cpu, {("BC", "LIFETIME BASELINE", "user"): 1, ("BC", "LIFETIME BASELINE", "system"): 1,
+                               ("BC", "OTHER", "user"): 1, ("BC", "OTHER", "system"): 1})
+        faults = {tuple(labels): total for labels, total in metrics.MODEL_PAGE_FAULTS.collect()}
+        self.assertEqual(faults[("BC", "OTHER", "minor")], process.rusage.ru_minflt)
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_disabled(self):
+        ''' Test nothing is recorded when metrics are disabled. '''
+        metrics.observe("parse", 0.1, "BC")
+        self.assertEqual(metrics.STAGE_DURATION.collect(), [])
+
+
+class MetricsViewTests(TestCase):
+    ''' Test the request pipeline is timed and exposed on the metrics endpoint. '''
+    TEST_DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'tests', 'data')
+
+    @classmethod
+    def setUpClass(cls):
+        super(MetricsViewTests, cls).setUpClass()
+        cls.user = User.objects.create_user('testuser', email='testuser@test.com', password='testing')
+        cls.user.save()
+        cls.token = Token.objects.create(user=cls.user)
+        cls.token.save()
+        cls.client = APIClient(enforce_csrf_checks=True)
+        cls.client.credentials(HTTP_AUTHORIZATION='Token ' + cls.token.key)
+
+    def setUp(self):
+        for m in metrics.REGISTRY:
+            m.clear()
+
+    def tearDown(self):
+        for m in metrics.REGISTRY:
+            m.clear()
+
+    def test_bws_stages(self):
+        ''' Test each stage of a BWS request is timed and exposed on the metrics endpoint. '''
+        with open(os.path.join(MetricsViewTests.TEST_DATA_DIR, "d3.bwa"), "r") as pedigree_data:
+            data = {'mut_freq': 'UK', 'cancer_rates': 'UK', 'pedigree_data': pedigree_data, 'user_id': 'test_XXX'}
+            response = MetricsViewTests.client.post(reverse('bws'), data, format='multipart',
+                                                    HTTP_ACCEPT="application/json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = MetricsViewTests.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith("text/plain"))
+        content = force_text(response.content)
+        self.assertTrue("# TYPE bws_stage_duration_seconds histogram" in content)
+        self.assertTrue("# TYPE bws_model_queue_depth gauge" in content)
+        for stage in ("parse", "validate", "serialise"):
+            self.assertTrue('bws_stage_duration_seconds_count{stage="' + stage +
+                            '",model="BC",calc="all",size="2-10"} 1' in content, stage)
+        for stage in ("write_files", "queue_wait", "subprocess", "parse_output"):
+            for calc in ("carrier_probs", "remaining_lifetime"):
+                self.assertTrue('bws_stage_duration_seconds_count{stage="' + stage +
+                                '",model="BC",calc="' + calc + '",size="2-10"} 1' in content, stage + " " + calc)
+        for name in ("MUTATION PROBABILITY", "REMAINING LIFETIME", "REMAINING LIFETIME BASELINE"):
+            self.assertTrue('bws_model_cpu_seconds_count{model="BC",name="' + name + '",mode="user"} 1'
+                            in content, name)
+            self.assertTrue('bws_model_max_rss_bytes_count{model="BC",name="' + name + '"} 1' in content, name)
+            self.assertTrue('bws_model_context_switches_total{model="BC",name="' + name + '",type="voluntary"}'
+                            in content, name)
+
+    def test_not_authenticated(self):
+        ''' Test the metrics endpoint requires authentication. '''
+        response = APIClient().get(reverse('metrics'))
+        self.assertIn(response.status_code, (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
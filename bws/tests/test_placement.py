@@ -0,0 +1,74 @@
+""" Model process CPU placement tests. """
+import os
+import shutil
+from subprocess import PIPE
+import tempfile
+
+from django.test import TestCase
+
+from bws import placement
+from bws.admission import SlotLimiter
+from bws.calcs import ModelProcess
+
+
+NODES = [[0, 1, 2, 3], [4, 5, 6, 7]]
+
+
+class PlacementTests(TestCase):
+
+    def setUp(self):
+        self.lock_dir = tempfile.mkdtemp(prefix="test_placement_")
+
+    def tearDown(self):
+        shutil.rmtree(self.lock_dir)
+
+    def test_cpulist(self):
+        ''' Test kernel CPU lists are parsed and formatted. '''
+        self.assertEqual(placement.parse_cpulist("0-3,8,10-11\n"), [0, 1, 2, 3, 8, 10, 11])
+        self.assertEqual(placement.format_cpulist([11, 0, 1, 2, 3, 8, 10]), "0-3,8,10-11")
+        self.assertEqual(placement.parse_cpulist(placement.format_cpulist([])), [])
+
+    def test_nodes(self):
+        ''' Test the NUMA nodes are read from sysfs and restricted to the CPUs of the worker. '''
+        allowed = sorted(os.sched_getaffinity(0))
+        for (node, cpus) in (("node0", allowed[:1]), ("node1", allowed[1:])):
+            os.mkdir(os.path.join(self.lock_dir, node))
+            with open(os.path.join(self.lock_dir, node, "cpulist"), "w") as f:
+                f.write(placement.format_cpulist(cpus + [max(allowed) + 1]) + "\n")
+        nodes = placement.get_nodes(sysfs=self.lock_dir)
+        self.assertEqual(sum(nodes, []), allowed)
+        self.assertEqual(placement.get_nodes(sysfs=os.path.join(self.lock_dir, "none")), [allowed])
+
+    def test_spread(self):
+        ''' Test the model processes are spread across the NUMA nodes. '''
+        self.assertIsNone(placement.get_cpus(2, [], None, nodes=NODES))
+        self.assertEqual(placement.get_cpus(2, [], "cores", nodes=NODES), [0, 1])
+        self.assertEqual(placement.get_cpus(2, [(2, [0, 1])], "cores", nodes=NODES), [4, 5])
+        self.assertEqual(placement.get_cpus(2, [(2, [0, 1]), (1, [4])], "cores", nodes=NODES), [5, 6])
+        self.assertEqual(placement.get_cpus(1, [(2, [0, 1]), (3, [4, 5, 6])], "cores", nodes=NODES), [2])
+        self.assertEqual(placement.get_cpus(1, [], "node", nodes=NODES), NODES[0])
+        self.assertEqual(placement.get_cpus(1, [(2, NODES[0])], "node", nodes=NODES), NODES[1])
+        self.assertEqual(placement.get_cpus(1, [(2, NODES[0]), (1, NODES[1])], "node", nodes=NODES), NODES[1])
+
+    def test_place(self):
+        ''' Test the CPUs of a model run are recorded with its slot and avoided by the next model run. '''
+        limiter = SlotLimiter(self.lock_dir, nslots=2, queue_size=2, timeout=5, retry_after=7)
+        ncpus = len(placement.get_nodes()[0])
+        with limiter.slot() as idx:
+            self.assertIsNone(limiter.place(idx, 1, None))
+            cpus = limiter.place(idx, 1, "cores")
+            self.assertEqual(len(cpus), 1)
+            self.assertEqual(limiter.place(idx, 1, "cores"), cpus)    # not avoiding its own CPUs
+            self.assertEqual(limiter.idle_cores(), os.cpu_count() - 1)
+            with limiter.slot() as idx2:
+                other = limiter.place(idx2, 1, "cores")
+                if ncpus > 1:
+                    self.assertNotEqual(other, cpus)
+
+    def test_affinity(self):
+        ''' Test a model process is pinned to its CPUs. '''
+        cpus = sorted(os.sched_getaffinity(0))[-1:]
+        process = ModelProcess(["sh", "-c", "sleep 0.2; grep Cpus_allowed_list /proc/$$/status"], cpus=cpus,
+                               stdout=PIPE)
+        (outs, _errs) = process.communicate(timeout=30)
+        self.assertEqual(outs.decode("utf-8").split()[-1], placement.format_cpulist(cpus))
@@ -0,0 +1,98 @@
+""" Request profiling tests. """
+import os
+import pstats
+import shutil
+import tempfile
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+
+class ProfilingTests(TestCase):
+    ''' Test requests are profiled when requested by admin users or sampled. '''
+    TEST_DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'tests', 'data')
+
+    @classmethod
+    def setUpClass(cls):
+        super(ProfilingTests, cls).setUpClass()
+        cls.user = User.objects.create_user('testuser', email='testuser@test.com', password='testing')
+        cls.user.save()
+        cls.admin = User.objects.create_user('testadmin', email='testadmin@test.com', password='testing',
+                                             is_staff=True)
+        cls.admin.save()
+
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.profile_dir)
+
+    def post(self, user, filename="d3.bwa", **extra):
+        ''' POST a pedigree to the BWS as the given user. '''
+        client = APIClient(enforce_csrf_checks=True)
+        client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.get_or_create(user=user)[0].key)
+        with open(os.path.join(ProfilingTests.TEST_DATA_DIR, filename), "r") as pedigree_data:
+            data = {'mut_freq': 'UK', 'cancer_rates': 'UK', 'pedigree_data': pedigree_data, 'user_id': 'test_XXX'}
+            response = client.post(reverse('bws'), data, format='multipart', HTTP_ACCEPT="application/json", **extra)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+
+    def test_admin_pstats(self):
+        ''' Test an admin user can request a cProfile profile that includes the model processes. '''
+        with override_settings(PROFILE_DIR=self.profile_dir, PROFILE_FORMAT='pstats'):
+            response = self.post(ProfilingTests.admin, HTTP_X_BWS_PROFILE="1")
+        filename = response['X-BWS-Profile-File']
+        self.assertEqual(os.listdir(self.profile_dir), [filename])
+        stats = pstats.Stats(os.path.join(self.profile_dir, filename))
+        functions = [func for (_f, _l, func) in stats.stats.keys()]
+        self.assertTrue('communicate' in functions)
+
+    def test_admin_collapsed(self):
+        ''' Test an admin user can request a collapsed stack profile. '''
+        with override_settings(PROFILE_DIR=self.profile_dir, PROFILE_FORMAT='collapsed', PROFILE_INTERVAL=0.001):
+            response = self.post(ProfilingTests.admin, HTTP_X_BWS_PROFILE="1")
+        with open(os.path.join(self.profile_dir, response['X-BWS-Profile-File']), 'r') as f:
+            lines = f.read().splitlines()
+        self.assertGreater(len(lines), 0)
+        for line in lines:
+            (stack, count) = line.rsplit(" ", 1)
+            self.assertGreater(int(count), 0)
+        self.assertTrue(any("post (rest_api.py" in line and "communicate" in line for line in lines))
+
+    @override_settings(FAMILY_WORKERS=2)
+    def test_multi_family_pstats(self):
+        ''' Test the cProfile profile of a multi-family file includes the families run by the family workers. '''
+        with override_settings(PROFILE_DIR=self.profile_dir, PROFILE_FORMAT='pstats'):
+            response = self.post(ProfilingTests.admin, os.path.join("multi", "d1.bwa"), HTTP_X_BWS_PROFILE="1")
+        stats = pstats.Stats(os.path.join(self.profile_dir, response['X-BWS-Profile-File']))
+        functions = [func for (_f, _l, func) in stats.stats.keys()]
+        self.assertTrue('communicate' in functions)
+        self.assertTrue('get_family_result' in functions)
+
+    @override_settings(FAMILY_WORKERS=2)
+    def test_multi_family_collapsed(self):
+        ''' Test the collapsed stack profile of a multi-family file includes the family workers. '''
+        with override_settings(PROFILE_DIR=self.profile_dir, PROFILE_FORMAT='collapsed', PROFILE_INTERVAL=0.001):
+            response = self.post(ProfilingTests.admin, os.path.join("multi", "d1.bwa"), HTTP_X_BWS_PROFILE="1")
+        with open(os.path.join(self.profile_dir, response['X-BWS-Profile-File']), 'r') as f:
+            lines = f.read().splitlines()
+        self.assertTrue(any(line.startswith("bws-family") and "communicate" in line for line in lines))
+
+    def test_not_admin(self):
+        ''' Test the profile header is ignored for users that are not admin users. '''
+        with override_settings(PROFILE_DIR=self.profile_dir):
+            response = self.post(ProfilingTests.user, HTTP_X_BWS_PROFILE="1")
+        self.assertFalse(response.has_header('X-BWS-Profile-File'))
+        self.assertEqual(os.listdir(self.profile_dir), [])
+
+    def test_sample_rate(self):
+        ''' Test requests are profiled at the sampling rate. '''
+        with override_settings(PROFILE_DIR=self.profile_dir, PROFILE_SAMPLE_RATE=1.0):
+            response = self.post(ProfilingTests.user)
+        self.assertFalse(response.has_header('X-BWS-Profile-File'))
+        self.assertEqual(len(os.listdir(self.profile_dir)), 1)
@@ -0,0 +1,89 @@
+""" Synthetic pedigree generator tests. """
+from io import StringIO
+
+from django.conf import settings
+from django.core.management import call_command
+from django.test import TestCase
+
+from bws.pedigree import PedigreeFile, BwaPedigree, CanRiskPedigree
+from bws.synthetic import synthetic_pedigree_file, SyntheticPedigree
+
+
+class SyntheticPedigreeTests(TestCase):
+    ''' Test the generated pedigrees are valid. '''
+
+    def test_file_types(self):
+        ''' Test each pedigree file format is valid and has the requested family sizes. '''
+        for file_type, cls in (('canrisk1', CanRiskPedigree), ('canrisk2', CanRiskPedigree), ('bwa', BwaPedigree)):
+            for size in (1, 3, 25, settings.MAX_PEDIGREE_SIZE):
+                pf = PedigreeFile(synthetic_pedigree_file(nfamilies=2, file_type=file_type, size=size, seed=size))
+                PedigreeFile.validate(pf.pedigrees)
+                self.assertEqual(len(pf.pedigrees), 2)
+                for pedi in pf.pedigrees:
+                    self.assertTrue(isinstance(pedi, cls))
+                    self.assertEqual(len(pedi.people), size)
+                    self.assertTrue(pedi.is_risks_calc_viable())
+                    self.assertTrue(pedi.is_carrier_probs_viable())
+
+    def test_many_families(self):
+        ''' Test a file with many families. '''
+        pf = PedigreeFile(synthetic_pedigree_file(nfamilies=500, size=10, seed=1))
+        self.assertEqual(len(pf.pedigrees), 500)
+        self.assertEqual(len(set(pedi.famid for pedi in pf.pedigrees)), 500)
+        PedigreeFile.validate(pf.pedigrees)
+
+    def test_large_family(self):
+        ''' Test a family larger than the maximum pedigree size can be generated. '''
+        pedi = SyntheticPedigree("XXX", size=settings.MAX_PEDIGREE_SIZE * 2)
+        self.assertEqual(len(pedi.people), settings.MAX_PEDIGREE_SIZE * 2)
+        self.assertEqual(len([p for p in pedi.people if p['target']]), 1)
+
+    def test_twins(self):
+        ''' Test MZ twins are pairs with the same parents, year of birth and genetic tests. '''
+        pedi = SyntheticPedigree("XXX", size=150, twins=5, gtest_rate=1.0)
+        twins = pedi.get_twins()
+        self.assertEqual(len(twins), 5)
+        for twin_id in twins:
+            pair = [p for p in pedi.people if p['mztwin'] == twin_id]
+            self.assertEqual(len(pair), 2)
+            for key in ('fathid', 'mothid', 'sex', 'yob', 'gtests'):
+                self.assertEqual(pair[0][key], pair[1][key])
+
+    def test_depth(self):
+        ''' Test the number of generations below the founders is limited by the depth. '''
+        pedi = SyntheticPedigree("XXX", size=20, depth=1, sibship=(5, 10))
+        self.assertEqual(max(p['gen'] for p in pedi.people), 1)
+        with self.assertRaises(ValueError):
+            SyntheticPedigree("XXX", size=30, depth=1)
+
+    def test_header(self):
+        ''' Test risk factors and PRS are declared in the header for the target. '''
+        pf = PedigreeFile(synthetic_pedigree_file(nfamilies=3, risk_factors=True, prs=True, seed=3))
+        PedigreeFile.validate(pf.pedigrees)
+        for pedi in pf.pedigrees:
+            self.assertNotEqual(pedi.bc_risk_factor_code, 0)
+            self.assertIsNotNone(pedi.bc_prs)
+            self.assertIsNotNone(pedi.oc_prs)
+
+    def test_seed(self):
+        ''' Test the same seed generates the same file. '''
+        self.assertEqual(synthetic_pedigree_file(nfamilies=2, size=40, twins=2, prs=True, seed=7),
+                         synthetic_pedigree_file(nfamilies=2, size=40, twins=2, prs=True, seed=7))
+        self.assertNotEqual(synthetic_pedigree_file(size=40, seed=7), synthetic_pedigree_file(size=40, seed=8))
+
+    def test_invalid(self):
+        ''' Test invalid generator options. '''
+        with self.assertRaises(ValueError):
+            SyntheticPedigree("XXX", size=2)
+        with self.assertRaises(ValueError):
+            SyntheticPedigree("XXX", twins=settings.MAX_NUMBER_MZ_TWIN_PAIRS + 1)
+        with self.assertRaises(ValueError):
+            synthetic_pedigree_file(file_type='xxx')
+
+    def test_command(self):
+        ''' Test the command line utility writes a valid pedigree file. '''
+        out = StringIO()
+        call_command('synthetic_pedigrees', '--size', '12', '--families', '4', '--format', 'bwa', '--seed', '1',
+                     '--validate', stdout=out)
+        pf = PedigreeFile(out.getvalue())
+        self.assertEqual(len(pf.pedigrees), 4)
@@ -1,16 +1,22 @@
 """ BOADICEA web-service throttling tests.  """
 
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from rest_framework import status
 from rest_framework.test import APIRequestFactory, APIClient, force_authenticate
 from django.core.cache import cache
+from django.core.files.uploadedfile import InMemoryUploadedFile, SimpleUploadedFile
+from unittest.mock import patch
 
-from bws.throttles import EndUserIDRateThrottle
+from bws.throttles import EndUserIDRateThrottle, PedigreeCostRateThrottle
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from rest_framework.request import Request
+from rest_framework.parsers import MultiPartParser
 from rest_framework.authentication import BasicAuthentication
 from rest_framework.permissions import IsAuthenticated
 from django.contrib.auth.models import User
+from django.conf import settings
+import os
 
 
 class TestEndUserIDRateThrottle(EndUserIDRateThrottle):
@@ -19,6 +25,11 @@ class TestEndUserIDRateThrottle(EndUserIDRateThrottle):
     scope = 'test_enduser_burst'
 
 
+class TestPedigreeCostRateThrottle(PedigreeCostRateThrottle):
+    rate = '100/min'
+    scope = 'test_cpu_budget'
+
+
 class MockView_Throttling(APIView):
     throttle_classes = (TestEndUserIDRateThrottle,)
 
@@ -31,6 +42,11 @@ class MockView_Authenticated_Throttling(MockView_Throttling):
     permission_classes = (IsAuthenticated,)
 
 
+class MockView_Cost_Throttling(MockView_Authenticated_Throttling):
+    throttle_classes = (TestPedigreeCostRateThrottle,)
+    model = settings.BC_MODEL
+
+
 class ThrottlingTests(TestCase):
 
     def setUp(self):
@@ -62,3 +78,90 @@ class ThrottlingTests(TestCase):
                 self.assertEqual(response.status_code, status.HTTP_200_OK)
             else:
                 self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_throttled_requests_not_counted(self):
+        ''' Ensure throttled requests do not count against the rate and the previous window slides out '''
+        def post(now):
+            with patch.object(TestEndUserIDRateThrottle, 'timer', return_value=now):
+                request = self.factory.post('/', data={"user_id": "testuserA"})
+                return MockView_Throttling.as_view()(request)
+
+        for dummy in range(1, TestEndUserIDRateThrottle.max_rate+1):
+            self.assertEqual(post(600).status_code, status.HTTP_200_OK)
+        for dummy in range(5):
+            response = post(600)
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        # the requests are counted in the next window until a third of the window has passed
+        self.assertEqual(response['Retry-After'], '80')
+        self.assertEqual(post(679).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(post(680).status_code, status.HTTP_200_OK)
+
+        # two thirds of the previous window's requests are counted until they slide out
+        response = post(680)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '20')
+        self.assertEqual(post(700).status_code, status.HTTP_200_OK)
+
+    def test_pedigree_cost(self):
+        ''' Ensure the cost scales with the number of people, families and calculations '''
+        data_dir = os.path.join(os.path.dirname(__file__), 'data')
+        with open(os.path.join(data_dir, "d3.bwa"), "r") as f:
+            pedigree_data = f.read()
+        npeople = len(pedigree_data.strip().splitlines()) - 2
+        ngenes = len(settings.BC_MODEL['GENES'])
+        self.assertEqual(PedigreeCostRateThrottle.get_pedigree_cost(pedigree_data, ['carrier_probs'], ngenes),
+                         npeople*(ngenes+1))
+        self.assertEqual(PedigreeCostRateThrottle.get_pedigree_cost(pedigree_data, ['lifetime', 'ten_year'], ngenes),
+                         2*(npeople+1))
+        with open(os.path.join(data_dir, "multi", "d1.bwa"), "r") as f:
+            multi_pedigree_data = f.read()
+        self.assertGreater(PedigreeCostRateThrottle.get_pedigree_cost(multi_pedigree_data, ['lifetime'], ngenes),
+                           npeople+1)
+
+    def test_requests_are_cost_throttled(self):
+        ''' Ensure large pedigrees use up the CPU budget faster than small pedigrees '''
+        pedigree = "##CanRisk 2.0\n##FamID\tName\tTarget\tIndivID\n" + "FAM1\tx\n"*3
+        ncalcs = len(settings.BC_MODEL['CALCS'])
+        cost = PedigreeCostRateThrottle.get_pedigree_cost(pedigree, settings.BC_MODEL['CALCS'],
+                                                          len(settings.BC_MODEL['GENES']))
+        self.assertGreater(cost, 3*ncalcs)
+        for dummy in range(1, 100 // cost + 2):
+            request = self.factory.post('/', data={"user_id": "testuserA", "pedigree_data": pedigree})
+            force_authenticate(request, user=self.user)
+            response = MockView_Cost_Throttling.as_view()(request)
+            if dummy <= 100 // cost:
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+            else:
+                self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_cost_over_budget(self):
+        ''' Ensure a request costing more than the whole budget is allowed once the budget is unused '''
+        pedigree = "##CanRisk 2.0\n##FamID\tName\tTarget\tIndivID\n" + "FAM1\tx\n"*100
+        self.assertGreater(PedigreeCostRateThrottle.get_pedigree_cost(pedigree, settings.BC_MODEL['CALCS'],
+                                                                      len(settings.BC_MODEL['GENES'])), 100)
+
+        def post(now):
+            with patch.object(TestPedigreeCostRateThrottle, 'timer', return_value=now):
+                request = self.factory.post('/', data={"user_id": "testuserA", "pedigree_data": pedigree})
+                force_authenticate(request, user=self.user)
+                return MockView_Cost_Throttling.as_view()(request)
+
+        self.assertEqual(post(600).status_code, status.HTTP_200_OK)
+        response = post(630)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '90')
+        self.assertEqual(post(719).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(post(720).status_code, status.HTTP_200_OK)
+
+    def test_large_file_cost(self):
+        ''' Ensure a pedigree file over the size limit is charged the whole budget without being read '''
+        pedigree = "##CanRisk 2.0\n##FamID\tName\tTarget\tIndivID\n" + "FAM1\tx\n"*3
+        upload = SimpleUploadedFile("pedigree.txt", pedigree.encode("utf-8"))
+        request = Request(self.factory.post('/', data={"pedigree_data": upload}), parsers=[MultiPartParser()])
+        throttle = TestPedigreeCostRateThrottle()
+        view = MockView_Cost_Throttling()
+        self.assertLess(throttle.get_request_cost(request, view), throttle.num_requests)
+        with override_settings(MAX_PEDIGREE_FILE_SIZE=len(pedigree)-1), \
+                patch.object(InMemoryUploadedFile, 'chunks') as chunks:
+            self.assertEqual(throttle.get_request_cost(request, view), throttle.num_requests)
+            chunks.assert_not_called()
@@ -3,7 +3,9 @@ import json
 import os
 from pathlib import Path
 
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test.testcases import TestCase
 from django.test.utils import override_settings
 from django.urls import reverse
@@ -14,6 +16,8 @@ from rest_framework.test import APIClient
 import vcf2prs
 from vcf2prs.prs import Prs
 
+from bws.vcf2prs_api import get_genotypes, get_reference_positions, Zscore2PercentView
+
 
 class Vcf2PrsWebServices(TestCase):
     ''' Test the VCF to PRS webservice '''
@@ -65,6 +69,28 @@ class Vcf2PrsWebServices(TestCase):
         zscore = prs.z_Score
         self.assertEqual(zscore, content['breast_cancer_prs']['zscore'], 'web-service and direct calculation')
 
+    def test_prs_indexed_genotypes(self):
+        ''' Test the PRS calculated from the VCF records at the reference positions is
+        the same as that from the whole VCF file. '''
+        with open(self.vcf_file, "r") as f:
+            vcf_file = f.read()
+        genotypes = get_genotypes(vcf_file, self.prs_file_name)
+        nrecords = len([line for line in genotypes.getvalue().splitlines() if not line.startswith('#')])
+        self.assertLessEqual(nrecords, len(get_reference_positions(self.prs_file_name)))
+
+        prs1 = Prs(prs_file=self.prs_file_name, geno_file=self.vcf_file, sample='0.9')
+        prs2 = Prs(prs_file=self.prs_file_name, geno_file=get_genotypes(vcf_file, self.prs_file_name), sample='0.9')
+        self.assertEqual(prs1.z_Score, prs2.z_Score)
+        self.assertEqual(prs1.alpha, prs2.alpha)
+
+    def test_prs_unknown_reference_file(self):
+        ''' Test POSTing with an unknown PRS reference file returns a 406. '''
+        data = {'vcf_file': self.vcf_data, 'sample_name': '0.9', 'bc_prs_reference_file': 'UNKNOWN.prs'}
+        Vcf2PrsWebServices.client.credentials(HTTP_AUTHORIZATION='Token ' + Vcf2PrsWebServices.token.key)
+        response = Vcf2PrsWebServices.client.post(Vcf2PrsWebServices.url, data, format='multipart',
+                                                  HTTP_ACCEPT="application/json")
+        self.assertEqual(response.status_code, status.HTTP_406_NOT_ACCEPTABLE)
+
     def test_prs_err(self):
         ''' Test POSTing to the 400 returned without the vcf specified. '''
         data = {'sample_name': 'SampleA'}
@@ -74,6 +100,23 @@ class Vcf2PrsWebServices(TestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertEqual(response.data['vcf_file'][0], 'This field is required.')
 
+    def test_prs_large_vcf(self):
+        ''' Test POSTing a vcf file larger than the maximum pedigree file size. '''
+        with open(self.vcf_file, "r") as f:
+            (fileformat, rest) = f.read().split("\n", 1)
+        padding = "##comment=" + ("X" * 1000) + "\n"
+        vcf_file = fileformat + "\n" + padding * (settings.MAX_PEDIGREE_FILE_SIZE // len(padding) + 1) + rest
+        self.assertGreater(len(vcf_file), settings.MAX_PEDIGREE_FILE_SIZE)
+        data = {'vcf_file': SimpleUploadedFile("large.vcf", vcf_file.encode("utf-8")), 'sample_name': '0.9',
+                'bc_prs_reference_file': self.prs_reference_file}
+        Vcf2PrsWebServices.client.credentials(HTTP_AUTHORIZATION='Token ' + Vcf2PrsWebServices.token.key)
+        response = Vcf2PrsWebServices.client.post(Vcf2PrsWebServices.url, data, format='multipart',
+                                                  HTTP_ACCEPT="application/json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        content = json.loads(force_text(response.content))
+        prs = Prs(prs_file=self.prs_file_name, geno_file=self.vcf_file, sample='0.9')
+        self.assertEqual(prs.z_Score, content['breast_cancer_prs']['zscore'])
+
     @override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=1)
     def test_prs_upload_limit(self):
         ''' Test POSTing to a vcf file that is too large. '''
@@ -82,3 +125,16 @@ class Vcf2PrsWebServices(TestCase):
         response = Vcf2PrsWebServices.client.post(Vcf2PrsWebServices.url, data, format='multipart',
                                                   HTTP_ACCEPT="application/json")
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class Zscore2PercentTests(TestCase):
+    ''' Test the conversion of z-scores to percentages. '''
+
+    def test_percentages(self):
+        ''' Test a list of z-scores gives the same percentages, in the same order, as single z-scores. '''
+        zscores = [-9, -5.2, -2.5, -1, 0, 0.3, 1.96, 4.5, 12]
+        percents = Zscore2PercentView.get_percentage(zscores)
+        self.assertEqual(len(zscores), len(percents))
+        for zscore, percent in zip(zscores, percents):
+            self.assertAlmostEqual(Zscore2PercentView.get_percentage(zscore), percent, places=10)
+        self.assertEqual(Zscore2PercentView.get_percentage(0), 50.0)
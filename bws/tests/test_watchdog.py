@@ -0,0 +1,92 @@
+""" Model process lifecycle and watchdog tests. """
+from io import StringIO
+import os
+import shutil
+from subprocess import PIPE
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management import call_command
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from bws import watchdog
+from bws.calcs import ModelProcess, Predictions
+from bws.exceptions import TimeOutException
+from bws.pedigree import Female, BwaPedigree
+
+
+def is_running(pid, wait=1):
+    """ Return true if a process is still running, i.e. exists and is not a zombie, after waiting for it to exit. """
+    end = time.time() + wait
+    while True:
+        try:
+            with open("/proc/" + str(pid) + "/stat", "r") as f:
+                running = f.read().rsplit(")", 1)[1].split()[0] != "Z"
+        except OSError:
+            running = False
+        if not running or time.time() > end:
+            return running
+        time.sleep(0.01)
+
+
+class ModelProcessTests(TestCase):
+
+    def setUp(self):
+        self.cwd = tempfile.mkdtemp(prefix="test_watchdog_")
+
+    def tearDown(self):
+        shutil.rmtree(self.cwd)
+
+    def test_kill_group(self):
+        ''' Test a process ignoring SIGTERM and the process it started are killed and reaped. '''
+        process = ModelProcess(["sh", "-c", "trap '' TERM; sleep 60 & echo $!; wait"], stdout=PIPE)
+        child = int(process.stdout.readline())
+        self.assertTrue(is_running(child, wait=0))
+        self.assertEqual(os.getpgid(process.pid), process.pid)
+        self.assertEqual(os.getpgid(child), process.pid)
+
+        process.kill_group(grace=0.1)
+        self.assertIsNotNone(process.returncode)
+        self.assertFalse(is_running(process.pid))
+        self.assertFalse(is_running(child))
+
+    def test_run_timeout(self):
+        ''' Test a model run that times out is killed and its partial outputs are removed. '''
+        pedi = BwaPedigree(people=[Female("FAM1", "F0", "001", "", "", target="1", age="40", yob="1980")])
+        env = dict(settings.FORTRAN_ENV, BWS_SIM_BASE="30", BWS_SIM_MODE="sleep")
+        with override_settings(FORTRAN_ENV=env, FORTRAN_TIMEOUT=0.5, FORTRAN_KILL_GRACE=0.1,
+                               FORTRAN_COALESCE_DIR=None):
+            with self.assertRaises(TimeOutException):
+                Predictions(pedi, cwd=self.cwd, model_settings=settings.BC_MODEL, calcs=["carrier_probs"])
+        self.assertFalse(os.path.exists(os.path.join(self.cwd, "can_probs.out")))
+        self.assertEqual([p for p in watchdog.get_model_processes() if p.owner == os.getpid()], [])
+
+
+class WatchdogTests(TestCase):
+
+    def test_orphaned(self):
+        ''' Test orphaned and overdue model processes are reported and killed. '''
+        exited = ModelProcess(["true"])
+        exited.wait()
+        process = ModelProcess(["sleep", "60"])
+        try:
+            processes = [p for p in watchdog.get_model_processes() if p.pid == process.pid]
+            self.assertEqual(len(processes), 1)
+            self.assertEqual(processes[0].owner, os.getpid())
+            self.assertFalse(processes[0].is_orphaned())
+
+            processes[0].owner = exited.pid     # as if started by a worker that has exited
+            self.assertTrue(processes[0].is_orphaned())
+            self.assertFalse(processes[0].is_overdue())
+            with override_settings(FORTRAN_TIMEOUT=-10, FORTRAN_KILL_GRACE=0):
+                self.assertTrue(processes[0].is_overdue())
+                self.assertIn(process.pid, [p.pid for p in watchdog.get_stray_processes(log=False)])
+                out = StringIO()
+                call_command('model_watchdog', '--kill', stdout=out)
+                self.assertIn("overdue pid=" + str(process.pid), out.getvalue())
+            process.wait(timeout=5)
+            self.assertFalse(is_running(process.pid))
+        finally:
+            process.kill_group(grace=0)
@@ -1,10 +1,12 @@
 """ Mutation risk and probability calculation testing. """
 from datetime import date
 from django.test import TestCase
+from django.test.utils import override_settings
 from bws.pedigree import Female, PedigreeFile, BwaPedigree, CanRiskPedigree
 from copy import deepcopy
 from bws.calcs import Predictions, RemainingLifetimeRisk, RangeRiskBaseline,\
-    ModelParams
+    ModelParams, get_param_file
+from bws.checks import check_model_files
 from bws.cancer import Cancer, Cancers, CanRiskGeneticTests
 from django.conf import settings
 import tempfile
@@ -295,3 +297,56 @@ class RiskTests(TestCase):
                         yob=str(self.year-23), cancers=Cancers(bc1=Cancer("20")))
         pedigree.people.append(sister)
         self.assertEqual(Predictions._get_niceness(pedigree), 1)
+
+
+class ModelFilesTests(TestCase):
+    """ Shared model parameters files and system checks. """
+
+    def setUp(self):
+        self.params_dir = tempfile.mkdtemp(prefix="test_params_")
+
+    def tearDown(self):
+        shutil.rmtree(self.params_dir)
+
+    def test_param_file(self):
+        ''' Test a parameters file is written once and shared by runs with the same settings. '''
+        msettings = settings.BC_MODEL
+        mutation_freq = msettings['MUTATION_FREQUENCIES']['UK']
+        sensitivity = msettings['GENETIC_TEST_SENSITIVITY']
+        with override_settings(PARAMS_DIR=self.params_dir):
+            path1 = get_param_file(msettings, mutation_freq, sensitivity)
+            mtime = os.stat(path1).st_mtime_ns
+            self.assertEqual(get_param_file(msettings, dict(mutation_freq), dict(sensitivity)), path1)
+            self.assertEqual(os.stat(path1).st_mtime_ns, mtime)
+            path2 = get_param_file(msettings, mutation_freq, sensitivity, isashk=True)
+            self.assertNotEqual(path1, path2)
+        self.assertEqual(len(os.listdir(self.params_dir)), 2)
+
+        pedigree_file = os.path.join(self.params_dir, "test.params")
+        BwaPedigree(people=[Female("XXX", "F1", "1", "0", "0", target="1")]).write_param_file(
+            filepath=pedigree_file, model_settings=msettings, mutation_freq=mutation_freq, sensitivity=sensitivity)
+        self.assertTrue(filecmp.cmp(path1, pedigree_file, shallow=False))
+
+    def test_custom_param_file(self):
+        ''' Test a parameters file for custom settings is written to the working directory. '''
+        msettings = settings.BC_MODEL
+        mutation_freq = {g: 0.001 for g in msettings['MUTATION_FREQUENCIES']['UK']}
+        sensitivity = {g: 0.5 for g in msettings['GENETIC_TEST_SENSITIVITY']}
+        cwd = os.path.join(self.params_dir, "cwd")
+        os.mkdir(cwd)
+        with override_settings(PARAMS_DIR=os.path.join(self.params_dir, "params")):
+            path1 = get_param_file(msettings, mutation_freq, msettings['GENETIC_TEST_SENSITIVITY'], cwd=cwd)
+            path2 = get_param_file(msettings, msettings['MUTATION_FREQUENCIES']['UK'], sensitivity, cwd=cwd)
+            self.assertRaises(ValueError, get_param_file, msettings, mutation_freq, sensitivity)
+            self.assertFalse(os.path.exists(settings.PARAMS_DIR))
+        self.assertEqual(os.path.dirname(path1), cwd)
+        self.assertEqual(sorted(os.listdir(cwd)), sorted([os.path.basename(path1), os.path.basename(path2)]))
+
+    def test_check_incidence_files(self):
+        ''' Test the system check reports missing cancer incidence rates files. '''
+        with override_settings(PARAMS_DIR=self.params_dir):
+            self.assertEqual(check_model_files(None), [])
+            with override_settings(OC_MODEL=dict(settings.OC_MODEL, INCIDENCE="/xxx/incidences_")):
+                errors = check_model_files(None)
+        self.assertEqual(len(errors), len(settings.OC_MODEL['CANCER_RATES']))
+        self.assertEqual(set(e.id for e in errors), {"bws.E001"})
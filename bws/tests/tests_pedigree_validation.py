@@ -5,15 +5,18 @@ from datetime import date
 import os
 import random
 import re
+from unittest.mock import patch
 
+from django.core.cache import cache
 from django.test import TestCase
 from django.test.utils import override_settings
 
+from bws import metrics
 from bws.cancer import GeneticTest, PathologyTest, PathologyTests, BWSGeneticTests,\
     Genes
 from bws.exceptions import PathologyError, PedigreeError, GeneticTestError, \
     CancerError, PersonError, PedigreeFileError
-from bws.pedigree import PedigreeFile, Male, Female
+from bws.pedigree import PedigreeFile, Male, Female, Person
 from django.conf import settings
 
 
@@ -105,6 +108,25 @@ class PedigreeFileTests(TestCase, ErrorTests):
                                     r"CanRisk format 2 pedigree files should have 27 data items per line."):
             PedigreeFile(pd)
 
+    def test_file_size(self):
+        ''' Test a pedigree file larger than the maximum size is rejected before it is parsed. '''
+        pd = self.get_pedigree_data()
+        with override_settings(MAX_PEDIGREE_FILE_SIZE=len(pd)-1):
+            with self.assertRaisesRegex(PedigreeFileError, r"larger than the maximum size"):
+                PedigreeFile(pd)
+        with override_settings(MAX_PEDIGREE_FILE_SIZE=len(pd)):
+            PedigreeFile(pd)
+
+    def test_file_lines(self):
+        ''' Test a pedigree file with more than the maximum number of lines is rejected. '''
+        pd = self.get_pedigree_data()
+        nlines = len(pd.splitlines())
+        with override_settings(MAX_PEDIGREE_FILE_LINES=nlines-1):
+            with self.assertRaisesRegex(PedigreeFileError, r"more than the maximum of"):
+                PedigreeFile(pd)
+        with override_settings(MAX_PEDIGREE_FILE_LINES=nlines):
+            PedigreeFile(pd)
+
 
 class PersonTests(TestCase, ErrorTests):
     """ Tests related to individuals in the pedigree. """
@@ -128,19 +150,19 @@ class PersonTests(TestCase, ErrorTests):
         m2 = pedigree.get_person_by_name('M2')
         m2.pid = "XXXXXXXX"
         with self.assertRaisesRegex(PersonError, r"Individual identifiers must be alphanumeric strings with a max"):
-            m2.validate(pedigree)
+            pedigree.validate_structure()
 
         m2.pid = ""
         with self.assertRaisesRegex(PersonError, r"Individual identifiers must be alphanumeric strings with a max"):
-            m2.validate(pedigree)
+            pedigree.validate_structure()
 
         m2.pid = "000"
         with self.assertRaisesRegex(PersonError, r"Individual identifiers must be alphanumeric strings with a max"):
-            m2.validate(pedigree)
+            pedigree.validate_structure()
 
         m2.pid = "X*A"
         with self.assertRaisesRegex(PersonError, r"Individual identifiers must be alphanumeric strings with a max"):
-            m2.validate(pedigree)
+            pedigree.validate_structure()
 
     def test_fathid_id(self):
         """ Test an error is raised if the father ID is not an alphanumeric or is too large.  """
@@ -149,15 +171,15 @@ class PersonTests(TestCase, ErrorTests):
         m2 = pedigree.get_person_by_name('M2')
         m2.fathid = "XXXXXXXX"
         with self.assertRaisesRegex(PersonError, r"Father identifier .* unexpected character"):
-            m2.validate(pedigree)
+            pedigree.validate_structure()
 
         m2.fathid = ""
         with self.assertRaisesRegex(PersonError, r"Father identifier .* unexpected character"):
-            m2.validate(pedigree)
+            pedigree.validate_structure()
 
         m2.fathid = "X*A"
         with self.assertRaisesRegex(PersonError, r"Father identifier .* unexpected character"):
-            m2.validate(pedigree)
+            pedigree.validate_structure()
 
     def test_mothid_id(self):
         """ Test an error is raised if the mother ID is not an alphanumeric or is too large.  """
@@ -166,15 +188,15 @@ class PersonTests(TestCase, ErrorTests):
         m2 = pedigree.get_person_by_name('M2')
         m2.mothid = "XXXXXXXX"
         with self.assertRaisesRegex(PersonError, r"Mother identifier .* unexpected character"):
-            m2.validate(pedigree)
+            pedigree.validate_structure()
 
         m2.mothid = ""
         with self.assertRaisesRegex(PersonError, r"Mother identifier .* unexpected character"):
-            m2.validate(pedigree)
+            pedigree.validate_structure()
 
         m2.mothid = "X*A"
         with self.assertRaisesRegex(PersonError, r"Mother identifier .* unexpected character"):
-            m2.validate(pedigree)
+            pedigree.validate_structure()
 
     def test_parent_unspecified(self):
         """ Test an error is raised if only one of the parents is specified. """
@@ -183,7 +205,7 @@ class PersonTests(TestCase, ErrorTests):
         m2 = pedigree.get_person_by_name('F1')
         m2.mothid = "0"
         with self.assertRaisesRegex(PersonError, r"only one parent specified"):
-            m2.validate(pedigree)
+            pedigree.validate_structure()
 
     def test_father_sex(self):
         ''' Test an error is raised if the sex of the father is not 'M'. '''
@@ -338,6 +360,25 @@ class PedigreeTests(TestCase, ErrorTests):
         with self.assertRaisesRegex(PedigreeError, r"unexpected number of family members"):
             PedigreeFile(self.pedigree_data)
 
+    @override_settings(MAX_PEDIGREE_SIZE=2)
+    def test_family_members_parsed(self):
+        """ Test a pedigree with more than MAX_PEDIGREE_SIZE members is rejected before they are created. """
+        with patch.object(Person, 'factory', wraps=Person.factory) as factory:
+            with self.assertRaisesRegex(PedigreeError, r"the maximum is 2"):
+                PedigreeFile(self.pedigree_data)
+        factory.assert_not_called()
+
+    def test_structure_first(self):
+        """ Test the structural checks of all pedigrees are run before the other checks. """
+        pedigree_data = copy.copy(self.pedigree_data)
+        pedigree_data2 = '\n'.join(pedigree_data.split('\n')[2:]).replace("XXX", "YYY")
+        pedigree_file = PedigreeFile(pedigree_data + '\n' + pedigree_data2)
+        self.assertEqual(len(pedigree_file.pedigrees), 2)
+        pedigree_file.pedigrees[0].get_person_by_name('F1').age = "0"
+        pedigree_file.pedigrees[1].people.remove(pedigree_file.pedigrees[1].get_person_by_name('M2'))
+        with self.assertRaisesRegex(PersonError, r"The father (.*) is missing"):
+            PedigreeFile.validate(pedigree_file.pedigrees)
+
     def test_sex(self):
         """ Test an error is raised if individuals sex is not M or F. """
         pedigree_data = copy.copy(self.pedigree_data)
@@ -844,3 +885,62 @@ class PathologyTestTests(TestCase, ErrorTests):
             her2=PathologyTest(PathologyTest.HER2_TEST, result="N"),
             ck14=PathologyTest(PathologyTest.CK14_TEST, result="P"),
             ck56=PathologyTest(PathologyTest.CK56_TEST, result="P"))), " 6 ")
+
+
+class ValidationCacheTests(TestCase, ErrorTests):
+    """ Tests related to caching the pedigree validation results. """
+
+    def setUp(self):
+        ''' Read in pedigree data. '''
+        super().setUpErrorTests()
+        cache.clear()
+        metrics.VALIDATION_CACHE.clear()
+
+    def tearDown(self):
+        cache.clear()
+        metrics.VALIDATION_CACHE.clear()
+
+    def get_lookups(self):
+        return {tuple(labels): total for labels, total in metrics.VALIDATION_CACHE.collect()}
+
+    def test_content_hash(self):
+        ''' Test the hash is of the parsed pedigree and not the layout of the file. '''
+        pedigree_data = re.sub(r"\t", "    ", self.pedigree_data)
+        self.assertEqual(PedigreeFile(pedigree_data).pedigrees[0].content_hash(),
+                         self.pedigree_file.pedigrees[0].content_hash())
+        pedigree = deepcopy(self.pedigree_file.pedigrees[0])
+        pedigree.get_person_by_name('F1').cancers.diagnoses.bc1.age = "22"
+        self.assertNotEqual(pedigree.content_hash(), self.pedigree_file.pedigrees[0].content_hash())
+
+    def test_warnings_cached(self):
+        ''' Test the warnings of a resubmitted pedigree are returned without validating it again. '''
+        pedigree_file = deepcopy(self.pedigree_file)
+        f1 = pedigree_file.pedigrees[0].get_person_by_name('F1')
+        pedigree_file.pedigrees[0].people.append(Male(f1.famid, "M1A", "111", f1.fathid, f1.mothid))
+        with patch.object(PedigreeFile, 'validate', wraps=PedigreeFile.validate) as validate:
+            warnings1 = PedigreeFile.validate_cached(pedigree_file.pedigrees, "BC")
+            warnings2 = PedigreeFile.validate_cached(deepcopy(pedigree_file.pedigrees), "OC")
+        self.assertEqual(validate.call_count, 1)
+        self.assertEqual(len(warnings1), 1)
+        self.assertEqual(warnings1, warnings2)
+        self.assertEqual(self.get_lookups(), {("BC", "miss"): 1, ("OC", "hit"): 1})
+
+    def test_error_cached(self):
+        ''' Test the validation error of a resubmitted pedigree is raised again. '''
+        pedigree_file = deepcopy(self.pedigree_file)
+        f2 = pedigree_file.pedigrees[0].get_person_by_name('F2')
+        pedigree_file.pedigrees[0].people.remove(f2)
+        with patch.object(PedigreeFile, 'validate', wraps=PedigreeFile.validate) as validate:
+            for _i in range(2):
+                with self.assertRaisesRegex(PersonError, r"\[XXX1\] - The mother (.*) is missing"):
+                    PedigreeFile.validate_cached(pedigree_file.pedigrees, "BC")
+        self.assertEqual(validate.call_count, 1)
+        self.assertEqual(self.get_lookups(), {("BC", "miss"): 1, ("BC", "hit"): 1})
+
+    @override_settings(VALIDATION_CACHE_TIMEOUT=0)
+    def test_disabled(self):
+        ''' Test the pedigrees are always validated when the cache is disabled. '''
+        with patch.object(PedigreeFile, 'validate', wraps=PedigreeFile.validate) as validate:
+            PedigreeFile.validate_cached(self.pedigree_file.pedigrees, "BC")
+            PedigreeFile.validate_cached(self.pedigree_file.pedigrees, "BC")
+        self.assertEqual(validate.call_count, 2)
@@ -1,6 +1,12 @@
 import logging
+import re
+
+from django.conf import settings
+from django.core.files.base import File
 from rest_framework.throttling import UserRateThrottle, SimpleRateThrottle
 
+from bws.pedigree import BLANK_LINE
+
 logger = logging.getLogger(__name__)
 
 
@@ -20,17 +26,89 @@ class LogThrottleMixin():
         return False
 
 
-class BurstRateThrottle(LogThrottleMixin, UserRateThrottle):
+class CounterThrottleMixin():
+    """
+    Sliding window counter used in place of the list of request timestamps that SimpleRateThrottle
+    stores in the cache for each key. Requests are counted in fixed windows of the throttle duration
+    using atomic cache increments, and the count in the previous window is weighted by how much of it
+    still overlaps the sliding window. The cost of a request is constant whatever the rate, e.g.
+    '6000/day' no longer means reading and writing a list of up to 6000 timestamps per request.
+
+    Increments are atomic with the memcached, redis and local memory cache backends.
+    """
+
+    def get_cost(self, request, view):
+        """ Number of requests counted against the rate for this request. """
+        return 1
+
+    def allow_request(self, request, view):
+        """ Implement the check to see if the request should be throttled. """
+        if self.rate is None:
+            return True
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        self.now = self.timer()
+        window = int(self.now // self.duration)
+        self.elapsed = self.now - window * self.duration
+        self.window_key = self.key + "_" + str(window)
+        self.cost = self.get_cost(request, view)
+
+        count = self.incr(self.window_key, self.cost)
+        self.previous = self.cache.get(self.key + "_" + str(window - 1), 0)
+        self.count = count + self.previous * (self.duration - self.elapsed) / self.duration
+        if self.count > self.num_requests:
+            self.cache.decr(self.window_key, self.cost)     # rejected requests are not counted
+            self.count -= self.cost
+            self.current = count - self.cost
+            return self.throttle_failure()
+        return self.throttle_success()
+
+    def incr(self, key, delta):
+        """ Atomically increment a window counter, creating it if it does not exist. """
+        try:
+            return self.cache.incr(key, delta)
+        except ValueError:
+            # counter kept for two windows as it is weighted into the next window's count
+            if self.cache.add(key, delta, 2 * self.duration):
+                return delta
+            return self.cache.incr(key, delta)
+
+    def throttle_success(self):
+        """ The request has already been counted. """
+        return True
+
+    def wait(self):
+        """
+        Returns the recommended next request time in seconds, i.e. when enough of the counted
+        requests have slid out of the window for this request to be allowed.
+        """
+        remaining_duration = self.duration - self.elapsed
+        excess = self.count + self.cost - self.num_requests
+        previous_share = self.previous * remaining_duration / self.duration
+        if self.previous > 0 and excess <= previous_share:
+            # wait for enough of the previous window to slide out
+            return excess * self.duration / self.previous
+        if self.current <= 0:
+            return remaining_duration
+        # the previous window slides out by the start of the next window, when the current window
+        # becomes the previous window and then has to slide out by the rest of the excess
+        return remaining_duration + self.duration * (excess - previous_share) / self.current
+
+
+class BurstRateThrottle(LogThrottleMixin, CounterThrottleMixin, UserRateThrottle):
     """ Throttle short burst of requests from a user. """
     scope = 'burst'
 
 
-class SustainedRateThrottle(LogThrottleMixin, UserRateThrottle):
+class SustainedRateThrottle(LogThrottleMixin, CounterThrottleMixin, UserRateThrottle):
     """ Throttle sustained requests from a user. """
     scope = 'sustained'
 
 
-class EndUserIDRateThrottle(LogThrottleMixin, SimpleRateThrottle):
+class EndUserIDRateThrottle(LogThrottleMixin, CounterThrottleMixin, SimpleRateThrottle):
     """
     Limits the rate of API calls that may be made by a given end user.
     The end user id plus the user will be used as a unique cache key.
@@ -51,3 +129,82 @@ class EndUserIDRateThrottle(LogThrottleMixin, SimpleRateThrottle):
             }
         except TypeError:
             return None
+
+
+class PedigreeCostRateThrottle(LogThrottleMixin, CounterThrottleMixin, UserRateThrottle):
+    """
+    Limits the model CPU budget used by a user. Rather than counting each request once, a
+    request is charged the estimated cost of the calculations it asks for, so a one person
+    pedigree costs much less than a large multi-family file. The rate is given in cost units
+    per period, where a unit is one person in one model run. A request costing more than the
+    whole budget is charged the whole budget, so that it is allowed once the budget is unused
+    rather than always throttled.
+    """
+    scope = 'cpu_budget'
+
+    def get_cost(self, request, view):
+        """ Estimated cost of the calculations requested, at most the budget. """
+        cost = self.get_request_cost(request, view)
+        if cost > self.num_requests:
+            logger.warning(f"REQUEST COST ({self.__class__.__name__}): {cost} more than the budget of "
+                           f"{self.num_requests}; USER: {request.user}")
+            return self.num_requests
+        return cost
+
+    def get_request_cost(self, request, view):
+        """
+        Estimated cost of the calculations requested. A pedigree file larger than
+        MAX_PEDIGREE_FILE_SIZE is charged the whole budget without being read.
+        """
+        try:
+            pedigree_data = request.data.get('pedigree_data')
+        except AttributeError:
+            return 1
+        if isinstance(pedigree_data, (File, str)):
+            size = pedigree_data.size if isinstance(pedigree_data, File) else len(pedigree_data)
+            if size > settings.MAX_PEDIGREE_FILE_SIZE:
+                return self.num_requests
+        if isinstance(pedigree_data, File):
+            pedigree_data.seek(0)
+            content = b''.join(pedigree_data.chunks()).decode("utf-8", "ignore")
+            pedigree_data.seek(0)
+            pedigree_data = content
+        if not isinstance(pedigree_data, str):
+            return 1
+
+        model = getattr(view, 'model', None)
+        if model is None:
+            return 1
+        calcs = list(model['CALCS'])
+        tenyr_ages = request.data.get('tenyr_ages')
+        if isinstance(tenyr_ages, str):
+            calcs = ['ten_year'] * len(re.findall(r"\d+", tenyr_ages))
+        cost = PedigreeCostRateThrottle.get_pedigree_cost(pedigree_data, calcs, len(model['GENES']))
+        logger.debug(f"REQUEST COST ({self.__class__.__name__}): {cost}; USER: {request.user}")
+        return cost
+
+    @classmethod
+    def get_pedigree_cost(cls, pedigree_data, calcs, ngenes):
+        """
+        Estimate the cost of running the calculations for the pedigrees in a pedigree file from the
+        number of people in each family, without parsing the file into pedigrees.
+        @param pedigree_data: pedigree file content
+        @param calcs: list of calculations, e.g. ['carrier_probs', 'remaining_lifetime']
+        @param ngenes: number of genes in the model
+        @return: cost in units of one person in one model run
+        """
+        families = {}
+        for idx, line in enumerate(pedigree_data.splitlines()):
+            if idx == 0 or line.startswith('#') or line.startswith('FamID') or BLANK_LINE.match(line):
+                continue
+            famid = line.split(None, 1)[0]
+            families[famid] = families.get(famid, 0) + 1
+
+        cost = 0
+        for npeople in families.values():
+            for calc in calcs:
+                if calc == 'carrier_probs':
+                    cost += npeople * (ngenes+1)    # pedigree is written out for each target genotype
+                else:
+                    cost += npeople + 1             # risk plus the one person baseline risk
+        return max(cost, 1)
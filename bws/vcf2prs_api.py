@@ -11,6 +11,7 @@ from rest_framework.response import Response
 from rest_framework.schemas import ManualSchema
 from rest_framework.views import APIView
 
+from bws import metrics
 from bws.serializers import FileField
 from bws.throttles import BurstRateThrottle, EndUserIDRateThrottle, SustainedRateThrottle
 import time
@@ -18,8 +19,12 @@ import logging
 import io
 import vcf
 import traceback
-from math import erf, sqrt
+import hashlib
+from functools import lru_cache
+from math import erf, pi, sqrt
+import numpy as np
 from django.conf import settings
+from django.core.cache import cache
 import vcf2prs
 from vcf2prs.prs import Prs
 from vcf2prs.exception import Vcf2PrsError
@@ -29,6 +34,125 @@ from pathlib import Path
 logger = logging.getLogger(__name__)
 
 
+def _erf(x):
+    '''
+    Error function of a numpy array, i.e. math.erf vectorised, from the series
+    erf(x) = 2/sqrt(pi) * exp(-x^2) * sum_n 2^n x^(2n+1) / (1.3.5...(2n+1)), whose terms are all
+    the same sign so it is accurate to double precision. For |x| > 6, erf(x) is +/-1 to double
+    precision.
+    @param x: numpy array
+    @return: numpy array of erf(x)
+    '''
+    x = np.clip(x, -6.0, 6.0)
+    x2 = x * x
+    term = x.copy()
+    total = x.copy()
+    n = 0
+    while np.any(np.abs(term) > 1e-17 * np.abs(total)):
+        n += 1
+        term *= 2.0 * x2 / (2 * n + 1)
+        total += term
+    return 2.0 / sqrt(pi) * np.exp(-x2) * total
+
+
+def _position_key(chrom, pos):
+    ''' Normalised chromosome:position key, e.g. 'chr1', '1' -> '1:1234'. '''
+    chrom = chrom.strip()
+    if chrom[:3].lower() == 'chr':
+        chrom = chrom[3:]
+    return chrom.upper() + ':' + pos.strip()
+
+
+@lru_cache(maxsize=None)
+def get_reference_positions(prs_ref_file):
+    '''
+    Get the variant positions listed in a PRS reference file.
+    @param prs_ref_file: path to the PRS reference file
+    @return: frozenset of chromosome:position keys
+    @raise Vcf2PrsError: if the reference file cannot be read, as by vcf2prs
+    '''
+    positions = set()
+    try:
+        with open(prs_ref_file, 'r') as f:
+            for line in f:
+                parts = line.split(',')
+                if len(parts) > 1 and parts[1].strip().isdigit():
+                    positions.add(_position_key(parts[0], parts[1]))
+    except (OSError, UnicodeDecodeError):
+        raise Vcf2PrsError('Error: Unable to open the file "{0}".'.format(prs_ref_file))
+    return frozenset(positions)
+
+
+@lru_cache(maxsize=1)
+def get_all_reference_positions():
+    ''' Get the union of the variant positions in all the breast and ovarian cancer PRS reference files. '''
+    moduledir = Path(vcf2prs.__file__).parent.parent
+    positions = set()
+    for model in (settings.BC_MODEL, settings.OC_MODEL):
+        for ref_file in model['PRS_REFERENCE_FILES'].values():
+            try:
+                positions.update(get_reference_positions(os.path.join(moduledir, "PRS_files", ref_file)))
+            except Vcf2PrsError:
+                logger.warning("PRS reference file not found: " + ref_file)
+    return frozenset(positions)
+
+
+def get_vcf_index(vcf_file):
+    '''
+    Get an index of the VCF records at the PRS reference positions. The index is built on
+    the first upload of a file and cached keyed by the hash of its content, so that PRS
+    scoring only needs the records at the reference positions.
+    @param vcf_file: VCF file content
+    @return: tuple of the header end offset and a dictionary of chromosome:position keys to
+    a list of (start, end) offsets of the records
+    '''
+    key = "vcf_index_" + hashlib.sha256(vcf_file.encode("utf-8")).hexdigest()
+    vcf_index = cache.get(key)
+    if vcf_index is not None:
+        return vcf_index
+
+    positions = get_all_reference_positions()
+    header_end = 0
+    records = {}
+    start = 0
+    length = len(vcf_file)
+    while start < length:
+        end = vcf_file.find('\n', start)
+        end = length if end == -1 else end+1
+        if vcf_file.startswith('#', start):
+            header_end = end
+        else:
+            tab1 = vcf_file.find('\t', start, end)
+            tab2 = vcf_file.find('\t', tab1+1, end) if tab1 != -1 else -1
+            if tab2 != -1:
+                pkey = _position_key(vcf_file[start:tab1], vcf_file[tab1+1:tab2])
+                if pkey in positions:
+                    records.setdefault(pkey, []).append((start, end))
+        start = end
+    vcf_index = (header_end, records)
+    cache.set(key, vcf_index, settings.VCF_INDEX_CACHE_TIMEOUT)
+    return vcf_index
+
+
+def get_genotypes(vcf_file, prs_ref_file):
+    '''
+    Get a VCF stream restricted to the header and the records at the positions
+    in the PRS reference file.
+    @param vcf_file: VCF file content
+    @param prs_ref_file: path to the PRS reference file
+    @return: VCF stream
+    '''
+    positions = get_reference_positions(prs_ref_file)
+    if len(positions) == 0:         # unrecognised reference file format, use the whole VCF
+        return io.StringIO(vcf_file)
+    header_end, records = get_vcf_index(vcf_file)
+    lines = [vcf_file[:header_end]]
+    for (start, end) in sorted(r for pkey in positions.intersection(records) for r in records[pkey]):
+        line = vcf_file[start:end]
+        lines.append(line if line.endswith('\n') else line+'\n')
+    return io.StringIO(''.join(lines))
+
+
 class Vcf2PrsInputSerializer(serializers.Serializer):
     ''' Vcf2Prs input. '''
     sample_name = serializers.CharField(min_length=1, max_length=40, required=False)
@@ -133,7 +257,6 @@ Variant Call Format (VCF) file to Polygenic Risk Score (PRS) web-service.
         if serializer.is_valid(raise_exception=True):
             validated_data = serializer.validated_data
             vcf_file = validated_data.get("vcf_file")
-            vcf_stream = io.StringIO(vcf_file)
 
             moduledir = Path(vcf2prs.__file__).parent.parent
             bc_prs_ref_file = validated_data.get("bc_prs_reference_file", None)
@@ -150,7 +273,10 @@ Variant Call Format (VCF) file to Polygenic Risk Score (PRS) web-service.
 
             try:
                 if bc_prs_ref_file is not None:
-                    breast_prs = Prs(prs_file=bc_prs_ref_file, geno_file=vcf_stream, sample=sample_name)
+                    with metrics.Timer("parse", "PRS", "prs"):
+                        geno_file = get_genotypes(vcf_file, bc_prs_ref_file)
+                    with metrics.Timer("prs", "PRS", "prs"):
+                        breast_prs = Prs(prs_file=bc_prs_ref_file, geno_file=geno_file, sample=sample_name)
                     bc_alpha = breast_prs.alpha
                     bc_zscore = breast_prs.z_Score
                 else:
@@ -158,7 +284,10 @@ Variant Call Format (VCF) file to Polygenic Risk Score (PRS) web-service.
                     bc_zscore = 0
 
                 if oc_prs_ref_file is not None:
-                    ovarian_prs = Prs(prs_file=oc_prs_ref_file, geno_file=vcf_stream, sample=sample_name)
+                    with metrics.Timer("parse", "PRS", "prs"):
+                        geno_file = get_genotypes(vcf_file, oc_prs_ref_file)
+                    with metrics.Timer("prs", "PRS", "prs"):
+                        ovarian_prs = Prs(prs_file=oc_prs_ref_file, geno_file=geno_file, sample=sample_name)
                     oc_alpha = ovarian_prs.alpha
                     oc_zscore = ovarian_prs.z_Score
                 else:
@@ -170,9 +299,10 @@ Variant Call Format (VCF) file to Polygenic Risk Score (PRS) web-service.
                     'ovarian_cancer_prs': {'alpha': oc_alpha, 'zscore': oc_zscore,
                                            'percent': Zscore2PercentView.get_percentage(oc_zscore)}
                 }
-                prs_serializer = Vcf2PrsOutputSerializer(data)
+                with metrics.Timer("serialise", "PRS", "prs"):
+                    data = Vcf2PrsOutputSerializer(data).data
                 logger.info("PRS elapsed time=" + str(time.time() - start))
-                return Response(prs_serializer.data)
+                return Response(data)
             except Vcf2PrsError as ex:
                 logger.debug(ex)
                 data = {
@@ -195,13 +325,22 @@ Variant Call Format (VCF) file to Polygenic Risk Score (PRS) web-service.
 
 
 class ZscoreInputSerializer(serializers.Serializer):
-    ''' Zscore2Percent input. '''
-    zscore = serializers.FloatField(required=True)
+    ''' Zscore2Percent input, either a single z-score or a list of z-scores. '''
+    zscore = serializers.FloatField(required=False)
+    zscores = serializers.ListField(child=serializers.FloatField(), required=False,
+                                    min_length=1, max_length=settings.MAX_ZSCORES)
+
+    def validate(self, data):
+        if ('zscore' in data) == ('zscores' in data):
+            raise serializers.ValidationError("Provide either a zscore or a list of zscores.")
+        return data
 
 
 class ZscoreOutputSerializer(serializers.Serializer):
     """ PRS represented as a percentage of those with a lower PRS. """
-    percent = serializers.FloatField(min_value=0, max_value=100, read_only=True)
+    percent = serializers.FloatField(min_value=0, max_value=100, read_only=True, required=False)
+    percents = serializers.ListField(child=serializers.FloatField(min_value=0, max_value=100),
+                                     read_only=True, required=False)
 
 
 class Zscore2PercentView(APIView):
@@ -214,14 +353,25 @@ class Zscore2PercentView(APIView):
         schema = ManualSchema(
             fields=[
                 coreapi.Field(
-                    name="sample_name",
-                    required=True,
+                    name="zscore",
+                    required=False,
                     location='form',
                     schema=coreschema.Number(
                         title="z-score",
                         description="Standard normal PRS",
                     ),
                 ),
+                coreapi.Field(
+                    name="zscores",
+                    required=False,
+                    location='form',
+                    schema=coreschema.Array(
+                        items=coreschema.Number(),
+                        title="z-scores",
+                        description="List of standard normal PRS",
+                        min_items=1,
+                    ),
+                ),
             ],
             encoding="application/json",
             description="""
@@ -235,10 +385,14 @@ Returns PRS represented as a percentage of those with a lower PRS.
         ---
         response_serializer: Vcf2PrsOutputSerializer
         parameters:
-           - name: z-score
+           - name: zscore
              description: Standard normal PRS
              type: number
-             required: true
+             required: false
+           - name: zscores
+             description: list of standard normal PRS, percentages are returned in the same order
+             type: array
+             required: false
 
         responseMessages:
            - code: 401
@@ -251,7 +405,11 @@ Returns PRS represented as a percentage of those with a lower PRS.
         """
         serializer = self.serializer_class(data=request.data)
         if serializer.is_valid(raise_exception=True):
-            zscore = serializer.validated_data.get("zscore")
+            validated_data = serializer.validated_data
+            if 'zscores' in validated_data:
+                percents = Zscore2PercentView.get_percentage(validated_data.get("zscores"))
+                return Response(ZscoreOutputSerializer({"percents": percents}).data)
+            zscore = validated_data.get("zscore")
             return Response(ZscoreOutputSerializer({"percent": Zscore2PercentView.get_percentage(zscore)}).data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -261,9 +419,15 @@ Returns PRS represented as a percentage of those with a lower PRS.
         Use error function to compute cumulative standard normal distribution,
         https://docs.python.org/3/library/math.html#math.erf
         (alternative to scipy.stats.norm.cdf(load, mu, sigma) * 100.0) to get
-        percentage representation.
+        percentage representation. A list of PRS is converted in one vectorised operation, see
+        L{_erf}.
         @param: standard normal PRS which is normally distributed in the general population with mean
-        of 0 and standard deviation of 1
-        @return: PRS represented as a percentage of those with a lower PRS
+        of 0 and standard deviation of 1, or a list of these
+        @return: PRS represented as a percentage of those with a lower PRS, or a list of these in
+        the same order as the input
         """
-        return ((1.0 + erf(load / sqrt(2.0))) / 2.0) * 100.0
+        if np.ndim(load) == 0:
+            return ((1.0 + erf(load / sqrt(2.0))) / 2.0) * 100.0
+
+        loads = np.asarray(load, dtype=float)
+        return (((1.0 + _erf(loads / sqrt(2.0))) / 2.0) * 100.0).tolist()
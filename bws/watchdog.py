@@ -0,0 +1,120 @@
+"""
+Watchdog for the model processes on a host. Each model process is started with the
+BWS_MODEL_OWNER environment variable set to the pid of the web-service worker that started it
+(see L{bws.calcs.ModelProcess}), which is inherited by any processes it starts. A model
+process is reported as:
+  - orphaned: the worker that started it has exited, e.g. it was killed while the model ran
+  - overdue:  it has run for longer than FORTRAN_TIMEOUT plus the FORTRAN_KILL_GRACE period
+"""
+import logging
+import os
+import signal
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+OWNER_ENV = "BWS_MODEL_OWNER"
+
+
+class ProcessInfo(object):
+    """ Model process read from /proc. """
+
+    def __init__(self, pid, ppid, pgid, owner, elapsed, cmdline):
+        """
+        @param pid: process id
+        @param ppid: parent process id
+        @param pgid: process group id
+        @param owner: pid of the worker that started the model process
+        @param elapsed: seconds since the process started
+        @param cmdline: command line
+        """
+        self.pid = pid
+        self.ppid = ppid
+        self.pgid = pgid
+        self.owner = owner
+        self.elapsed = elapsed
+        self.cmdline = cmdline
+
+    def is_orphaned(self):
+        """ Return true if the worker that started the model process has exited. """
+        try:
+            os.kill(self.owner, 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass
+        return False
+
+    def is_overdue(self):
+        """ Return true if the model process should have been killed for running too long. """
+        return self.elapsed > settings.FORTRAN_TIMEOUT + settings.FORTRAN_KILL_GRACE
+
+    def __str__(self):
+        return ("pid=%d ppid=%d pgid=%d owner=%d elapsed=%.0fs %s" %
+                (self.pid, self.ppid, self.pgid, self.owner, self.elapsed, " ".join(self.cmdline)))
+
+
+def get_model_processes(proc="/proc"):
+    """
+    Get the model processes on the host that can be read by this user.
+    @keyword proc: proc file system mount point
+    @return: list of L{ProcessInfo}
+    """
+    try:
+        with open(os.path.join(proc, "uptime"), "r") as f:
+            uptime = float(f.read().split()[0])
+    except OSError:
+        return []
+    ticks = os.sysconf("SC_CLK_TCK")
+    marker = (OWNER_ENV + "=").encode("utf-8")
+    processes = []
+    for name in os.listdir(proc):
+        if not name.isdigit():
+            continue
+        path = os.path.join(proc, name)
+        try:
+            with open(os.path.join(path, "environ"), "rb") as f:
+                owner = [int(v[len(marker):]) for v in f.read().split(b"\0") if v.startswith(marker)]
+            if len(owner) == 0:
+                continue
+            with open(os.path.join(path, "stat"), "r") as f:
+                # fields after the command name, which is in brackets and may contain spaces
+                fields = f.read().rsplit(")", 1)[1].split()
+            with open(os.path.join(path, "cmdline"), "rb") as f:
+                cmdline = [a.decode("utf-8", "replace") for a in f.read().split(b"\0") if a]
+        except (OSError, IndexError, ValueError):
+            continue    # exited or not readable by this user
+        if fields[0] == "Z":
+            continue    # exited, waiting to be reaped by its parent
+        processes.append(ProcessInfo(int(name), int(fields[1]), int(fields[2]), owner[0],
+                                     uptime - int(fields[19]) / ticks, cmdline))
+    return processes
+
+
+def get_stray_processes(proc="/proc", log=True):
+    """
+    Get the orphaned and overdue model processes.
+    @keyword proc: proc file system mount point
+    @keyword log: log a warning for each process
+    @return: list of L{ProcessInfo}
+    """
+    strays = [p for p in get_model_processes(proc) if p.is_orphaned() or p.is_overdue()]
+    if log:
+        for p in strays:
+            logger.warning(("ORPHANED" if p.is_orphaned() else "OVERDUE") + " MODEL PROCESS: " + str(p))
+    return strays
+
+
+def kill(processes):
+    """
+    Kill model processes. The processes they started are also model processes, so are killed
+    if they are included.
+    @param processes: list of L{ProcessInfo}
+    """
+    for p in processes:
+        try:
+            os.kill(p.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError) as e:
+            logger.warning("MODEL PROCESS NOT KILLED: " + str(p) + " " + str(e))
@@ -19,7 +19,7 @@ setup(
     description='A Django app for web-services for BOADICEA.',
     long_description=open(os.path.join(ROOT, 'README.rst')).read(),
     install_requires=["requests>=2.26.0", "Django>=3.2.11,<4", "djangorestframework==3.13.1",
-                      "coreapi==2.3.3", "PyVCF==0.6.8"],
+                      "coreapi==2.3.3", "PyVCF==0.6.8", "numpy"],
     classifiers=[
         'Environment :: Web Environment',
         'Framework :: Django',